@@ -0,0 +1,87 @@
+import hashlib
+
+
+def abort(message):
+    """ abort the command """
+
+    print(message)
+    exit()
+
+
+def parse_shard(shard):
+    """ parses a K/N shard specification into a (K, N) tuple, K in 1..N """
+
+    try:
+        index, count = [int(x) for x in str(shard).split('/')]
+    except:
+        abort(f'error: invalid shard {shard}, K/N expected')
+
+    if count < 1 or index < 1 or index > count:
+        abort(f'error: invalid shard {shard}, 1 <= K <= N expected')
+
+    return index, count
+
+
+def stable_hash(value):
+    """ returns a process independent hash of a value """
+
+    digest = hashlib.md5(str(value).strip().encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big')
+
+
+def get_weight(account, weight_key):
+    """ returns the numeric cost of an account, 1 when missing or invalid """
+
+    try:
+        weight = float(account.get(weight_key, 1))
+    except (TypeError, ValueError):
+        weight = 1
+
+    return weight if weight > 0 else 1
+
+
+def shard_by_hash(accounts, index, count):
+    """ keeps the accounts whose account_id hash falls into the shard """
+
+    return [
+        account for account in accounts
+        if stable_hash(account['account_id']) % count == index - 1
+    ]
+
+
+def shard_by_weight(accounts, index, count, weight_key):
+    """ keeps the accounts assigned to the shard by a greedy cost balancing """
+
+    # heaviest first, hash as tie breaker so all workers agree on the order
+    ordered = sorted(
+        enumerate(accounts),
+        key=lambda item: (
+            -get_weight(item[1], weight_key),
+            stable_hash(item[1]['account_id']),
+            item[0]
+        )
+    )
+
+    loads = [0] * count
+    selected = set()
+    for position, account in ordered:
+        shard = loads.index(min(loads))
+        loads[shard] += get_weight(account, weight_key)
+        if shard == index - 1:
+            selected.add(position)
+
+    # preserve the original account list order
+    return [account for position, account in enumerate(accounts) if position in selected]
+
+
+def shard_accounts(accounts, shard=None, weight_key=None):
+    """ returns the subset of accounts for a K/N shard, all accounts if none """
+
+    if not shard:
+        return accounts
+
+    index, count = parse_shard(shard)
+    if weight_key:
+        return shard_by_weight(accounts, index, count, weight_key)
+    else:
+        return shard_by_hash(accounts, index, count)
@@ -0,0 +1,97 @@
+import os
+import subprocess
+import sys
+import time
+
+REPEATS = 10
+GOOGLE_REPEATS = 3
+HEAVY_MODULES = ['yaml', 'requests', 'oauth2client', 'googleapiclient']
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# run a CLI script as __main__ and report which heavy modules it pulled in
+PROBE = """
+import runpy, sys
+sys.argv = {argv!r}
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit:
+    pass
+print(','.join(m for m in {heavy!r} if m in sys.modules), file=sys.stderr)
+"""
+
+
+# build the drive and sheets clients the way StorageGoogleDrive does, without credentials
+GOOGLE_PROBE = """
+from googleapiclient import discovery
+for name, version in [('drive', 'v3'), ('sheets', 'v4')]:
+    discovery.build(name, version, developerKey='benchmark', {options})
+"""
+GOOGLE_DISCOVERY = [
+    ('google clients, bundled discovery', 'static_discovery=True'),
+    ('google clients, fetched discovery', 'static_discovery=False, cache_discovery=False')
+]
+
+
+def time_command(command, repeats=REPEATS):
+    """ returns the (best, mean) wall time in seconds of a command """
+
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        subprocess.run(command, cwd=BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start_time)
+
+    return min(timings), sum(timings) / len(timings)
+
+
+def heavy_modules(argv):
+    """ returns the heavy modules imported while running a CLI command """
+
+    probe = PROBE.format(argv=argv, heavy=HEAVY_MODULES)
+    result = subprocess.run(
+        [sys.executable, '-c', probe],
+        cwd=BASE_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True
+    )
+    lines = result.stderr.strip().splitlines()
+    return lines[-1] if lines else ''
+
+
+def main():
+    commands = [
+        ['insights-cli.py', '--help'],
+        ['insights-cli.py', 'query', '--help'],
+        ['insights-cli.py', 'merge', '--help'],
+        ['maturity-cli.py', '--help']
+    ]
+
+    print(f'{"command":<40} {"best":>8} {"mean":>8}  heavy modules')
+    baseline = time_command([sys.executable, '-c', 'pass'])
+    print(f'{"python -c pass":<40} {baseline[0]:>8.3f} {baseline[1]:>8.3f}')
+
+    for module in HEAVY_MODULES:
+        command = [sys.executable, '-c', f'import {module}']
+        if subprocess.run(command, stderr=subprocess.DEVNULL).returncode:
+            print(f'{"import " + module:<40} {"not installed":>17}')
+            continue
+        best, mean = time_command(command)
+        print(f'{"import " + module:<40} {best:>8.3f} {mean:>8.3f}')
+
+    for argv in commands:
+        best, mean = time_command([sys.executable] + argv)
+        print(f'{" ".join(argv):<40} {best:>8.3f} {mean:>8.3f}  {heavy_modules(argv)}')
+
+    # the fetched discovery needs network access, it is reported unavailable otherwise
+    for label, options in GOOGLE_DISCOVERY:
+        command = [sys.executable, '-c', GOOGLE_PROBE.format(options=options)]
+        if subprocess.run(command, stderr=subprocess.DEVNULL).returncode:
+            print(f'{label:<40} {"unavailable":>17}')
+            continue
+        best, mean = time_command(command, GOOGLE_REPEATS)
+        print(f'{label:<40} {best:>8.3f} {mean:>8.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 SUMMARY_NAME = 'Summary'
 APM_NAME = 'ApmDetails'
 BROWSER_NAME = 'BrowserDetails'
-MOBILE_NAME = 'MobileDetails'
\ No newline at end of file
+MOBILE_NAME = 'MobileDetails'
+RUN_STATS_NAME = 'MaturityRunStats'
@@ -0,0 +1,175 @@
+import hashlib
+import os
+import random
+import tempfile
+import threading
+
+from instrumentation import count, timed
+from rate_limiter import TokenBucket
+
+SCOPES = [
+    'https://www.googleapis.com/auth/drive',
+    'https://www.googleapis.com/auth/spreadsheets'
+]
+DISCOVERY_CACHE_FOLDER = os.path.join(tempfile.gettempdir(), 'newr-google-discovery')
+
+# per user quotas as (requests per second, burst), sheets allows 60 requests per minute per user
+QUOTAS = {
+    'sheets': (1, 60),
+    'drive': (10, 100)
+}
+MAX_RETRIES = 6
+BACKOFF_SECONDS = 2 # first backoff, doubled on every retry
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+RATE_LIMIT_REASONS = [b'rateLimitExceeded', b'userRateLimitExceeded']
+
+__lock = threading.Lock()
+__local = threading.local()
+__credentials = {} # secret file -> credentials, one token shared by every service
+__services = {} # (secret file, name, version) -> service
+__rate_limiters = {} # (secret file, api) -> token bucket shared by every thread
+
+
+def abort(message):
+    """ abort the command """
+
+    print(message)
+    exit()
+
+
+class DiscoveryFileCache():
+    """ discovery documents kept on disk, for client libraries without bundled documents """
+
+    def __init__(self, folder=DISCOVERY_CACHE_FOLDER):
+        """ init """
+
+        self.__folder = folder
+
+    def __get_path(self, url):
+        return os.path.join(self.__folder, hashlib.md5(url.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, url):
+        """ returns the cached document or None """
+
+        try:
+            with open(self.__get_path(url), encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, url, content):
+        """ caches a document, best effort """
+
+        try:
+            os.makedirs(self.__folder, exist_ok=True)
+            with open(self.__get_path(url), 'w', encoding='utf-8') as f:
+                f.write(content)
+        except OSError:
+            pass
+
+
+def get_credentials(secret_file):
+    """ returns the service account credentials of a secret file, loaded once """
+
+    with __lock:
+        if not secret_file in __credentials:
+            from oauth2client.service_account import ServiceAccountCredentials
+
+            if not os.path.exists(secret_file):
+                abort(f'error: cannot find secret file {secret_file}')
+            try:
+                __credentials[secret_file] = \
+                    ServiceAccountCredentials.from_json_keyfile_name(secret_file, SCOPES)
+            except:
+                abort('error: cannot open a connection to Google API')
+
+        return __credentials[secret_file]
+
+
+def build_service(name, version, credentials):
+    """ builds a service from the discovery document bundled with the client library
+
+        client libraries before 2.0 have no bundled documents, they fetch
+        the document once and keep it in a local file cache
+    """
+
+    from googleapiclient import discovery
+
+    try:
+        return discovery.build(name, version, credentials=credentials, static_discovery=True)
+    except TypeError:
+        return discovery.build(name, version, credentials=credentials, cache=DiscoveryFileCache())
+
+
+def get_service(secret_file, name, version):
+    """ returns a service built on first use and shared for the whole process """
+
+    credentials = get_credentials(secret_file)
+    key = (secret_file, name, version)
+    with __lock:
+        if not key in __services:
+            try:
+                __services[key] = build_service(name, version, credentials)
+            except:
+                abort('error: cannot open a connection to Google API')
+
+        return __services[key]
+
+
+def get_http(secret_file):
+    """ returns an authorized http object for the current thread, httplib2 is not thread safe """
+
+    https = getattr(__local, 'https', None)
+    if https is None:
+        https = __local.https = {}
+
+    if not secret_file in https:
+        import httplib2
+        https[secret_file] = get_credentials(secret_file).authorize(httplib2.Http())
+
+    return https[secret_file]
+
+
+def get_rate_limiter(secret_file, api):
+    """ returns the token bucket modelling the per user quota of an api """
+
+    key = (secret_file, api)
+    with __lock:
+        if not key in __rate_limiters:
+            rate, capacity = QUOTAS[api]
+            __rate_limiters[key] = TokenBucket(rate, capacity)
+
+        return __rate_limiters[key]
+
+
+def is_retryable(error):
+    """ True for quota and transient server errors """
+
+    status = int(getattr(error.resp, 'status', 0))
+    if status in RETRY_STATUSES:
+        return True
+
+    content = getattr(error, 'content', b'') or b''
+    return status == 403 and any(reason in content for reason in RATE_LIMIT_REASONS)
+
+
+def execute(request, secret_file, api, max_retries=MAX_RETRIES):
+    """ executes an api request within the user quota, backing off on rate limit errors
+
+        the backoff empties the shared token bucket, so every thread using
+        the same quota slows down, not just the one that was rejected
+    """
+
+    from googleapiclient.errors import HttpError
+
+    rate_limiter = get_rate_limiter(secret_file, api)
+    for attempt in range(max_retries):
+        rate_limiter.acquire()
+        try:
+            with timed('google_clients.execute', api):
+                return request.execute(http=get_http(secret_file))
+        except HttpError as error:
+            if attempt == max_retries - 1 or not is_retryable(error):
+                raise
+            count('google_clients.retries', api)
+            rate_limiter.penalize(BACKOFF_SECONDS * 2 ** attempt * random.uniform(1, 1.5))
@@ -1,59 +1,53 @@
 #!env/bin/python
 
+import json
+import math
+
 SHEET1_SHEET_ID=0
+SHEET1_TITLE='Sheet1'
 SHEET_DEFAULT_COLUMNS=26
 SHEET_DEFAULT_ROWS=1000
+DATE_COLUMN_PREFIX='datetime' # Sheets serial dates, datetime, datetime_compare, ...
+INDEX_SHEET_TITLE='Index'
+INDEX_HEADERS=['dataset', 'spreadsheet', 'sheet', 'rows', 'url']
 
-def cell_snippet(x):
-    ''' create the proper snippet to append data to a sheet depending on the value type '''
+def part_name(name, part):
+    ''' name of a spreadsheet / sheet part, the first part keeps the plain name '''
 
-    if type(x) == str:
-        return {
-            'userEnteredValue': {
-                'stringValue': x
-            }
-        }
-    elif type(x) == bool:
-        return {
-            'userEnteredValue': {
-                'boolValue': x
-            }
-        }
-    elif type(x) == int:
-        return {
-            'userEnteredValue': {
-                'numberValue': x
-            },
-            'userEnteredFormat': {
-                'numberFormat': {
-                    'type': 'NUMBER',
-                    'pattern': '#,##0'
-                }
-            }
-        }
-    elif type(x) == float and x > 40000:  # hack... only floats above 40K are dates
-        return {
-            'userEnteredValue': {
-                'numberValue': x
-            },
-            'userEnteredFormat': {
-                'numberFormat': {
-                    'type': 'DATE'
-                }
-            }
-        }
+    return name if part == 1 else f'{name}_{part}'
+
+
+def value_snippet(x):
+    ''' convert a value to a RAW values API cell, structured values are written as JSON '''
+
+    if x is None:
+        return ''
+    elif type(x) == float and not math.isfinite(x):
+        return str(x)
+    elif type(x) in [str, bool, int, float]:
+        return x
     else:
-        return {
-            'userEnteredValue': {
-                'numberValue': x
-            },
-            'userEnteredFormat': {
-                'numberFormat': {
-                    'type': 'NUMBER',
-                    'pattern': '#,##0.00'
-                }
-            }
-        }
+        return json.dumps(x)
+
+
+def column_number_format(name, value):
+    ''' number format of a column from its name and first value, None for text columns '''
+
+    if type(value) == bool or not type(value) in [int, float]:
+        return None
+    elif name.startswith(DATE_COLUMN_PREFIX):
+        return {'type': 'DATE'}
+    elif type(value) == int:
+        return {'type': 'NUMBER', 'pattern': '#,##0'}
+    else:
+        return {'type': 'NUMBER', 'pattern': '#,##0.00'}
+
+
+def a1_range(sheet_name, cells=None):
+    ''' A1 notation range on a sheet, the sheet name is always quoted '''
+
+    quoted = "'" + sheet_name.replace("'", "''") + "'"
+    return f'{quoted}!{cells}' if cells else quoted
 
 
 def pivot_table_snippet(sheet_id, pivot, headers):
@@ -95,12 +89,21 @@ def pivot_table_snippet(sheet_id, pivot, headers):
     return pivot_table
 
 
-def add_sheet_request(title):
+def add_sheet_request(title, sheet_id=None, row_count=None, column_count=None):
+    properties = {
+        'title': title
+    }
+    if sheet_id is not None:
+        properties['sheetId'] = sheet_id
+    if row_count or column_count:
+        properties['gridProperties'] = {
+            'rowCount': row_count if row_count else SHEET_DEFAULT_ROWS,
+            'columnCount': column_count if column_count else SHEET_DEFAULT_COLUMNS
+        }
+
     return {
         'addSheet': {
-            'properties': {
-                'title': title
-            }
+            'properties': properties
         }
     }
 
@@ -136,12 +139,31 @@ def delete_dimension_request(sheet_id, dimension, start_index=0, end_index=1):
     }
 
 
-def append_cells_request(sheet_id, rows):
+def clear_values_request(sheet_id):
     return {
-        'appendCells': {
-            'sheetId': sheet_id,
-            'rows': rows,
-            'fields': '*',
+        'updateCells': {
+            'range': {
+                'sheetId': sheet_id
+            },
+            'fields': 'userEnteredValue'
+        }
+    }
+
+
+def update_header_request(sheet_id, headers):
+    return {
+        'updateCells': {
+            'rows': [
+                {
+                    'values': [{'userEnteredValue': {'stringValue': str(x)}} for x in headers]
+                }
+            ],
+            'start': {
+                'sheetId': sheet_id,
+                'rowIndex': 0,
+                'columnIndex': 0
+            },
+            'fields': 'userEnteredValue'
         }
     }
 
@@ -166,6 +188,25 @@ def pivot_request(pivot_sheet_id, pivot_table):
     }
 
 
+def number_format_request(sheet_id, column_index, number_format):
+    return {
+        'repeatCell': {
+            'range': {
+                'sheetId': sheet_id,
+                'startRowIndex': 1,
+                'startColumnIndex': column_index,
+                'endColumnIndex': column_index + 1
+            },
+            'cell': {
+                'userEnteredFormat': {
+                    'numberFormat': number_format
+                }
+            },
+            'fields': 'userEnteredFormat.numberFormat'
+        }
+    }
+
+
 def basic_filter_request(sheet_id):
     return {
         'setBasicFilter': {
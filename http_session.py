@@ -0,0 +1,16 @@
+import threading
+
+import requests
+
+__local = threading.local()
+
+
+def get_session():
+    """ returns a requests session kept alive per thread, so connections are reused across calls """
+
+    session = getattr(__local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        __local.session = session
+
+    return session
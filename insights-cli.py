@@ -1,14 +1,18 @@
 import csv
+import itertools
 import json
 import os
 import sys
-import yaml
+import tempfile
+import time
 
+# yaml, requests and the google api client are slow to import, so they are
+# imported by the commands that actually need them
+from account_sharding import shard_accounts
 from insights_cli_argparser import get_cmdline_args
-from newrelic_query_api import NewRelicQueryAPI
-from storage_local import StorageLocal
-from storage_google_drive import StorageGoogleDrive
-from storage_newrelic_insights import StorageNewRelicInsights
+from storage_local import StorageLocal, merge_run_folders
+from storage_buffer import StorageBuffer
+from storage_pipeline import StoragePipeline, close_storages
 
 
 def abort(message):
@@ -73,6 +77,8 @@ def get_vault(vault_file):
 def get_queries(query_file):
     """ returns a list of queries from an YAML file """
 
+    import yaml
+
     _, ext = os.path.splitext(query_file)
     if ext.lower() not in ['.yml', '.yaml']:
         abort('error: YAML query file expected')
@@ -105,9 +111,24 @@ def validate_input(subject, data, keys):
     return len_data
 
 
+class FetchError(Exception):
+    """ an error raised while fetching or flattening the events """
+
+
+def iter_fetched(events):
+    """ yields the events, telling their errors apart from the write errors """
+
+    try:
+        yield from events
+    except Exception as error:
+        raise FetchError(error) from error
+
+
 def do_query(**args):
     """ query command """
 
+    from newrelic_query_api import NewRelicQueryAPI
+
     query = args['query']
     account_id = args['account_id']
     query_api_key = args['query_api_key']
@@ -134,27 +155,85 @@ def do_query(**args):
         nrql = query
 
     api = NewRelicQueryAPI(account_id, query_api_key)
-    events = api.events(nrql, include={'account_id': account_id})
+    events = iter_fetched(api.iter_events(nrql, include={'account_id': account_id}))
 
-    if not len(events):
+    try:
+        first = next(events, None)
+    except FetchError as error:
+        abort(f'error: cannot fetch the events, {error}')
+    if first is None:
         abort('error: empty events list returned')
+    events = itertools.chain([first], events)
+
+    writers = {
+        'json': write_json,
+        'json-compact': write_json_compact,
+        'ndjson': write_ndjson,
+        'csv': write_csv
+    }
 
+    # stdout is left open for the error message
+    f = open_file(output_file, 'w')
     try:
-        with open_file(output_file, 'w') as f:
-            if output_format == 'json':
-                json.dump(events, f, sort_keys=True, indent=4)
-            else:
-                csv_writer = csv.DictWriter(f, fieldnames=events[0].keys())
-                csv_writer.writeheader()
-                for event in events:
-                    csv_writer.writerow(event)
+        writers[output_format](events, f)
+    except FetchError as error:
+        abort(f'error: cannot fetch the events, {error}')
     except:
         abort(f'error: cannot write to {output_file}')
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+def write_json(events, f):
+    """ pretty printed JSON array, needs the whole list in memory """
+
+    json.dump(list(events), f, sort_keys=True, indent=4)
+
+
+def write_json_compact(events, f):
+    """ compact JSON array streamed one event at a time """
+
+    f.write('[')
+    for index, event in enumerate(events):
+        if index:
+            f.write(',')
+        f.write(json.dumps(event, separators=(',', ':')))
+    f.write(']\n')
+
+
+def write_ndjson(events, f):
+    """ one compact JSON event per line, streamed """
+
+    for event in events:
+        f.write(json.dumps(event, separators=(',', ':')))
+        f.write('\n')
 
 
-def export_events(storage, vault_file, query_file, accounts):
+def write_csv(events, f):
+    """ CSV with the union of all columns, events are spooled to disk meanwhile """
 
-    vault = get_vault(vault_file) if vault_file else {}
+    columns = {}
+    with tempfile.TemporaryFile('w+') as spool:
+        for event in events:
+            columns.update(dict.fromkeys(event.keys()))
+            spool.write(json.dumps(event, separators=(',', ':')))
+            spool.write('\n')
+
+        spool.seek(0)
+        csv_writer = csv.DictWriter(f, fieldnames=list(columns.keys()), restval='')
+        csv_writer.writeheader()
+        for line in spool:
+            csv_writer.writerow(json.loads(line))
+
+
+def export_events(storages, vault_file, query_file, accounts, progress=None, stagger_seconds=0, query_rate=0):
+
+    from newrelic_query_api import NewRelicQueryAPIPool
+
+    # one client per account / key for the whole run, vault secrets share theirs
+    clients = NewRelicQueryAPIPool(query_rate if query_rate else 0)
+    vault = clients.get_vault(get_vault(vault_file)) if vault_file else {}
 
     queries = get_queries(query_file)
     len_queries = validate_input('queries', queries, ['name', 'nrql'])
@@ -163,36 +242,52 @@ def export_events(storage, vault_file, query_file, accounts):
     len_accounts = validate_input('accounts', accounts, metadata_keys)
     metadata_keys.remove('query_api_key')
 
-    for idx_account, account in enumerate(accounts):
+    # storage writes are coalesced across accounts and run on their own
+    # threads, overlapping the queries
+    pipeline = StoragePipeline([StorageBuffer(storage) for storage in storages])
+
+    try:
+        for idx_account, account in enumerate(accounts):
+
+            # spread the accounts over time to smooth the load on the APIs
+            if idx_account and stagger_seconds:
+                time.sleep(stagger_seconds)
+
+            master_name = account['master_name']
+            account_name = account['account_name']
 
-        master_name = account['master_name']
-        account_name = account['account_name']
+            metadata = {k:v for k,v in account.items() if k in metadata_keys}
 
-        metadata = {k:v for k,v in account.items() if k in metadata_keys}
+            for idx_query, query in enumerate(queries):
 
-        for idx_query, query in enumerate(queries):
+                name = query['name']
+                nrql = query['nrql']
+                secret = query.get('secret', None)
 
-            name = query['name']
-            nrql = query['nrql']
-            secret = query.get('secret', None)
+                if secret:
+                    if not secret in vault:
+                        abort(f'error: cannot find {secret} in vault')
+                    api = vault[secret]
+                else:
+                    api = clients.get(account['account_id'], account['query_api_key'])
 
-            if secret:
-                if not secret in vault:
-                    abort(f'error: cannot find {secret} in vault')
-                account_id = vault[secret]['account_id']
-                query_api_key = vault[secret]['query_api_key']
-            else:
-                account_id = account['account_id']
-                query_api_key = account['query_api_key']
+                log('account {}/{}: {} - {}, query {}/{}: {}'.format(
+                    idx_account+1, len_accounts, account['account_id'], account_name,
+                    idx_query+1, len_queries, name)
+                )
+                if progress:
+                    progress(
+                        accounts_done=idx_account, accounts_total=len_accounts,
+                        queries_done=idx_query, queries_total=len_queries,
+                        account=account_name, query=name
+                    )
 
-            log('account {}/{}: {} - {}, query {}/{}: {}'.format(
-                idx_account+1, len_accounts, account_id, account_name,
-                idx_query+1, len_queries, name)
-            )
+                events = api.events(nrql, params=metadata)
+                pipeline.dump_data(master_name, query['name'], events, metadata)
 
-            api = NewRelicQueryAPI(account_id, query_api_key)
-            events = api.events(query['nrql'], include=metadata, params=metadata)
-            storage.dump_data(master_name, query['name'], events)
+    finally:
+        # drain all pending writes before wrapping up
+        pipeline.close()
 
 
 def do_batch_local(**args):
@@ -203,14 +298,26 @@ def do_batch_local(**args):
     account_file = args['account_file']
     output_folder = args['output_folder']
 
-    storage = StorageLocal(account_file, output_folder)
-    accounts = storage.get_accounts()
+    storage = StorageLocal(
+        account_file, output_folder,
+        output_format=args.get('output_format', 'csv'),
+        max_open_files=args.get('max_open_files', StorageLocal.MAX_OPEN_FILES)
+    )
+    accounts = shard_accounts(storage.get_accounts(), args['shard'], args['shard_weight'])
 
-    export_events(storage, vault_file, query_file, accounts)
+    try:
+        export_events(
+            [storage], vault_file, query_file, accounts,
+            args.get('progress'), args.get('stagger_seconds', 0), args.get('query_rate', 0)
+        )
+    finally:
+        storage.close()
 
 
 def do_batch_google(**args):
-    """ batch-local command """
+    """ batch-google command """
+
+    from storage_google_drive import StorageGoogleDrive
 
     vault_file = args['vault_file']
     query_file = args['query_file']
@@ -218,28 +325,221 @@ def do_batch_google(**args):
     output_folder_id = args['output_folder_id']
     secret_file = args['secret_file']
 
-    storage = StorageGoogleDrive(account_file_id, output_folder_id, secret_file)
-    accounts = storage.get_accounts()
+    storage = StorageGoogleDrive(
+        account_file_id, output_folder_id, secret_file,
+        concurrency=args.get('google_concurrency', StorageGoogleDrive.CONCURRENCY)
+    )
+    accounts = shard_accounts(storage.get_accounts(), args['shard'], args['shard_weight'])
 
-    export_events(storage, vault_file, query_file, accounts)
+    try:
+        export_events(
+            [storage], vault_file, query_file, accounts,
+            args.get('progress'), args.get('stagger_seconds', 0), args.get('query_rate', 0)
+        )
 
-    # add some nice formatting to all Google Sheets
-    storage.format_data()
+        # add some nice formatting to all Google Sheets
+        storage.format_data()
+    finally:
+        storage.close()
 
 
 def do_batch_insights(**args):
     """ batch-insights command """
 
+    from storage_newrelic_insights import StorageNewRelicInsights
+
     vault_file = args['vault_file']
     query_file = args['query_file']
     account_file = args['account_file']
     insert_account_id = args['insert_account_id']
     insert_api_key = args['insert_api_key']
 
-    storage = StorageNewRelicInsights(account_file, insert_account_id, insert_api_key)
-    accounts = storage.get_accounts()
+    storage = StorageNewRelicInsights(
+        account_file, insert_account_id, insert_api_key,
+        concurrency=args.get('insert_concurrency', StorageNewRelicInsights.CONCURRENCY),
+        spool_folder=args.get('spool_folder')
+    )
+    accounts = shard_accounts(storage.get_accounts(), args['shard'], args['shard_weight'])
+
+    try:
+        export_events(
+            [storage], vault_file, query_file, accounts,
+            args.get('progress'), args.get('stagger_seconds', 0), args.get('query_rate', 0)
+        )
+    finally:
+        # wait for the inserts still in flight, failed ones are spooled
+        storage.close()
+
+
+def do_batch(**args):
+    """ batch command, one query pass fanned out to every selected storage """
+
+    vault_file = args['vault_file']
+    query_file = args['query_file']
+    account_file = args.get('account_file')
+    account_file_id = args.get('account_file_id')
+    output_folder = args.get('output_folder')
+    output_folder_id = args.get('output_folder_id')
+    secret_file = args.get('secret_file')
+    insert_account_id = args.get('insert_account_id')
+    insert_api_key = args.get('insert_api_key')
+    database_file = args.get('database_file')
+
+    if bool(account_file) == bool(account_file_id):
+        abort('error: one and only one input list can be set (local or google)')
+
+    if not (output_folder or output_folder_id or insert_api_key or database_file):
+        abort('error: at least one output (local, google, insights or sqlite) must be set')
+
+    if not secret_file and (output_folder_id or account_file_id):
+        abort('error: found a google input or output without a google secret file')
+
+    if bool(insert_api_key) ^ bool(insert_account_id):
+        abort('error: both a new relic insights key and account id must be set')
+
+    if output_folder_id or account_file_id:
+        from storage_google_drive import StorageGoogleDrive
+        google_storage = StorageGoogleDrive(
+            account_file_id, output_folder_id, secret_file,
+            concurrency=args.get('google_concurrency', StorageGoogleDrive.CONCURRENCY)
+        )
+
+    if insert_api_key:
+        from storage_newrelic_insights import StorageNewRelicInsights
+        insights_storage = StorageNewRelicInsights(
+            account_file, insert_account_id, insert_api_key,
+            concurrency=args.get('insert_concurrency', StorageNewRelicInsights.CONCURRENCY),
+            spool_folder=args.get('spool_folder')
+        )
+
+    if database_file:
+        from storage_sqlite import StorageSQLite
+        sqlite_storage = StorageSQLite(account_file, database_file)
+
+    if account_file or output_folder:
+        # the local storage also reads the local account list, with or without a local output
+        local_storage = StorageLocal(
+            account_file, output_folder or '',
+            output_format=args.get('output_format', 'csv'),
+            max_open_files=args.get('max_open_files', StorageLocal.MAX_OPEN_FILES)
+        )
+
+    if account_file:
+        accounts = local_storage.get_accounts()
+    else:
+        accounts = google_storage.get_accounts()
+    accounts = shard_accounts(accounts, args['shard'], args['shard_weight'])
+
+    storages = [
+        local_storage if output_folder else None,
+        google_storage if output_folder_id else None,
+        insights_storage if insert_api_key else None,
+        sqlite_storage if database_file else None
+    ]
+    try:
+        export_events(
+            [storage for storage in storages if storage], vault_file, query_file, accounts,
+            args.get('progress'), args.get('stagger_seconds', 0), args.get('query_rate', 0)
+        )
+
+        if output_folder_id:
+            # add some nice formatting to all Google Sheets
+            google_storage.format_data()
+    finally:
+        # even after an error, files are completed and pending events sent or spooled
+        close_storages(storages)
+
+
+def do_merge(**args):
+    """ merge command """
+
+    input_folders = args['input_folders']
+    output_folder = args['output_folder']
+
+    for input_folder in input_folders:
+        if not os.path.isdir(input_folder):
+            abort(f'error: cannot find folder {input_folder}')
+
+    for name in merge_run_folders(input_folders, output_folder):
+        log(f'merged {name}')
+
+
+def do_replay(**args):
+    """ replay command """
+
+    from insights_spool import InsightsSpool, iter_segment
+    from storage_newrelic_insights import StorageNewRelicInsights
+
+    spool_folder = args['spool_folder']
+    insert_account_id = args['insert_account_id']
+    insert_api_key = args['insert_api_key']
+
+    if not os.path.isdir(spool_folder):
+        abort(f'error: cannot find folder {spool_folder}')
+
+    # only the segments found now are replayed, events failing again are
+    # spooled to new segments by the storage
+    segments = InsightsSpool(spool_folder).get_segments()
+    if not segments:
+        log('nothing to replay')
+        return
+
+    storage = StorageNewRelicInsights(
+        None, insert_account_id, insert_api_key,
+        concurrency=args.get('insert_concurrency', StorageNewRelicInsights.CONCURRENCY),
+        spool_folder=spool_folder
+    )
+    for segment in segments:
+        storage.dump_encoded(iter_segment(segment))
+        storage.flush()
+        os.remove(segment)
+        log(f'replayed {segment}')
+    storage.close()
+
+
+def do_daemon(**args):
+    """ daemon command """
+
+    from service_scheduler import Job, Scheduler
+
+    schedule_file = args['schedule_file']
+    status_port = args['status_port']
+
+    with open_file(schedule_file) as f:
+        try:
+            schedule = json.load(f)
+        except:
+            abort('error: cannot parse JSON schedule file')
+
+    jobs = []
+    for definition in schedule.get('jobs', []):
+        name = definition.get('name', definition.get('command', ''))
+        command = definition.get('command', '')
+        if not command in DAEMON_COMMANDS:
+            abort(f'error: unsupported daemon command {command}')
+
+        # same arguments as the command line, optional ones default to None
+        job_args = {'vault_file': None, 'shard': None, 'shard_weight': None}
+        job_args.update(definition.get('args', {}))
+
+        def target(progress, command=DAEMON_COMMANDS[command], job_args=job_args):
+            command(progress=progress, **job_args)
+
+        jobs.append(Job(name, definition.get('cron', '@daily'), target))
+
+    if not jobs:
+        abort('error: no jobs found in the schedule file')
+
+    Scheduler(jobs).run_forever(status_port or schedule.get('status_port', 0))
+
 
-    export_events(storage, vault_file, query_file, accounts)
+DAEMON_COMMANDS = {
+    'batch': do_batch,
+    'batch-local': do_batch_local,
+    'batch-google': do_batch_google,
+    'batch-insights': do_batch_insights,
+    'replay': do_replay
+}
 
 if __name__ == "__main__":
     args, error = get_cmdline_args()
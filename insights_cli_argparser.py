@@ -9,6 +9,10 @@ def get_cmdline_args():
     prepare_batch_local_parser(subparsers)
     prepare_batch_google_parser(subparsers)
     prepare_batch_insights_parser(subparsers)
+    prepare_batch_parser(subparsers)
+    prepare_merge_parser(subparsers)
+    prepare_replay_parser(subparsers)
+    prepare_daemon_parser(subparsers)
 
     args = parser.parse_args()
     error = parser.print_help if args.command == None else None
@@ -30,8 +34,8 @@ def prepare_query_parser(subparsers):
         help='output file name'
     )
     query_parser.add_argument('-f', '--output-format',
-        help='output type',
-        choices=['json', 'csv'],
+        help='output type, all but json are streamed',
+        choices=['json', 'json-compact', 'ndjson', 'csv'],
         default='json'
     )
     query_parser.add_argument('-q', '--query',
@@ -57,6 +61,9 @@ def prepare_batch_local_parser(subparsers):
         help='Local output folder name',
         required=True
     )
+    add_local_output_arguments(batch_local_parser)
+    add_query_rate_argument(batch_local_parser)
+    add_shard_arguments(batch_local_parser)
 
 
 def prepare_batch_google_parser(subparsers):
@@ -81,6 +88,9 @@ def prepare_batch_google_parser(subparsers):
         help='Google secret file location',
         required=True
     )
+    add_google_concurrency_argument(batch_google_parser)
+    add_query_rate_argument(batch_google_parser)
+    add_shard_arguments(batch_google_parser)
 
 
 def prepare_batch_insights_parser(subparsers):
@@ -104,4 +114,143 @@ def prepare_batch_insights_parser(subparsers):
     batch_insights_parser.add_argument('-k', '--insert-api-key',
         help='New Relic Insights insert API key',
         required=True
-    )
\ No newline at end of file
+    )
+    add_insert_arguments(batch_insights_parser)
+    add_query_rate_argument(batch_insights_parser)
+    add_shard_arguments(batch_insights_parser)
+
+
+def prepare_batch_parser(subparsers):
+    batch_parser = subparsers.add_parser('batch')
+    batch_parser.set_defaults(command='do_batch')
+    batch_parser.add_argument('-v', '--vault-file',
+        help='Local CSV vault file [secret,account_id,query_api_key]',
+    )
+    batch_parser.add_argument('-q', '--query-file',
+        help='Local YAML input queries [{"name": "name", "nrql": "query"},...]',
+        required=True
+    )
+    batch_parser.add_argument('-a', '--account-file',
+        help='Local CSV input accounts [master_name,account_id,account_name,query_api_key]'
+    )
+    batch_parser.add_argument('-A', '--account-file-id',
+        help='Google Sheets input accounts [master_name,account_id,account_name,query_api_key]'
+    )
+    batch_parser.add_argument('-o', '--output-folder',
+        help='Local output folder name'
+    )
+    add_local_output_arguments(batch_parser)
+    batch_parser.add_argument('-O', '--output-folder-id',
+        help='Google Drive output folder id'
+    )
+    batch_parser.add_argument('-s', '--secret-file',
+        help='Google secret file location'
+    )
+    add_google_concurrency_argument(batch_parser)
+    batch_parser.add_argument('-i', '--insert-account-id',
+        help='New Relic Insights insert account id'
+    )
+    batch_parser.add_argument('-k', '--insert-api-key',
+        help='New Relic Insights insert API key'
+    )
+    add_insert_arguments(batch_parser)
+    batch_parser.add_argument('-d', '--database-file',
+        help='Local SQLite output database file, one table per query'
+    )
+    add_query_rate_argument(batch_parser)
+    add_shard_arguments(batch_parser)
+
+
+def add_local_output_arguments(parser):
+    parser.add_argument('-f', '--output-format',
+        help='Local output file format',
+        choices=['csv', 'csv.gz', 'csv.zst', 'parquet', 'arrow'],
+        default='csv'
+    )
+    parser.add_argument('--max-open-files',
+        help='max number of local output files kept open at once',
+        type=int,
+        default=256
+    )
+
+
+def add_insert_arguments(parser, spool=True):
+    parser.add_argument('--insert-concurrency',
+        help='max number of in-flight New Relic Insights insert requests',
+        type=int,
+        default=4
+    )
+    if spool:
+        parser.add_argument('--spool-folder',
+            help='Local folder where failed New Relic Insights inserts are kept for the replay command'
+        )
+
+
+def add_google_concurrency_argument(parser):
+    parser.add_argument('--google-concurrency',
+        help='max number of Google spreadsheets written at the same time',
+        type=int,
+        default=4
+    )
+
+
+def add_query_rate_argument(parser):
+    parser.add_argument('--query-rate',
+        help='max queries per second per query API key, unlimited by default',
+        type=float,
+        default=0
+    )
+
+
+def add_shard_arguments(parser):
+    parser.add_argument('--shard',
+        help='process only the K/N shard of the accounts list (K in 1..N)'
+    )
+    parser.add_argument('--shard-weight',
+        help='accounts column with the cost used to balance shards instead of hashing account_id'
+    )
+
+
+def prepare_merge_parser(subparsers):
+    merge_parser = subparsers.add_parser('merge')
+    merge_parser.set_defaults(command='do_merge')
+    merge_parser.add_argument('-i', '--input-folders',
+        help='Local per-shard run folders to be merged',
+        nargs='+',
+        required=True
+    )
+    merge_parser.add_argument('-o', '--output-folder',
+        help='Local merged run folder name',
+        required=True
+    )
+
+
+def prepare_replay_parser(subparsers):
+    replay_parser = subparsers.add_parser('replay')
+    replay_parser.set_defaults(command='do_replay')
+    replay_parser.add_argument('-s', '--spool-folder',
+        help='Local folder of failed New Relic Insights inserts',
+        required=True
+    )
+    replay_parser.add_argument('-i', '--insert-account-id',
+        help='New Relic Insights insert account id',
+        required=True
+    )
+    replay_parser.add_argument('-k', '--insert-api-key',
+        help='New Relic Insights insert API key',
+        required=True
+    )
+    add_insert_arguments(replay_parser, spool=False)
+
+
+def prepare_daemon_parser(subparsers):
+    daemon_parser = subparsers.add_parser('daemon')
+    daemon_parser.set_defaults(command='do_daemon')
+    daemon_parser.add_argument('-s', '--schedule-file',
+        help='Local JSON schedule {"status_port": port, "jobs": [{"name": "name", "cron": "0 3 * * *", "command": "batch-local", "args": {...}},...]}',
+        required=True
+    )
+    daemon_parser.add_argument('-p', '--status-port',
+        help='local port of the daemon JSON status endpoint',
+        type=int
+    )
@@ -0,0 +1,78 @@
+import glob
+import os
+import threading
+import time
+
+
+class InsightsSpool():
+    """ append-only on-disk spool of Insights events that could not be inserted
+
+        events are kept JSON encoded, one per line, in segment files named
+        after their creation time so they replay in order; a segment is
+        rotated once it reaches max_segment_bytes and every append is
+        flushed to disk before returning, so a crash loses nothing that was
+        reported as spooled
+    """
+
+    EXTENSION = '.ndjson'
+    MAX_SEGMENT_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, spool_folder, max_segment_bytes=MAX_SEGMENT_BYTES):
+        """ init """
+
+        self.__spool_folder = spool_folder
+        self.__max_segment_bytes = max_segment_bytes
+        self.__lock = threading.Lock()
+        self.__segment = None # current segment file, opened on the first append
+        self.__sequence = 0
+
+        os.makedirs(spool_folder, exist_ok=True)
+
+    def __open_segment(self):
+        """ opens a new segment file, names never collide across processes """
+
+        self.__sequence += 1
+        name = '{:013d}-{}-{:04d}{}'.format(
+            int(time.time() * 1000), os.getpid(), self.__sequence, InsightsSpool.EXTENSION
+        )
+        return open(os.path.join(self.__spool_folder, name), 'a', encoding='utf-8')
+
+    def append(self, events):
+        """ appends a list of JSON encoded events to the current segment """
+
+        if not events:
+            return
+
+        with self.__lock:
+            if self.__segment and self.__segment.tell() >= self.__max_segment_bytes:
+                self.__segment.close()
+                self.__segment = None
+            if not self.__segment:
+                self.__segment = self.__open_segment()
+
+            self.__segment.write('\n'.join(events) + '\n')
+            self.__segment.flush()
+            os.fsync(self.__segment.fileno())
+
+    def get_segments(self):
+        """ returns the segment files in the spool folder, oldest first """
+
+        return sorted(glob.glob(os.path.join(self.__spool_folder, '*' + InsightsSpool.EXTENSION)))
+
+    def close(self):
+        """ closes the current segment """
+
+        with self.__lock:
+            if self.__segment:
+                self.__segment.close()
+                self.__segment = None
+
+
+def iter_segment(segment):
+    """ yields the JSON encoded events of a segment file """
+
+    with open(segment, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
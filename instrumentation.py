@@ -0,0 +1,179 @@
+import contextlib
+import functools
+import inspect
+import random
+import threading
+import time
+
+MAX_SAMPLES = 1024 # latency samples kept per (function, label), a uniform reservoir
+PERCENTILES = [50, 95, 99]
+
+__lock = threading.Lock()
+__timers = {} # (function, label) -> timer statistics
+__counters = {} # (function, label) -> count
+
+
+def __record(name, label, wall, cpu, failed=False):
+    """ adds one call to the statistics of (name, label) """
+
+    with __lock:
+        stats = __timers.get((name, label))
+        if stats is None:
+            stats = __timers[(name, label)] = {
+                'count': 0, 'errors': 0, 'wall': 0.0, 'cpu': 0.0, 'max': 0.0, 'samples': []
+            }
+        stats['count'] += 1
+        stats['errors'] += 1 if failed else 0
+        stats['wall'] += wall
+        stats['cpu'] += cpu
+        stats['max'] = max(stats['max'], wall)
+
+        # reservoir sampling, every call has the same chance to be kept
+        samples = stats['samples']
+        if len(samples) < MAX_SAMPLES:
+            samples.append(wall)
+        else:
+            index = random.randrange(stats['count'])
+            if index < MAX_SAMPLES:
+                samples[index] = wall
+
+
+def percentile(samples, p):
+    """ nearest rank percentile of sorted samples """
+
+    if not samples:
+        return 0.0
+    rank = max(1, -(-len(samples) * p // 100))
+    return samples[int(rank) - 1]
+
+
+@contextlib.contextmanager
+def timed(name, label=''):
+    """ times the wall and cpu time of the block, the cpu time of the current thread only """
+
+    start_wall, start_cpu = time.perf_counter(), time.thread_time()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        __record(name, label, time.perf_counter() - start_wall, time.thread_time() - start_cpu, failed)
+
+
+def timed_iter(name, label, iterable):
+    """ yields from the iterable, timing only the time spent producing the items as one call """
+
+    iterator = iter(iterable)
+    wall, cpu = 0.0, 0.0
+    failed = False
+    try:
+        while True:
+            start_wall, start_cpu = time.perf_counter(), time.thread_time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                wall += time.perf_counter() - start_wall
+                cpu += time.thread_time() - start_cpu
+            yield item
+    finally:
+        __record(name, label, wall, cpu, failed)
+
+
+def count(name, label='', value=1):
+    """ adds value to the counter of (name, label) """
+
+    with __lock:
+        __counters[(name, label)] = __counters.get((name, label), 0) + value
+
+
+def timer(name=None, label=None, label_arg=None):
+    """ decorator timing every call of a function, like decorators_samples.timer but recorded
+
+        the statistics are keyed by name, the module and qualified name of
+        the function by default, and by a label that is either a string, a
+        callable receiving the call arguments, or the value of the argument
+        named label_arg; generator functions are timed over their whole
+        iteration
+    """
+
+    def decorator(func):
+        _name = name if name else f'{func.__module__}.{func.__qualname__}'
+        signature = inspect.signature(func) if label_arg else None
+
+        def get_label(args, kwargs):
+            if label_arg:
+                return str(signature.bind_partial(*args, **kwargs).arguments.get(label_arg, ''))
+            elif callable(label):
+                return str(label(*args, **kwargs))
+            else:
+                return label if label else ''
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def wrapper_timer(*args, **kwargs):
+                return (yield from timed_iter(_name, get_label(args, kwargs), func(*args, **kwargs)))
+        else:
+            @functools.wraps(func)
+            def wrapper_timer(*args, **kwargs):
+                with timed(_name, get_label(args, kwargs)):
+                    return func(*args, **kwargs)
+
+        return wrapper_timer
+
+    return decorator
+
+
+def reset():
+    """ drops every statistic, a resident process starts each run from zero """
+
+    with __lock:
+        __timers.clear()
+        __counters.clear()
+
+
+def get_report():
+    """ returns the statistics as a list of row dictionaries, timers then counters """
+
+    with __lock:
+        timers = [(k, dict(v, samples=sorted(v['samples']))) for k,v in __timers.items()]
+        counters = list(__counters.items())
+
+    report = []
+    for (name, label), stats in sorted(timers):
+        row = {
+            'kind': 'timer',
+            'function': name,
+            'label': label,
+            'count': stats['count'],
+            'errors': stats['errors'],
+            'wall_seconds': round(stats['wall'], 6),
+            'cpu_seconds': round(stats['cpu'], 6)
+        }
+        for p in PERCENTILES:
+            row[f'p{p}_ms'] = round(percentile(stats['samples'], p) * 1000, 3)
+        row['max_ms'] = round(stats['max'] * 1000, 3)
+        report.append(row)
+
+    for (name, label), value in sorted(counters):
+        report.append({'kind': 'counter', 'function': name, 'label': label, 'count': value})
+
+    return report
+
+
+def dump_report(storages, master, output_file, constants={}):
+    """ writes the report through the storages, like any other dataset """
+
+    report = get_report()
+    if report:
+        for storage in storages:
+            if storage:
+                storage.dump_data(master, output_file, report, constants)
+
+    return report
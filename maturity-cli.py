@@ -4,13 +4,17 @@ import os
 
 from global_constants import *
 
-from newrelic_account_metrics import NewRelicAccountMetrics
+from account_sharding import shard_accounts
+from maturity_cli_argparser import get_cmdline_args
 
-from storage_newrelic_insights import StorageNewRelicInsights
-from storage_google_drive import StorageGoogleDrive
 from storage_local import StorageLocal
+from storage_buffer import StorageBuffer
+from storage_pipeline import StoragePipeline, close_storages
+from pivot_engine import StoragePivot
+import instrumentation
 
 CONFIG_FILE = 'config.json'
+DAEMON_SCHEDULE = '0 2 * * *' # every day at 2am
 
 
 def to_datetime(timestamp):
@@ -29,27 +33,44 @@ def abort(message):
     exit()
 
 
-def get_config():
+def get_config(config_file=CONFIG_FILE, shard=None, shard_weight=None, output_format=None):
     """ read the config settings """
 
-    if not os.path.exists(CONFIG_FILE):
-        abort('error: config.json not found')
+    if not os.path.exists(config_file):
+        abort(f'error: {config_file} not found')
 
-    config = json.load(open(CONFIG_FILE, 'r'))
+    config = json.load(open(config_file, 'r'))
     output_folder = config.get('output_folder', '')
     account_file = config.get('account_file', '')
+    output_format = output_format if output_format else config.get('output_format', 'csv')
+    max_open_files = config.get('max_open_files', StorageLocal.MAX_OPEN_FILES)
     output_folder_id = config.get('output_folder_id', '')
+    database_file = config.get('database_file', '')
     account_file_id = config.get('account_file_id', '')
     account_sheet = config.get('account_sheet', 'Sheet1')
     secret_file = config.get('secret_file', '')
+    google_concurrency = config.get('google_concurrency', 4)
     insert_api_key = config.get('insert_api_key', '')
     insert_account_id = config.get('insert_account_id', '')
+    insert_concurrency = config.get('insert_concurrency', 4)
+    spool_folder = config.get('spool_folder', '')
     pivots = config.get('pivots', {})
+    pivot_mode = config.get('pivot_mode', 'local')
+    run_stats = config.get('run_stats', True)
+    buffer_rows = config.get('buffer_rows', StorageBuffer.MAX_ROWS)
+    buffer_bytes = config.get('buffer_bytes', StorageBuffer.MAX_BYTES)
+    buffer_seconds = config.get('buffer_seconds', StorageBuffer.MAX_SECONDS)
+    shard = shard if shard else config.get('shard', '')
+    shard_weight = shard_weight if shard_weight else config.get('shard_weight', '')
+    schedule = config.get('schedule', DAEMON_SCHEDULE)
+    status_port = config.get('status_port', 0)
+    stagger_seconds = config.get('stagger_seconds', 0)
     input_local = bool(account_file)
     input_google = bool(account_file_id)
     output_local = bool(output_folder)
     output_google = bool(output_folder_id)
     output_insights = bool(insert_api_key)
+    output_sqlite = bool(database_file)
 
     if input_local and input_google:
         abort('error: one and only one input list can be set (local or google)')
@@ -63,46 +84,64 @@ def get_config():
     if bool(insert_api_key) ^ bool(insert_account_id):
         abort('error: both a new relic insights key and account id must be set')
 
+    if not pivot_mode in ['local', 'sheets']:
+        abort('error: pivot_mode must be local or sheets')
+
     del config
+    del config_file
     return locals()
 
 
-def inject_metadata(data, metadata):
-    """ inject the metadata at the beginning of the dictionary """
-
-    for index,row in enumerate(data):
-        _row = {}
-        _row.update(metadata)
-        _row.update(row)
-        data[index] = _row
+def export_metrics(config, progress=None, accounts_pool=None):
+    # requests and the google api client are slow to import, so the modules
+    # using them are imported only when the config actually needs them
+    from newrelic_account_metrics import NewRelicAccountMetrics
 
-
-def export_metrics(config):
     timestamp = int(time.time())
 
+    # resident runs report each run on its own, with fresh account snapshots
+    instrumentation.reset()
+    for account_maturity in (accounts_pool or {}).values():
+        account_maturity.clear_cache()
+
     # setup the required input and output instances
     if config['input_local'] or config['output_local']:
         local_storage = StorageLocal(
             config['account_file'],
             config['output_folder'],
             time.localtime(timestamp),
-            'MATURITY'
+            'MATURITY',
+            config['output_format'],
+            config['max_open_files']
         )
 
     if config['input_google'] or config['output_google']:
+        from storage_google_drive import StorageGoogleDrive
         google_storage = StorageGoogleDrive(
             config['account_file_id'],
             config['output_folder_id'],
             config['secret_file'],
             time.localtime(timestamp),
-            'MATURITY'
+            'MATURITY',
+            concurrency=config['google_concurrency']
         )
 
     if config['output_insights']:
+        from storage_newrelic_insights import StorageNewRelicInsights
         insights_storage = StorageNewRelicInsights(
             config['account_file'],
             config['insert_account_id'],
             config['insert_api_key'],
+            timestamp,
+            config['insert_concurrency'],
+            spool_folder=config['spool_folder'] or None
+        )
+
+    if config['output_sqlite']:
+        from storage_sqlite import StorageSQLite
+        sqlite_storage = StorageSQLite(
+            config['account_file'],
+            config['database_file'],
             timestamp
         )
 
@@ -113,59 +152,131 @@ def export_metrics(config):
         accounts = google_storage.get_accounts(config['account_sheet'])
     else:
         accounts = []
+    accounts = shard_accounts(accounts, config['shard'], config['shard_weight'])
+
+    # storage writes are coalesced across accounts and run on their own
+    # threads, overlapping the collection
+    storages = [
+        local_storage if config['output_local'] else None,
+        google_storage if config['output_google'] else None,
+        insights_storage if config['output_insights'] else None,
+        sqlite_storage if config['output_sqlite'] else None
+    ]
+    # local pivots are aggregated as the rows go by and written to the file like outputs
+    if config['pivot_mode'] == 'local' and config['pivots']:
+        pivot_storage = StoragePivot(config['pivots'], [
+            local_storage if config['output_local'] else None,
+            google_storage if config['output_google'] else None,
+            sqlite_storage if config['output_sqlite'] else None
+        ])
+    else:
+        pivot_storage = None
+
+    pipeline = StoragePipeline([
+        StorageBuffer(
+            storage,
+            config['buffer_rows'],
+            config['buffer_bytes'],
+            config['buffer_seconds']
+        ) for storage in storages if storage
+    ] + [pivot_storage])
 
     # traverse, extract, store maturity metrics from all accounts
-    for index, account in enumerate(accounts):
-
-        # get account fields
-        master_name = account['master_name']
-        account_id = account['account_id']
-        account_name = account['account_name']
-        rest_api_key = account['rest_api_key']
-
-        # can do a better progression log...
-        print('{}/{}: {} - {}'.format(
-            index+1,
-            len(accounts),
-            account_id,
-            account_name
-        ))
-
-        # get metrics from current account
-        account_maturity = NewRelicAccountMetrics(rest_api_key)
-        account_summary, apm_apps, browser_apps, mobile_apps = account_maturity.metrics()
-
-        # inject the required metadata in all lists
-        for item in [account_summary, apm_apps, browser_apps, mobile_apps]:
-            inject_metadata(
-                item, {
+    try:
+        try:
+            for index, account in enumerate(accounts):
+
+                # spread the accounts over time to smooth the load on the APIs
+                if index and config['stagger_seconds']:
+                    time.sleep(config['stagger_seconds'])
+
+                # get account fields
+                master_name = account['master_name']
+                account_id = account['account_id']
+                account_name = account['account_name']
+                rest_api_key = account['rest_api_key']
+
+                # can do a better progression log...
+                print('{}/{}: {} - {}'.format(
+                    index+1,
+                    len(accounts),
+                    account_id,
+                    account_name
+                ))
+                if progress:
+                    progress(done=index, total=len(accounts), account=account_name)
+
+                # get metrics from current account, resident runs keep the account clients
+                if accounts_pool is None:
+                    account_maturity = NewRelicAccountMetrics(rest_api_key)
+                elif rest_api_key in accounts_pool:
+                    account_maturity = accounts_pool[rest_api_key]
+                else:
+                    account_maturity = NewRelicAccountMetrics(rest_api_key)
+                    accounts_pool[rest_api_key] = account_maturity
+                account_summary, apm_apps, browser_apps, mobile_apps = account_maturity.metrics()
+
+                # the metadata travels next to the rows, storages prepend it on write
+                metadata = {
                     'master_name': master_name,
                     'account_id': account_id,
                     'account_name': account_name,
                     'datetime': to_datetime(timestamp)
                 }
-            )
 
-        # dumps the data to available storages
-        storages = [
-            local_storage if config['output_local'] else None,
-            google_storage if config['output_google'] else None,
-            insights_storage if config['output_insights'] else None
-        ]
-        for storage in storages:
-            if storage:
-                storage.dump_data(SUMMARY_NAME, SUMMARY_NAME, account_summary)
-                storage.dump_data(master_name, APM_NAME, apm_apps)
-                storage.dump_data(master_name, BROWSER_NAME, browser_apps)
-                storage.dump_data(master_name, MOBILE_NAME, mobile_apps)
-
-    if config['output_google']:
-        google_storage.format_data(config['pivots'])
+                # queue the data to available storages
+                pipeline.dump_data(SUMMARY_NAME, SUMMARY_NAME, account_summary, metadata)
+                pipeline.dump_data(master_name, APM_NAME, apm_apps, metadata)
+                pipeline.dump_data(master_name, BROWSER_NAME, browser_apps, metadata)
+                pipeline.dump_data(master_name, MOBILE_NAME, mobile_apps, metadata)
+
+        finally:
+            # drain all pending writes before wrapping up
+            pipeline.close()
+
+        if pivot_storage:
+            pivot_storage.close()
+
+        # timings and counters of the run, written like a dataset of the summary
+        if config['run_stats']:
+            instrumentation.dump_report(storages, SUMMARY_NAME, RUN_STATS_NAME, {
+                'datetime': to_datetime(timestamp),
+                'accounts': len(accounts)
+            })
+
+        if config['output_google']:
+            google_storage.format_data(config['pivots'] if config['pivot_mode'] == 'sheets' else {})
+
+    finally:
+        # even after an error, files are completed and pending events sent or spooled
+        close_storages(storages)
+
+    if progress:
+        progress(done=len(accounts), total=len(accounts))
+
+
+def run_daemon(config, status_port=0):
+    """ runs export_metrics on the config schedule in a resident process """
+
+    from service_scheduler import Job, Scheduler
+
+    accounts_pool = {}
+    job = Job(
+        'maturity',
+        config['schedule'],
+        lambda progress: export_metrics(config, progress, accounts_pool)
+    )
+    Scheduler([job]).run_forever(status_port or config['status_port'])
+
 
 def main():
     try:
-        config = get_config()
-        export_metrics(config)
+        args = get_cmdline_args()
+        config = get_config(args.config_file, args.shard, args.shard_weight, args.output_format)
+        if args.daemon:
+            run_daemon(config, args.status_port)
+        else:
+            export_metrics(config)
     except Exception as error:
         print(error.args)
 
@@ -0,0 +1,28 @@
+import argparse
+
+def get_cmdline_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config-file',
+        help='JSON config file',
+        default='config.json'
+    )
+    parser.add_argument('-f', '--output-format',
+        help='Local output file format, overrides output_format in the config file',
+        choices=['csv', 'csv.gz', 'csv.zst', 'parquet', 'arrow']
+    )
+    parser.add_argument('--shard',
+        help='process only the K/N shard of the accounts list (K in 1..N)'
+    )
+    parser.add_argument('--shard-weight',
+        help='accounts column with the cost used to balance shards instead of hashing account_id'
+    )
+    parser.add_argument('-d', '--daemon',
+        help='keep running and collect on the config schedule',
+        action='store_true'
+    )
+    parser.add_argument('-p', '--status-port',
+        help='local port of the daemon JSON status endpoint',
+        type=int
+    )
+
+    return parser.parse_args()
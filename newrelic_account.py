@@ -18,6 +18,11 @@ class NewRelicAccount():
         self.__cache = []
         self.__return_type = return_type
 
+    def clear_cache(self):
+        """ drops the cached result sets, the next calls fetch a new snapshot """
+
+        self.__cache = []
+
     def __get_cache(self, set_name):
         L = list(filter(lambda set: set['set_name'] == set_name, self.__cache))
         if len(L) == 1:
@@ -1,6 +1,7 @@
 import json
 import time
 
+from instrumentation import timer
 from newrelic_account import NewRelicAccount
 
 DEFAULT_APDEX = 0.5
@@ -63,6 +64,11 @@ class NewRelicAccountMetrics():
         self.__account = NewRelicAccount(rest_api_key)
         self.reset_metrics()
 
+    def clear_cache(self):
+        """ drops the account snapshot, a resident process calls it once per run """
+
+        self.__account.clear_cache()
+
     def reset_metrics(self):
         self.__metrics = {}
         for metric_name in NewRelicAccountMetrics.__METRIC_NAMES:
@@ -104,10 +110,12 @@ class NewRelicAccountMetrics():
                             self.entities_with_conditions[(condition_type,entity)] = \
                                 self.entities_with_conditions.get((condition_type,entity), 0) + 1
 
+    @timer()
     def get_users_metrics(self):
         users, _ = self.__account.users()
         self.__metrics['users_total'] = len(users)
 
+    @timer()
     def get_apm_metrics(self):
         result_apps = []
         apm_apps, _ = self.__account.apm_applications()
@@ -162,6 +170,7 @@ class NewRelicAccountMetrics():
 
         return result_apps
 
+    @timer()
     def get_mobile_metrics(self):
         result_apps = []
         mobile_apps, _ = self.__account.mobile_applications()
@@ -190,6 +199,7 @@ class NewRelicAccountMetrics():
 
         return result_apps
 
+    @timer()
     def get_browser_metrics(self):
         result_apps = []
         browser_apps, _ = self.__account.browser_applications()
@@ -203,6 +213,7 @@ class NewRelicAccountMetrics():
                 self.__metrics['browser_with_conditions'] += 1
         return result_apps # to be implemented
 
+    @timer()
     def get_alerts_policies_metrics(self, current_time):
         alerts_policies, _ = self.__account.alerts_policies()
         for alerts_policy in alerts_policies:
@@ -222,6 +233,7 @@ class NewRelicAccountMetrics():
             elif update_delta < NewRelicAccountMetrics.__MONTH_TIME:
                 self.__metrics['alerts_policies_a_month_old'] += 1
 
+    @timer()
     def metrics(self):
         start_time = time.time()
         self.reset_metrics()
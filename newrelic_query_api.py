@@ -1,7 +1,12 @@
+import collections
 import json
 import os
 import re
 import requests
+import threading
+
+from instrumentation import count, timed, timed_iter
+from rate_limiter import TokenBucket
 
 SP = '_'
 
@@ -131,9 +136,8 @@ def get_single(results, header, include={}, offset=0):
 
 
 def get_events(results, header, include={}, offset=0):
-    """ SELECT attr1, attr2, ... FROM ... """
+    """ SELECT attr1, attr2, ... FROM ... (generator) """
 
-    data = []
     events = results[0]['events']
     for event in events:
         row = {k:v for k,v in include.items()}
@@ -142,27 +146,21 @@ def get_events(results, header, include={}, offset=0):
             row.update({
                 'datetime': to_datetime(row['timestamp'])
             })
-        data.append(row)
-
-    return data
+        yield row
 
 
 def get_facets(results, header, include={}, offset=0):
-    """ SELECT aggr1, aggr2, ... FROM ... FACET attr1, attr2, ... """
+    """ SELECT aggr1, aggr2, ... FROM ... FACET attr1, attr2, ... (generator) """
 
-    data = []
     for result in results:
         row = get_facets_values(result['name'], header)
         row.update(get_results_values(result['results'], header, include, offset=len(row)))
-        data.append(row)
-
-    return data
+        yield row
 
 
 def get_timeseries(results, header, include={}, offset=0, prefix=''):
-    """ SELECT aggr1, aggr2, ... FROM ... TIMESERIES """
+    """ SELECT aggr1, aggr2, ... FROM ... TIMESERIES (generator) """
 
-    data = []
     for result in results:
         row = get_results_values(result['results'], header, include, offset)
         row.update({
@@ -171,9 +169,7 @@ def get_timeseries(results, header, include={}, offset=0, prefix=''):
             'timestamp' + prefix: result['endTimeSeconds'],
             'datetime' + prefix: to_datetime(int(result['endTimeSeconds']) * 1000)
         })
-        data.append(row)
-
-    return data
+        yield row
 
 
 def get_compare(results, header, include={}, offset=0):
@@ -233,6 +229,50 @@ def get_compare_timeseries(results, header, include={}, offset=0):
     return data
 
 
+class QueryCache():
+    """ least recently used query results, bounded by entries and by response bytes
+
+        one cache is shared by all the clients of a pool, so the memory it
+        holds does not grow with the number of accounts of the run
+    """
+
+    MAX_ENTRIES = 128
+    MAX_BYTES = 32 * 1024 * 1024 # size of the JSON responses kept
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        """ init """
+
+        self.__max_entries = max_entries
+        self.__max_bytes = max_bytes
+        self.__lock = threading.Lock()
+        self.__entries = collections.OrderedDict() # key -> (JSON result, size)
+        self.__size = 0
+
+    def get(self, key):
+        """ returns the cached result or None """
+
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return None
+            self.__entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, result, size):
+        """ caches a result, results larger than the whole cache are not kept """
+
+        if not self.__max_entries or size > self.__max_bytes:
+            return
+
+        with self.__lock:
+            if key in self.__entries:
+                self.__size -= self.__entries.pop(key)[1]
+            self.__entries[key] = (result, size)
+            self.__size += size
+            while len(self.__entries) > self.__max_entries or self.__size > self.__max_bytes:
+                self.__size -= self.__entries.popitem(last=False)[1][1]
+
+
 def parse_nrql(nrql, params):
     """ replace variables in nrql """
 
@@ -290,8 +330,8 @@ class NewRelicQueryAPI():
     """
 
     MAX_RETRIES = 5
-
-    def __init__(self, account_id=0, query_api_key='', max_retries=MAX_RETRIES):
+    def __init__(self, account_id=0, query_api_key='', max_retries=MAX_RETRIES,
+        rate_limiter=None, cache=None):
         """ init """
 
         if not account_id:
@@ -308,34 +348,57 @@ class NewRelicQueryAPI():
             'Accept': 'application/json',
             'X-Query-Key': query_api_key
         }
+        self.__account_id = str(account_id)
         self.__url = f'https://insights-api.newrelic.com/v1/accounts/{account_id}/query'
         self.__max_retries = max_retries
+        self.__session = requests.Session()
+        self.__session.headers.update(self.__headers)
+        self.__rate_limiter = rate_limiter if rate_limiter else TokenBucket()
+        self.__cache = cache if cache else QueryCache() # (account id, parsed nrql) -> JSON result
 
     def query(self, nrql, params={}):
         """ request a JSON result from the Insights Query API """
 
         parsed_nrql = parse_nrql(nrql, params)
+        result = self.__cache.get((self.__account_id, parsed_nrql))
+        if not result is None:
+            count('newrelic_query_api.cache_hits', self.__account_id)
+            return result
+
         succeeded = False
         count_retries = 0
         while not succeeded and count_retries < self.__max_retries:
             try:
                 count_retries += 1
-                response = requests.get(
-                    self.__url, headers=self.__headers, params={'nrql': parsed_nrql}
-                )
+                self.__rate_limiter.acquire()
+                with timed('newrelic_query_api.query', self.__account_id):
+                    response = self.__session.get(self.__url, params={'nrql': parsed_nrql})
                 succeeded = (response.status_code == requests.codes.ok)
             except:
                 pass
+        if count_retries > 1:
+            count('newrelic_query_api.retries', self.__account_id, count_retries - 1)
+
+        if not succeeded:
+            return []
+
+        result = response.json()
+        self.__cache.set((self.__account_id, parsed_nrql), result, len(response.content))
 
-        return response.json() if succeeded else []
+        return result
 
     def events(self, nrql, include={}, params={}):
         """ execute the nrql and convert to an events list """
 
+        return list(self.iter_events(nrql, include, params))
+
+    def iter_events(self, nrql, include={}, params={}):
+        """ execute the nrql and yield the events as they are flattened """
+
         # get the NRQL results
         response = self.query(nrql, params=params)
         if not response:
-            return []
+            return
 
         metadata = response.get('metadata', {})
         contents = metadata.get('contents', {})
@@ -442,8 +505,57 @@ class NewRelicQueryAPI():
         else:
             results = []
 
-        # parse the result JSON and return a list of event
-        return fetch_data(results, header, _include, offset) if results else []
+        # parse the result JSON and yield the events, timing the flattening only
+        if results:
+            yield from timed_iter(
+                'newrelic_query_api.flatten',
+                fetch_data.__name__,
+                fetch_data(results, header, _include, offset)
+            )
+
+class NewRelicQueryAPIPool():
+    """ NewRelicQueryAPI clients created once per run, one per (account id, query api key)
+
+        clients keep their connection session for the whole run and share one
+        bounded result cache, and all the clients of the same query api key
+        share one rate limiter of max_rate queries per second (0 means unlimited)
+    """
+
+    def __init__(self, max_rate=0, max_retries=NewRelicQueryAPI.MAX_RETRIES,
+        cache_entries=QueryCache.MAX_ENTRIES, cache_bytes=QueryCache.MAX_BYTES):
+        """ init """
+
+        self.__clients = {}
+        self.__cache = QueryCache(cache_entries, cache_bytes)
+        self.__rate_limiters = {}
+        self.__max_rate = max_rate
+        self.__max_retries = max_retries
+
+    def get(self, account_id, query_api_key):
+        """ returns the shared client of an account id / query api key """
+
+        key = (str(account_id).strip(), query_api_key)
+        if not key in self.__clients:
+            if not query_api_key in self.__rate_limiters:
+                self.__rate_limiters[query_api_key] = TokenBucket(self.__max_rate)
+            self.__clients[key] = NewRelicQueryAPI(
+                account_id,
+                query_api_key,
+                max_retries=self.__max_retries,
+                rate_limiter=self.__rate_limiters[query_api_key],
+                cache=self.__cache
+            )
+
+        return self.__clients[key]
+
+    def get_vault(self, vault):
+        """ resolves a {secret: {account_id, query_api_key}} vault to shared clients """
+
+        return {
+            secret: self.get(keys['account_id'], keys['query_api_key'])
+            for secret, keys in vault.items()
+        }
+
 
 if __name__ == "__main__":
     nrqls = [
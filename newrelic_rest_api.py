@@ -5,6 +5,9 @@ import sys
 import urllib.parse as urlparse
 from datetime import datetime, date, timedelta
 
+from http_session import get_session
+from instrumentation import count, timed
+
 MAX_PAGES = 200 # max number of pages to fetch on a paginating endpoint
 MAX_RETRIES = 5 # max number of requests before giving up
 
@@ -191,14 +194,17 @@ class NewRelicRestAPI():
             while not succeeded and count_retries < max_retries:
                 try:
                     count_retries += 1
-                    response = requests.get(
-                        url,
-                        headers=self.__headers,
-                        params=params
-                    )
+                    with timed('newrelic_rest_api.get', endpoint):
+                        response = get_session().get(
+                            url,
+                            headers=self.__headers,
+                            params=params
+                        )
                     succeeded = (response.status_code == requests.codes.ok)
                 except:
                     succeeded = False
+            if count_retries > 1:
+                count('newrelic_rest_api.retries', endpoint, count_retries - 1)
             if succeeded:
                 response_json = response.json()[result_set_name]
                 result += response_json
@@ -0,0 +1,239 @@
+""" local evaluation of the Google Sheets pivot definitions of the config
+
+    a pivot definition is {"rows": [...], "columns": [...], "values":
+    {"column": "FUNCTION"}} with the Sheets summarize functions; rows are
+    aggregated in one pass into a hash table keyed by (row key, column key),
+    and the result is a static table with one line per row key, one column
+    per (column key, value) and a Grand Total line
+"""
+
+import math
+import statistics
+
+from row_batches import iter_rows
+
+GRAND_TOTAL = 'Grand Total'
+
+
+def is_number(value):
+    return type(value) in [int, float] and not (type(value) == float and math.isnan(value))
+
+
+def is_empty(value):
+    return value is None or value == ''
+
+
+def append_number(state, value):
+    if is_number(value):
+        state.append(value)
+    return state
+
+
+def add_unique(state, value):
+    if not is_empty(value):
+        state.add(str(value))
+    return state
+
+
+# summarize function -> (initial state, update(state, value) -> state, result(state))
+AGGREGATES = {
+    'SUM': (
+        lambda: 0,
+        lambda s, v: s + v if is_number(v) else s,
+        lambda s: s
+    ),
+    'COUNT': (
+        lambda: 0,
+        lambda s, v: s + 1 if is_number(v) else s,
+        lambda s: s
+    ),
+    'COUNTA': (
+        lambda: 0,
+        lambda s, v: s if is_empty(v) else s + 1,
+        lambda s: s
+    ),
+    'COUNTUNIQUE': (
+        set,
+        add_unique,
+        len
+    ),
+    'AVERAGE': (
+        lambda: (0, 0),
+        lambda s, v: (s[0] + v, s[1] + 1) if is_number(v) else s,
+        lambda s: s[0] / s[1] if s[1] else ''
+    ),
+    'MAX': (
+        lambda: None,
+        lambda s, v: (v if s is None else max(s, v)) if is_number(v) else s,
+        lambda s: '' if s is None else s
+    ),
+    'MIN': (
+        lambda: None,
+        lambda s, v: (v if s is None else min(s, v)) if is_number(v) else s,
+        lambda s: '' if s is None else s
+    ),
+    'PRODUCT': (
+        lambda: None,
+        lambda s, v: (v if s is None else s * v) if is_number(v) else s,
+        lambda s: 0 if s is None else s
+    ),
+    'MEDIAN': (
+        list,
+        append_number,
+        lambda s: statistics.median(s) if s else ''
+    ),
+    'STDEV': (
+        list,
+        append_number,
+        lambda s: statistics.stdev(s) if len(s) > 1 else ''
+    ),
+    'STDEVP': (
+        list,
+        append_number,
+        lambda s: statistics.pstdev(s) if s else ''
+    ),
+    'VAR': (
+        list,
+        append_number,
+        lambda s: statistics.variance(s) if len(s) > 1 else ''
+    ),
+    'VARP': (
+        list,
+        append_number,
+        lambda s: statistics.pvariance(s) if s else ''
+    )
+}
+
+
+def abort(message):
+    """ abort the command """
+
+    print(message)
+    exit()
+
+
+def sort_key(key):
+    """ ascending order of mixed type keys, numbers first """
+
+    return tuple((0, k, '') if is_number(k) else (1, 0, str(k)) for k in key)
+
+
+class PivotTable():
+    """ hash aggregation of one pivot definition """
+
+    def __init__(self, pivot):
+        """ init """
+
+        self.__rows = pivot.get('rows', [])
+        self.__columns = pivot.get('columns', [])
+        self.__values = list(pivot.get('values', {}).items())
+
+        for _, function in self.__values:
+            if not function in AGGREGATES:
+                abort(f'error: unsupported pivot function {function}')
+
+        self.__aggregates = [AGGREGATES[function] for _, function in self.__values]
+        self.__cells = {} # (row key, column key) -> aggregate states
+        self.__column_keys = set()
+
+    def __update(self, key, row):
+        """ folds a row into the aggregate states of a cell """
+
+        states = self.__cells.get(key)
+        if states is None:
+            states = [init() for init, _, _ in self.__aggregates]
+        self.__cells[key] = [
+            update(state, row.get(column))
+            for state, (_, update, _), (column, _) in zip(states, self.__aggregates, self.__values)
+        ]
+
+    def add(self, row):
+        """ aggregates one row """
+
+        row_key = tuple(row.get(k, '') for k in self.__rows)
+        column_key = tuple(row.get(k, '') for k in self.__columns)
+        self.__column_keys.add(column_key)
+        self.__update((row_key, column_key), row)
+        self.__update((None, column_key), row) # grand total
+
+    def __value_name(self, column_key, column, function):
+        """ result column name, Sheets style """
+
+        name = f'{function} of {column}'
+        return f'{" / ".join(str(k) for k in column_key)} - {name}' if column_key else name
+
+    def result(self):
+        """ returns the pivot table as a list of row dictionaries, Grand Total last """
+
+        column_keys = sorted(self.__column_keys, key=sort_key)
+        # without row fields the grand total is the only line
+        row_keys = sorted(set(k for k,_ in self.__cells.keys() if k is not None), key=sort_key) \
+            if self.__rows else []
+
+        table = []
+        for row_key in row_keys + [None]:
+            if row_key is None:
+                line = {k: '' for k in self.__rows}
+                if self.__rows:
+                    line[self.__rows[0]] = GRAND_TOTAL
+            else:
+                line = dict(zip(self.__rows, row_key))
+
+            for column_key in column_keys:
+                # cells without rows are left blank, like in Sheets
+                states = self.__cells.get((row_key, column_key))
+                for index, (column, function) in enumerate(self.__values):
+                    _, _, result = self.__aggregates[index]
+                    value = result(states[index]) if states else ''
+                    line[self.__value_name(column_key, column, function)] = value
+
+            table.append(line)
+
+        return table
+
+
+class StoragePivot():
+    """ storage evaluating the pivot definitions over the rows going through it
+
+        rows of the datasets with a pivot definition are aggregated per
+        (master, dataset); close() writes every pivot table as a
+        <dataset>Pivot dataset of the same master to the output storages
+    """
+
+    SUFFIX = 'Pivot'
+
+    def __init__(self, pivots, storages=[]):
+        """ init """
+
+        self.__pivots = pivots
+        self.__storages = [storage for storage in storages if storage]
+        self.__tables = {} # (master, dataset) -> pivot table
+
+    def dump_data(self, master, output_file, data=[], constants={}):
+        """ aggregates the data when the dataset has a pivot definition """
+
+        if type(data) == list and len(data):
+            self.dump_batches(master, output_file, [(constants, data)])
+
+    def dump_batches(self, master, output_file, batches=[]):
+        """ aggregates (constants, rows) batches when the dataset has a pivot definition """
+
+        pivot = self.__pivots.get(output_file)
+        if not pivot:
+            return
+
+        target = (master, output_file)
+        if not target in self.__tables:
+            self.__tables[target] = PivotTable(pivot)
+        table = self.__tables[target]
+        for row in iter_rows(batches):
+            table.add(row)
+
+    def close(self):
+        """ writes the pivot tables to the output storages """
+
+        for (master, output_file), table in self.__tables.items():
+            result = table.result()
+            for storage in self.__storages:
+                storage.dump_data(master, output_file + StoragePivot.SUFFIX, result)
+        self.__tables = {}
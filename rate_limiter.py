@@ -0,0 +1,51 @@
+import threading
+import time
+
+
+class TokenBucket():
+    """ thread safe token bucket, rate tokens per second up to capacity
+
+        a rate of 0 disables the limiter
+    """
+
+    def __init__(self, rate=0, capacity=None):
+        """ init """
+
+        self.rate = rate
+        self.capacity = capacity if capacity else max(1, rate)
+        self.__tokens = self.capacity
+        self.__last = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def __refill(self):
+        """ adds the tokens accrued since the last refill """
+
+        now = time.monotonic()
+        self.__tokens = min(self.capacity, self.__tokens + (now - self.__last) * self.rate)
+        self.__last = now
+
+    def acquire(self, tokens=1):
+        """ blocks until the tokens are available and takes them """
+
+        if not self.rate:
+            return
+
+        while True:
+            with self.__lock:
+                self.__refill()
+                if self.__tokens >= tokens:
+                    self.__tokens -= tokens
+                    return
+                wait = (tokens - self.__tokens) / self.rate
+            time.sleep(wait)
+
+    def penalize(self, seconds):
+        """ empties the bucket and delays the next tokens, used on rate limit responses """
+
+        if not self.rate:
+            time.sleep(seconds)
+            return
+
+        with self.__lock:
+            self.__refill()
+            self.__tokens = min(self.__tokens, 0) - seconds * self.rate
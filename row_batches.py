@@ -0,0 +1,64 @@
+""" helpers for batches of rows that share constant columns
+
+    a batch is a (constants, rows) tuple where constants is a dictionary of
+    columns with the same value on every row (account, master, datetime,
+    eventType, ...) and rows is the list of per-row dictionaries; storages
+    expand the constants only when serializing, so result sets are never
+    copied just to prepend metadata
+"""
+
+
+def get_columns(batches):
+    """ returns the ordered column names, constants first, from the first row """
+
+    for constants, rows in batches:
+        if rows:
+            columns = list(constants.keys())
+            columns.extend([k for k in rows[0].keys() if not k in constants])
+            return columns
+
+    return []
+
+
+def extend_columns(columns, batches):
+    """ returns the columns followed by any new column found in the batches """
+
+    columns = list(columns)
+    known = set(columns)
+    for constants, rows in batches:
+        if not constants.keys() <= known:
+            new = [k for k in constants.keys() if not k in known]
+            columns.extend(new)
+            known.update(new)
+        for row in rows:
+            if not row.keys() <= known:
+                new = [k for k in row.keys() if not k in known]
+                columns.extend(new)
+                known.update(new)
+
+    return columns
+
+
+def iter_values(batches, columns, restval=''):
+    """ yields one list of values per row, aligned to the columns """
+
+    for constants, rows in batches:
+        defaults = [constants.get(k, restval) for k in columns]
+        for row in rows:
+            yield [row.get(k, default) for k,default in zip(columns, defaults)]
+
+
+def iter_rows(batches):
+    """ yields one dictionary per row, constants first """
+
+    for constants, rows in batches:
+        for row in rows:
+            _row = dict(constants)
+            _row.update(row)
+            yield _row
+
+
+def count_rows(batches):
+    """ returns the total number of rows in the batches """
+
+    return sum(len(rows) for _, rows in batches)
@@ -0,0 +1,259 @@
+import json
+import queue
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+CRON_ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *'
+}
+
+# (min, max) of minute, hour, day of month, month and day of week (0 = Sunday)
+CRON_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+
+def abort(message):
+    """ abort the command """
+
+    print(message)
+    exit()
+
+
+def parse_cron_field(field, low, high):
+    """ returns the set of values matched by one cron field """
+
+    values = set()
+    for part in field.split(','):
+        if '/' in part:
+            part, step = part.split('/')
+            step = int(step)
+        else:
+            step = 1
+
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = [int(x) for x in part.split('-')]
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f'{field} out of range {low}-{high}')
+
+        values.update(range(start, end + 1, step))
+
+    return values
+
+
+class CronSchedule():
+    """ standard 5 fields cron expression: minute hour day-of-month month day-of-week """
+
+    def __init__(self, expression):
+        """ init """
+
+        self.expression = expression
+        fields = CRON_ALIASES.get(expression.strip(), expression).split()
+        if len(fields) != 5:
+            abort(f'error: invalid cron expression {expression}')
+
+        try:
+            self.__minutes, self.__hours, self.__days, self.__months, self.__weekdays = [
+                parse_cron_field(field, low, high) for field, (low, high) in zip(fields, CRON_RANGES)
+            ]
+        except ValueError:
+            abort(f'error: invalid cron expression {expression}')
+
+        # 7 is an alias for sunday, cron OR's day of month and day of week when both are set
+        if 7 in self.__weekdays:
+            self.__weekdays = (self.__weekdays - {7}) | {0}
+        self.__any_day = fields[2] == '*'
+        self.__any_weekday = fields[4] == '*'
+
+    def __day_matches(self, moment):
+        """ day of month / day of week matching with cron semantics """
+
+        day = moment.day in self.__days
+        weekday = (moment.isoweekday() % 7) in self.__weekdays
+        if self.__any_day or self.__any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_time(self, after=None):
+        """ returns the next matching timestamp strictly after the given one """
+
+        moment = datetime.fromtimestamp(after if after else time.time())
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 5)
+
+        while moment < limit:
+            if not moment.month in self.__months:
+                month = moment.month % 12 + 1
+                year = moment.year + (1 if month == 1 else 0)
+                moment = moment.replace(year=year, month=month, day=1, hour=0, minute=0)
+            elif not self.__day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif not moment.hour in self.__hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif not moment.minute in self.__minutes:
+                moment = moment + timedelta(minutes=1)
+            else:
+                return moment.timestamp()
+
+        abort(f'error: cron expression {self.expression} never matches')
+
+
+class Job():
+    """ a named callable run on a cron schedule, with its progress and timings """
+
+    def __init__(self, name, cron, target):
+        """ init """
+
+        self.name = name
+        self.schedule = CronSchedule(cron)
+        self.target = target
+        self.next_run = self.schedule.next_time()
+        self.state = 'scheduled'
+        self.runs = 0
+        self.failures = 0
+        self.last_start = None
+        self.last_duration = None
+        self.last_error = None
+        self.progress = {}
+
+    def report(self, **progress):
+        """ progress callback handed to the job target """
+
+        self.progress = progress
+
+    def status(self):
+        """ returns a JSON friendly status dictionary """
+
+        to_iso = lambda t: datetime.fromtimestamp(t).isoformat() if t else None
+        return {
+            'name': self.name,
+            'cron': self.schedule.expression,
+            'state': self.state,
+            'next_run': to_iso(self.next_run),
+            'runs': self.runs,
+            'failures': self.failures,
+            'last_start': to_iso(self.last_start),
+            'last_duration': self.last_duration,
+            'last_error': self.last_error,
+            'progress': self.progress
+        }
+
+
+class Scheduler():
+    """ runs jobs on their cron schedules, one at a time, in a resident process
+
+        jobs run sequentially on a single worker thread, so clients and
+        caches kept warm between runs are never shared across threads; a
+        job that becomes due while it is still queued or running is skipped
+    """
+
+    def __init__(self, jobs=[]):
+        """ init """
+
+        self.jobs = list(jobs)
+        self.started = time.time()
+        self.__pending = queue.Queue()
+        self.__stopped = threading.Event()
+
+    def __run(self, job):
+        """ executes one job and records its outcome """
+
+        job.state = 'running'
+        job.last_start = time.time()
+        job.last_error = None
+        job.progress = {}
+        try:
+            job.target(job.report)
+        except BaseException as error:
+            job.failures += 1
+            job.last_error = repr(error)
+            traceback.print_exc()
+        finally:
+            job.runs += 1
+            job.last_duration = round(time.time() - job.last_start, 2)
+            job.state = 'scheduled'
+
+    def __work(self):
+        """ worker thread loop """
+
+        while not self.__stopped.is_set():
+            try:
+                job = self.__pending.get(timeout=1)
+            except queue.Empty:
+                continue
+            self.__run(job)
+
+    def status(self):
+        """ returns a JSON friendly status of the scheduler and its jobs """
+
+        return {
+            'started': datetime.fromtimestamp(self.started).isoformat(),
+            'uptime': round(time.time() - self.started, 2),
+            'jobs': [job.status() for job in self.jobs]
+        }
+
+    def run_forever(self, status_port=None):
+        """ dispatches due jobs until interrupted """
+
+        if status_port:
+            serve_status(self, status_port)
+
+        worker = threading.Thread(target=self.__work, name='scheduler-worker', daemon=True)
+        worker.start()
+
+        for job in self.jobs:
+            print(f'scheduled {job.name} ({job.schedule.expression}) next run at {job.status()["next_run"]}')
+
+        try:
+            while True:
+                now = time.time()
+                for job in self.jobs:
+                    if job.next_run <= now:
+                        job.next_run = job.schedule.next_time(now)
+                        if job.state == 'scheduled':
+                            job.state = 'queued'
+                            self.__pending.put(job)
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.__stopped.set()
+
+
+def serve_status(scheduler, port, host='127.0.0.1'):
+    """ starts a local HTTP endpoint returning the scheduler status as JSON """
+
+    class StatusHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.rstrip('/') in ['', '/status']:
+                body = json.dumps(scheduler.status(), indent=4).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self.send_error(404)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer((host, port), StatusHandler)
+    thread = threading.Thread(target=server.serve_forever, name='status-server', daemon=True)
+    thread.start()
+
+    return server
@@ -0,0 +1,63 @@
+import time
+
+
+class StorageBuffer():
+    """ write-behind buffer in front of any storage
+
+        rows are coalesced per (master, output_file) target, keeping each
+        call's constant columns apart, and handed to the storage as one
+        dump_batches call once a target reaches max_rows or max_bytes, or
+        its oldest row is older than max_seconds; flush() or close() must be
+        called at the end of the run to write the leftovers
+    """
+
+    MAX_ROWS = 5000
+    MAX_BYTES = 4 * 1024 * 1024
+    MAX_SECONDS = 60
+
+    def __init__(self, storage, max_rows=MAX_ROWS, max_bytes=MAX_BYTES, max_seconds=MAX_SECONDS):
+        """ init """
+
+        self.__storage = storage
+        self.__max_rows = max_rows
+        self.__max_bytes = max_bytes
+        self.__max_seconds = max_seconds
+        self.__targets = {} # (master, output_file) -> [batches, rows, size, first dump time]
+
+    def __flush_target(self, target):
+        """ writes the buffered batches of one target to the storage """
+
+        batches, _, _, _ = self.__targets.pop(target)
+        if batches:
+            self.__storage.dump_batches(*target, batches)
+
+    def dump_data(self, master, output_file, data=[], constants={}):
+        """ buffers the data and flushes the targets that hit a threshold """
+
+        if type(data) == list and len(data):
+            target = (master, output_file)
+            if not target in self.__targets:
+                self.__targets[target] = [[], 0, 0, time.time()]
+            buffered = self.__targets[target]
+            buffered[0].append((constants, data))
+            buffered[1] += len(data)
+            buffered[2] += sum(len(str(row)) for row in data) # rough size estimate
+
+            if buffered[1] >= self.__max_rows or buffered[2] >= self.__max_bytes:
+                self.__flush_target(target)
+
+        # time based flush, evaluated on every call
+        expired = time.time() - self.__max_seconds
+        for target in [k for k,v in self.__targets.items() if v[3] <= expired]:
+            self.__flush_target(target)
+
+    def flush(self):
+        """ writes all buffered rows to the storage """
+
+        for target in list(self.__targets.keys()):
+            self.__flush_target(target)
+
+    def close(self):
+        """ final flush, the underlying storage is left open """
+
+        self.flush()
@@ -1,11 +1,13 @@
 import json
 import os
 import time
+import zlib
 
-from oauth2client.service_account import ServiceAccountCredentials
-from googleapiclient import discovery
-
+from google_clients import execute, get_service
 from google_sheets_helpers import *
+from instrumentation import timer
+from row_batches import extend_columns, get_columns, iter_values
+from worker_threads import Worker, raise_errors, stop_workers
 
 
 def abort(message):
@@ -15,13 +17,25 @@ def abort(message):
     exit()
 
 class StorageGoogleDrive():
+    """ Google Drive run folder with one spreadsheet per master and one sheet per dataset
+
+        writes are queued per spreadsheet and sent in batches by sender threads
+    """
 
     OBJECT_TYPES = {
         'folder': 'application/vnd.google-apps.folder',
         'spreadsheet': 'application/vnd.google-apps.spreadsheet'
     }
 
-    def __init__(self, account_file_id, output_folder_id, secret_file, timestamp=None, prefix='RUN', writers=[], readers=[]):
+    MAX_BATCH_CELLS = 50000 # cells queued for a spreadsheet before its batchUpdate is sent
+    MAX_QUEUED_CELLS = 250000 # cells queued for all spreadsheets before every batchUpdate is sent
+    MAX_SHEET_CELLS = 5000000 # a dataset rolls over to its next sheet past this
+    MAX_SPREADSHEET_CELLS = 9000000 # and to the next spreadsheet of its master past this, Sheets allows 10M
+    CONCURRENCY = 4 # spreadsheets written at the same time
+    QUEUE_SIZE = 8 # max number of batches waiting for a sender
+
+    def __init__(self, account_file_id, output_folder_id, secret_file, timestamp=None, prefix='RUN', writers=[], readers=[],
+        concurrency=CONCURRENCY):
         """ init """
 
         self.__cache = {}
@@ -33,28 +47,34 @@ class StorageGoogleDrive():
                 time.localtime() if not timestamp else timestamp
             )
         self.__run_folder_id = None
+        self.__run_folder_created = False
+        self.__sheets = {} # spreadsheet id -> {sheet title: {sheet_id, header, rows, grid_rows, columns, formats}}
+        self.__requests = {} # spreadsheet id -> queued batchUpdate requests
+        self.__values = {} # spreadsheet id -> queued {sheet, start, values} row blocks
+        self.__queued_cells = {} # spreadsheet id -> number of queued cells
+        self.__parts = {} # (spreadsheet name, sheet name) -> (spreadsheet part, sheet part) being written
+        self.__last_parts = {} # spreadsheet name -> last spreadsheet part
         self.__readers = readers
         self.__writers = writers
 
+        self.__secret_file = secret_file
+        self.__concurrency = max(1, concurrency)
+        self.__senders = [] # started on the first send
+
         if not os.path.exists(secret_file):
             abort(f'error: cannot find secret file {secret_file}')
 
-        try:
-            credentials = ServiceAccountCredentials.from_json_keyfile_name(
-                secret_file,
-                [
-                    'https://www.googleapis.com/auth/drive',
-                    'https://www.googleapis.com/auth/spreadsheets'
-                ]
-            )
-            drive = discovery.build('drive', 'v3', credentials=credentials)
-            sheets = discovery.build('sheets', 'v4', credentials=credentials)
-        except:
-            abort('error: cannot open a connection to Google API')
+    @property
+    def __files(self):
+        return get_service(self.__secret_file, 'drive', 'v3').files() # pylint: disable=no-member
+
+    @property
+    def __permissions(self):
+        return get_service(self.__secret_file, 'drive', 'v3').permissions() # pylint: disable=no-member
 
-        self.__files = drive.files() # pylint: disable=no-member
-        self.__permissions = drive.permissions() # pylint: disable=no-member
-        self.__spreadsheets = sheets.spreadsheets() # pylint: disable=no-member
+    @property
+    def __spreadsheets(self):
+        return get_service(self.__secret_file, 'sheets', 'v4').spreadsheets() # pylint: disable=no-member
 
     def __set_permissions(self, object_id):
         """ set readers / writers permission on object id """
@@ -62,11 +82,11 @@ class StorageGoogleDrive():
         if object_id:
             if self.__writers:
                 body = {'role': 'writer', 'type': 'user', 'emailAddress': self.__writers}
-                self.__permissions.create(fileId=object_id, body=body).execute()
+                self.__execute(self.__permissions.create(fileId=object_id, body=body), 'drive')
 
             if self.__readers:
                 body = {'role': 'reader', 'type': 'user', 'emailAddress': self.__readers}
-                self.__permissions.create(fileId=object_id, body=body).execute()
+                self.__execute(self.__permissions.create(fileId=object_id, body=body), 'drive')
 
         return object_id
 
@@ -78,7 +98,7 @@ class StorageGoogleDrive():
 
         mime_type = StorageGoogleDrive.OBJECT_TYPES[object_type]
         query = f"'{parent_id}' in parents and name = '{object_name}' and mimeType = '{mime_type}'"
-        response = self.__files.list(q=query, spaces='drive', fields='files(id)').execute()
+        response = self.__execute(self.__files.list(q=query, spaces='drive', fields='files(id)'), 'drive')
         files = response.get('files', [])
 
         if len(files) == 1:
@@ -88,18 +108,18 @@ class StorageGoogleDrive():
 
         return object_id
 
-    def __create_object(self, object_type, object_name, parent_id):
-        """ create a new object """
+    def __create_object(self, object_type, object_name, parent_id, lookup=True):
+        """ create a new object, lookup=False when the parent is known to be empty """
 
         assert object_type in StorageGoogleDrive.OBJECT_TYPES,\
         'error: unsuported object type'
 
         mime_type = StorageGoogleDrive.OBJECT_TYPES[object_type]
-        object_id = self.__get_object_id(object_type, object_name, parent_id)
+        object_id = self.__get_object_id(object_type, object_name, parent_id) if lookup else None
 
         if not object_id:
             body = {'name': object_name, 'mimeType': mime_type, 'parents': [parent_id]}
-            response = self.__files.create(body=body).execute()
+            response = self.__execute(self.__files.create(body=body), 'drive')
             object_id = response.get('id', None)
             just_created = True
         else:
@@ -107,95 +127,216 @@ class StorageGoogleDrive():
 
         return object_id, just_created
 
-    def __get_sheet_id(self, spreadsheet_id, sheet_name):
-        """ search for a sheet name in a spreadsheet id and return the id """
-
-        response = self.__spreadsheets.get(spreadsheetId=spreadsheet_id).execute()
-        sheets = response.get('sheets', [])
-        sheets = [k for i,k in enumerate(sheets) if k.get('name', None) == sheet_name]
-        if len(sheets) == 1:
-            sheet_id = sheets[0].get('properties', {}).get('sheetId', None)
-        else:
-            sheet_id = None
+    def __get_sheets(self, spreadsheet_id, just_created=False):
+        """ returns the sheets index of a spreadsheet, read once with a field mask """
 
-        return sheet_id
+        if not spreadsheet_id in self.__sheets:
+            if just_created:
+                properties = [{'sheetId': SHEET1_SHEET_ID, 'title': SHEET1_TITLE}]
+            else:
+                response = self.__execute(self.__spreadsheets.get(
+                    spreadsheetId=spreadsheet_id,
+                    fields='sheets.properties(sheetId,title,gridProperties(rowCount,columnCount))'
+                ))
+                properties = [k['properties'] for k in response.get('sheets', [])]
+
+            self.__sheets[spreadsheet_id] = {
+                k['title']: {
+                    'sheet_id': k['sheetId'],
+                    'header': [] if just_created else None, # unknown until written or read
+                    'rows': 0 if just_created else None,
+                    'grid_rows': k.get('gridProperties', {}).get('rowCount', SHEET_DEFAULT_ROWS),
+                    'columns': k.get('gridProperties', {}).get('columnCount', SHEET_DEFAULT_COLUMNS),
+                    'formats': {}
+                } for k in properties
+            }
+
+        return self.__sheets[spreadsheet_id]
+
+    def __get_header(self, spreadsheet_id, sheet_name):
+        """ returns the header of a sheet, only sheets from an earlier run are read """
+
+        sheet = self.__get_sheets(spreadsheet_id)[sheet_name]
+        if sheet['header'] is None:
+            # only the header row is read, sheets are grown to the rows
+            # written so the grid row count from the sheets index is the
+            # number of rows, blank trailing cells included
+            response = self.__execute(self.__spreadsheets.values().get(
+                spreadsheetId=spreadsheet_id,
+                range=a1_range(sheet_name, '1:1'),
+                majorDimension='ROWS',
+                fields='values'
+            ))
+            values = response.get('values', [])
+            sheet['header'] = values[0] if values else []
+            sheet['rows'] = sheet['grid_rows']
+
+        return sheet['header']
+
+    def __create_sheet(self, spreadsheet_id, sheet_name, total_columns=None):
+        """ queue a new sheet, its id is assigned here so no reply is needed """
+
+        sheets = self.__get_sheets(spreadsheet_id)
+        if sheet_name in sheets:
+            return sheets[sheet_name]['sheet_id'], False
+
+        # data sheets start empty with as many columns as headers
+        sheet_id = max((k['sheet_id'] for k in sheets.values()), default=SHEET1_SHEET_ID) + 1
+        sheets[sheet_name] = {
+            'sheet_id': sheet_id,
+            'header': [],
+            'rows': 0,
+            'grid_rows': 1 if total_columns else SHEET_DEFAULT_ROWS,
+            'columns': total_columns if total_columns else SHEET_DEFAULT_COLUMNS,
+            'formats': {}
+        }
+        self.__queue_requests(spreadsheet_id, [
+            add_sheet_request(sheet_name, sheet_id, 1 if total_columns else None, total_columns)
+        ])
+
+        return sheet_id, True
+
+    def __queue_requests(self, spreadsheet_id, requests):
+        """ queue batchUpdate requests for a spreadsheet """
+
+        queued = self.__requests.setdefault(spreadsheet_id, [])
+        for request in requests:
+            # consecutive grid extensions of the same sheet go out as one request
+            if 'appendDimension' in request and queued and 'appendDimension' in queued[-1] and \
+                queued[-1]['appendDimension']['sheetId'] == request['appendDimension']['sheetId'] and \
+                queued[-1]['appendDimension']['dimension'] == request['appendDimension']['dimension']:
+                queued[-1]['appendDimension']['length'] += request['appendDimension']['length']
+            else:
+                queued.append(request)
 
-    def __create_sheet(self, spreadsheet_id, sheet_name):
-        """ create a new sheet """
+    def __queue_values(self, spreadsheet_id, sheet_name, start, values):
+        """ queue rows of values, a spreadsheet queue is sent once it holds MAX_BATCH_CELLS """
 
-        sheet_id = self.__get_sheet_id(spreadsheet_id, sheet_name)
-        if not sheet_id:
-            body = {"requests": [add_sheet_request(sheet_name)]}
-            response = self.__spreadsheets.batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
-            sheet_id = \
-                response.get('replies', [{}])[0].get('addSheet', {}).get('properties', {}).get('sheetId', None)
-            self.__fit_sheet_rows(spreadsheet_id, sheet_id)
-            just_created = True
+        queued = self.__values.setdefault(spreadsheet_id, [])
+        if queued and queued[-1]['sheet'] == sheet_name and \
+            queued[-1]['start'] + len(queued[-1]['values']) == start:
+            queued[-1]['values'].extend(values)
         else:
-            just_created = False
+            queued.append({'sheet': sheet_name, 'start': start, 'values': values})
 
-        return sheet_id, just_created
+        cells = sum(len(row) for row in values)
+        self.__queued_cells[spreadsheet_id] = self.__queued_cells.get(spreadsheet_id, 0) + cells
+        if self.__queued_cells[spreadsheet_id] >= StorageGoogleDrive.MAX_BATCH_CELLS:
+            self.__send_requests(spreadsheet_id)
+        elif sum(self.__queued_cells.values()) >= StorageGoogleDrive.MAX_QUEUED_CELLS:
+            self.flush()
 
-    def __fit_sheet_columns(self, spreadsheet_id, sheet_id, total_columns=SHEET_DEFAULT_COLUMNS):
-        """ set the total number of columns on the sheet """
+    def __send_requests(self, spreadsheet_id):
+        """ hand the queued requests of a spreadsheet to its sender thread """
 
-        if total_columns > SHEET_DEFAULT_COLUMNS:
-            requests = [
-                append_dimension_request(sheet_id, "COLUMNS", total_columns - SHEET_DEFAULT_COLUMNS)
-            ]
+        requests = self.__requests.pop(spreadsheet_id, [])
+        values = self.__values.pop(spreadsheet_id, [])
+        self.__queued_cells.pop(spreadsheet_id, None)
 
-        elif total_columns < SHEET_DEFAULT_COLUMNS:
-            requests = [
-                delete_dimension_request(sheet_id, "COLUMNS", 0, SHEET_DEFAULT_COLUMNS - total_columns)
-            ]
-        else:
-            requests = None
+        if requests or values:
+            raise_errors(self.__senders)
+            self.__start_senders()
+            # a spreadsheet always goes to the same sender, so its batches keep their order
+            sender = self.__senders[zlib.crc32(spreadsheet_id.encode('utf-8')) % len(self.__senders)]
+            sender.put((spreadsheet_id, requests, values))
+
+    def __post_batch(self, spreadsheet_id, requests, values):
+        """ send the requests of a spreadsheet as one batchUpdate, then its values """
 
         if requests:
             body = {"requests": requests}
-            self.__spreadsheets.batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
-
-    def __fit_sheet_rows(self, spreadsheet_id, sheet_id):
-        """ set the total number of rows to 1 by removing rows 2..1000 """
-
-        requests = [
-            delete_dimension_request(sheet_id, "ROWS", 1, SHEET_DEFAULT_ROWS)
+            self.__execute(self.__spreadsheets.batchUpdate(spreadsheetId=spreadsheet_id, body=body))
+
+        if values:
+            body = {
+                'valueInputOption': 'RAW',
+                'data': [
+                    {'range': a1_range(k['sheet'], f'A{k["start"] + 1}'), 'values': k['values']}
+                    for k in values
+                ]
+            }
+            self.__execute(self.__spreadsheets.values().batchUpdate(spreadsheetId=spreadsheet_id, body=body))
+
+    def __start_senders(self):
+        """ starts the sender threads once """
+
+        if self.__senders:
+            return
+        self.__senders = [
+            Worker(
+                f'google-sender-{index}',
+                lambda batch: self.__post_batch(*batch),
+                queue_size=StorageGoogleDrive.QUEUE_SIZE
+            ) for index in range(self.__concurrency)
         ]
 
-        body = {"requests": requests}
-        self.__spreadsheets.batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
+    def __execute(self, request, api='sheets'):
+        """ executes a request within the per user quota of the api """
+
+        return execute(request, self.__secret_file, api)
 
     def __get_dataset(self, spreadsheet_id, _range):
         """ return a list of accounts dictionaries """
 
         request = self.__spreadsheets.values().get(spreadsheetId=spreadsheet_id, range=_range)
-        return request.execute().get('values', [])
+        return self.__execute(request).get('values', [])
 
-    def __append_dataset(self, spreadsheet_id, sheet_id, sheet_data=[]):
-        """ append new rows to a sheet from a list (rows) of a list (columns) of values """
+    def __append_dataset(self, spreadsheet_id, sheet_name, sheet_data=[]):
+        """ queue new rows for a sheet from a list (rows) of a list (columns) of values """
 
         if sheet_data:
-            rows = [{"values": [cell_snippet(cell) for cell in row]} for row in sheet_data]
-
-            requests = [
-                append_cells_request(sheet_id, rows)
-            ]
+            sheet = self.__get_sheets(spreadsheet_id)[sheet_name]
+            start = sheet['rows']
+            sheet['rows'] += len(sheet_data)
 
-            body = {"requests": requests}
-            self.__spreadsheets.batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
+            if sheet['rows'] > sheet['grid_rows']:
+                self.__queue_requests(spreadsheet_id, [
+                    append_dimension_request(sheet['sheet_id'], 'ROWS', sheet['rows'] - sheet['grid_rows'])
+                ])
+                sheet['grid_rows'] = sheet['rows']
+
+            # the first value of a column decides its number format
+            for index, column in enumerate(sheet['header']):
+                if not column in sheet['formats']:
+                    value = next((row[index] for row in sheet_data[1 if start == 0 else 0:]
+                        if index < len(row) and not row[index] in [None, '']), None)
+                    if not value is None:
+                        sheet['formats'][column] = column_number_format(column, value)
+
+            values = [[value_snippet(cell) for cell in row] for row in sheet_data]
+            self.__queue_values(spreadsheet_id, sheet_name, start, values)
+
+    def __extend_header(self, spreadsheet_id, sheet, headers):
+        """ queue the grid columns and header cells needed by new columns """
+
+        requests = []
+        if len(headers) > sheet['columns']:
+            requests.append(
+                append_dimension_request(sheet['sheet_id'], 'COLUMNS', len(headers) - sheet['columns'])
+            )
+            sheet['columns'] = len(headers)
+        requests.append(update_header_request(sheet['sheet_id'], headers))
+        self.__queue_requests(spreadsheet_id, requests)
 
-    def __get_handle(self, spreadsheet_name, sheet_name):
-        """ return a (spreadsheet,sheet) handle and a flag if just created """
+    def __get_spreadsheet(self, spreadsheet_name):
+        """ return a spreadsheet id, the spreadsheet is created if needed """
 
         if not spreadsheet_name in self.__cache:
+            # nothing to look up in a run folder created by this run
             spreadsheet_id, just_created = self.__create_object(
-                'spreadsheet', spreadsheet_name, self.__run_folder_id)
+                'spreadsheet', spreadsheet_name, self.__run_folder_id, not self.__run_folder_created)
+            self.__get_sheets(spreadsheet_id, just_created)
             self.__cache.update({spreadsheet_name: spreadsheet_id})
-        else:
-            spreadsheet_id = self.__cache[spreadsheet_name]
+
+        return self.__cache[spreadsheet_name]
+
+    def __get_handle(self, spreadsheet_name, sheet_name, total_columns=None):
+        """ return a (spreadsheet,sheet) handle and a flag if just created """
+
+        spreadsheet_id = self.__get_spreadsheet(spreadsheet_name)
 
         if not (spreadsheet_name, sheet_name) in self.__cache:
-            sheet_id, just_created = self.__create_sheet(spreadsheet_id, sheet_name)
+            sheet_id, just_created = self.__create_sheet(spreadsheet_id, sheet_name, total_columns)
             self.__cache.update({(spreadsheet_name,sheet_name): (spreadsheet_id,sheet_id)})
         else:
             just_created = False
@@ -214,52 +355,202 @@ class StorageGoogleDrive():
 
         return accounts
 
-    def dump_data(self, spreadsheet_name, sheet_name, data=[]):
+    def dump_data(self, spreadsheet_name, sheet_name, data=[], constants={}):
         """ appends the data to the output spreadsheet/sheet """
 
+        if type(data) == list and len(data):
+            self.dump_batches(spreadsheet_name, sheet_name, [(constants, data)])
+
+    def __get_part(self, spreadsheet_name, sheet_name):
+        """ returns the (spreadsheet, sheet) part names currently written for a dataset """
+
+        # a new dataset starts in the last spreadsheet part of its master
+        spreadsheet_part, sheet_part = self.__parts.get(
+            (spreadsheet_name, sheet_name), (self.__last_parts.get(spreadsheet_name, 1), 1))
+        self.__parts[(spreadsheet_name, sheet_name)] = (spreadsheet_part, sheet_part)
+
+        return part_name(spreadsheet_name, spreadsheet_part), part_name(sheet_name, sheet_part)
+
+    def __roll_over(self, spreadsheet_name, sheet_name, new_spreadsheet, new_sheet=True):
+        """ moves a dataset to its next sheet, in the last spreadsheet part of its master
+
+            a sheet that was never created keeps its part when only the spreadsheet changes
+        """
+
+        spreadsheet_part, sheet_part = self.__parts[(spreadsheet_name, sheet_name)]
+        last_part = self.__last_parts.get(spreadsheet_name, 1)
+        if new_spreadsheet:
+            # another dataset may have opened a newer spreadsheet part already
+            last_part = last_part + 1 if spreadsheet_part == last_part else last_part
+            self.__last_parts[spreadsheet_name] = last_part
+            spreadsheet_part = last_part
+        self.__parts[(spreadsheet_name, sheet_name)] = (spreadsheet_part, sheet_part + (1 if new_sheet else 0))
+
+    def __get_room(self, spreadsheet_id, sheet, total_columns, extra_rows=0):
+        """ returns the number of rows that still fit in the (sheet, spreadsheet) cell limits """
+
+        sheets = self.__get_sheets(spreadsheet_id)
+        other_cells = sum(k['grid_rows'] * k['columns'] for k in sheets.values() if not k is sheet)
+        total_columns = max(total_columns, sheet['columns'])
+        used_rows = sheet['rows'] + extra_rows
+
+        sheet_room = StorageGoogleDrive.MAX_SHEET_CELLS // total_columns - used_rows
+        spreadsheet_room = (StorageGoogleDrive.MAX_SPREADSHEET_CELLS - other_cells) // total_columns - used_rows
+
+        return max(0, sheet_room), max(0, spreadsheet_room)
+
+    @timer(label_arg='sheet_name')
+    def dump_batches(self, spreadsheet_name, sheet_name, batches=[]):
+        """ appends (constants, rows) batches to the output spreadsheet/sheet """
+
         # creates the output folder on the first dump
         if not self.__run_folder_id:
-            self.__run_folder_id, _ = self.__create_object(
+            self.__run_folder_id, self.__run_folder_created = self.__create_object(
                 'folder',
                 self.__run_folder,
                 self.__output_folder_id
             )
 
-        if type(data) == list and len(data):
+        headers = get_columns(batches)
+        if not headers:
+            return
+
+        headers = extend_columns(headers, batches)
+        if 2 * len(headers) > StorageGoogleDrive.MAX_SHEET_CELLS:
+            abort(f'error: {sheet_name} rows are too wide for a Google Sheet')
+
+        rows = None
+        while True:
+            spreadsheet_part, sheet_part = self.__get_part(spreadsheet_name, sheet_name)
+
+            # a new sheet needs room for its header and one row, or it goes to the next spreadsheet
+            spreadsheet_id = self.__get_spreadsheet(spreadsheet_part)
+            sheets = self.__get_sheets(spreadsheet_id)
+            if not sheet_part in sheets:
+                total_cells = sum(k['grid_rows'] * k['columns'] for k in sheets.values())
+                if (StorageGoogleDrive.MAX_SPREADSHEET_CELLS - total_cells) // len(headers) < 2:
+                    self.__roll_over(spreadsheet_name, sheet_name, True, new_sheet=False)
+                    continue
+
             (spreadsheet_id, sheet_id), just_created = \
-                self.__get_handle(spreadsheet_name, sheet_name)
+                self.__get_handle(spreadsheet_part, sheet_part, len(headers))
+            sheet = self.__get_sheets(spreadsheet_id)[sheet_part]
+            sheet['dataset'] = (spreadsheet_name, sheet_name)
 
             if just_created:
-                headers = list(data[0].keys())
                 sheet_data = [headers]
-                self.__fit_sheet_columns(spreadsheet_id, sheet_id, len(headers))
+                sheet['rows'] = 0
             else:
+                # rows are aligned to the known header, new columns are appended to it
+                header = self.__get_header(spreadsheet_id, sheet_part)
+                headers = extend_columns(header, batches)
+                if len(headers) > len(header):
+                    self.__extend_header(spreadsheet_id, sheet, headers)
                 sheet_data = []
 
-            sheet_data.extend([list(row.values()) for row in data])
-            self.__append_dataset(spreadsheet_id, sheet_id, sheet_data)
+            sheet['header'] = headers
+            if rows is None:
+                rows = list(iter_values(batches, headers))
+
+            # rows that do not fit roll over to the next sheet or spreadsheet
+            sheet_room, spreadsheet_room = self.__get_room(spreadsheet_id, sheet, len(headers), len(sheet_data))
+            room = min(sheet_room, spreadsheet_room)
+
+            sheet_data.extend(rows[:room])
+            rows = rows[room:]
+            self.__append_dataset(spreadsheet_id, sheet_part, sheet_data)
+
+            if not rows:
+                break
 
+            self.__roll_over(spreadsheet_name, sheet_name, spreadsheet_room <= sheet_room)
+
+    def __write_index(self):
+        """ lists the parts of every rolled over dataset on an Index sheet of the first spreadsheet part
+
+            returns the (spreadsheet id, sheet id) of the Index sheets written
+        """
+
+        parts = {}
+        for k,v in self.__cache.items():
+            if type(k) == tuple:
+                (spreadsheet_part, sheet_part), (spreadsheet_id, sheet_id) = k, v
+                sheet = self.__get_sheets(spreadsheet_id)[sheet_part]
+                if 'dataset' in sheet:
+                    spreadsheet_name, sheet_name = sheet['dataset']
+                    parts.setdefault(spreadsheet_name, []).append([
+                        sheet_name, spreadsheet_part, sheet_part, max(0, sheet['rows'] - 1),
+                        f'https://docs.google.com/spreadsheets/d/{spreadsheet_id}/edit#gid={sheet_id}'
+                    ])
+
+        index_sheets = []
+        for spreadsheet_name, rows in parts.items():
+            if len(rows) == len(set(k[0] for k in rows)):
+                continue # nothing rolled over
+
+            spreadsheet_id = self.__cache[spreadsheet_name]
+            sheet_id, just_created = self.__create_sheet(spreadsheet_id, INDEX_SHEET_TITLE, len(INDEX_HEADERS))
+            sheet = self.__get_sheets(spreadsheet_id)[INDEX_SHEET_TITLE]
+            if not just_created:
+                # an Index sheet from an earlier run is rewritten, not read
+                self.__queue_requests(spreadsheet_id, [clear_values_request(sheet_id)])
+            sheet['header'] = INDEX_HEADERS
+            sheet['rows'] = 0
+            self.__append_dataset(spreadsheet_id, INDEX_SHEET_TITLE, [INDEX_HEADERS] + sorted(rows))
+            index_sheets.append((spreadsheet_id, sheet_id))
+
+        return index_sheets
+
+    def __send_all_requests(self):
+        """ hand the queued requests of every spreadsheet to the senders, without waiting """
+
+        for spreadsheet_id in list(set(self.__requests.keys()) | set(self.__values.keys())):
+            self.__send_requests(spreadsheet_id)
+
+    def flush(self):
+        """ send all queued requests """
+
+        self.__send_all_requests()
+
+        # wait for the senders
+        for sender in self.__senders:
+            sender.join()
+        raise_errors(self.__senders)
+
+    @timer()
     def format_data(self, pivots={}):
-        """ format all spreadsheets / sheets in the cache """
+        """ format all spreadsheets / sheets in the cache, from the local index only """
 
-        requests_queue = {}
-        for k,v in iter(self.__cache.items()):
+        index_sheets = self.__write_index()
+
+        # the rows still queued go out first, a spreadsheet always goes to the
+        # same sender so its formatting follows its values and columns are
+        # resized to them, while other spreadsheets are formatted concurrently
+        self.__send_all_requests()
+
+        for k,v in list(self.__cache.items()):
             if type(k) == tuple:
                 (_,sheet_name), (spreadsheet_id,sheet_id) = k, v
 
-                if not spreadsheet_id in requests_queue:
-                    requests_queue[spreadsheet_id] = []
-
-                # create a pivot table
-                pivot_sheet_name = sheet_name + 'Pivot'
-                pivot_sheet_id, _ = self.__create_sheet(spreadsheet_id, pivot_sheet_name)
-                headers = self.__get_dataset(spreadsheet_id, sheet_name + '!1:1')[0]
-                pivot = pivots.get(sheet_name, {})
-                pivot_table = pivot_table_snippet(sheet_id, pivot, headers)
+                sheet = self.__get_sheets(spreadsheet_id)[sheet_name]
+                headers = sheet['header']
+
+                # create a pivot table, only for datasets with a pivot definition
+                pivot = pivots.get(sheet['dataset'][1] if 'dataset' in sheet else sheet_name, {})
+                if pivot.get('values'):
+                    pivot_sheet_id, _ = self.__create_sheet(spreadsheet_id, sheet_name + 'Pivot')
+                    pivot_table = pivot_table_snippet(sheet_id, pivot, headers)
+                    self.__queue_requests(spreadsheet_id, [pivot_request(pivot_sheet_id, pivot_table)])
+
+                # one number format request per numeric column
+                formats = sheet['formats']
+                self.__queue_requests(spreadsheet_id, [
+                    number_format_request(sheet_id, index, formats[column])
+                    for index, column in enumerate(headers) if formats.get(column)
+                ])
 
                 # add all formatting requests to the queue
-                requests_queue[spreadsheet_id].extend([
-                    pivot_request(pivot_sheet_id, pivot_table),
+                self.__queue_requests(spreadsheet_id, [
                     basic_filter_request(sheet_id),
                     format_header_request(sheet_id),
                     freeze_rows_request(sheet_id),
@@ -270,11 +561,27 @@ class StorageGoogleDrive():
             else:
                 # remove Sheet1
                 spreadsheet_id = v
-                if not v in requests_queue:
-                    requests_queue[spreadsheet_id] = []
-                requests_queue[spreadsheet_id].append(delete_sheet_request(SHEET1_SHEET_ID))
+                sheets = self.__get_sheets(spreadsheet_id)
+                if SHEET1_TITLE in sheets and len(sheets) > 1:
+                    del sheets[SHEET1_TITLE]
+                    self.__queue_requests(spreadsheet_id, [delete_sheet_request(SHEET1_SHEET_ID)])
 
-        # post the batch request queue
-        for spreadsheet_id,requests in iter(requests_queue.items()):
-            body = {"requests": requests}
-            self.__spreadsheets.batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
\ No newline at end of file
+        for spreadsheet_id, sheet_id in index_sheets:
+            self.__queue_requests(spreadsheet_id, [
+                format_header_request(sheet_id),
+                freeze_rows_request(sheet_id),
+                auto_resize_dimension_request(sheet_id)
+            ])
+
+        # post the formatting queues, one batchUpdate per spreadsheet
+        self.flush()
+
+    def close(self):
+        """ send all queued requests and stop the senders """
+
+        try:
+            self.flush()
+        finally:
+            # the senders are stopped even when a send failed
+            stop_workers(self.__senders)
+            self.__senders = []
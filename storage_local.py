@@ -1,13 +1,36 @@
+import collections
 import csv
 import os
 import time
 
+from instrumentation import timer
+from row_batches import extend_columns, get_columns, iter_values
+from storage_local_writers import WRITERS, open_csv
+
+
+def abort(message):
+    """ abort the command """
+
+    print(message)
+    exit()
+
+
 class StorageLocal():
 
-    def __init__(self, account_file, output_folder, timestamp=None, prefix='RUN'):
+    OUTPUT_FORMATS = list(WRITERS.keys())
+    MAX_OPEN_FILES = 256 # least recently used files are closed above this cap
+
+    def __init__(self, account_file, output_folder, timestamp=None, prefix='RUN', output_format='csv',
+        max_open_files=MAX_OPEN_FILES):
         """ init """
 
-        self.__cache = {}
+        if not output_format in WRITERS:
+            abort(f'error: unsupported local output format {output_format}')
+
+        self.__cache = {} # name -> writer
+        self.__open = collections.OrderedDict() # names of writers holding a file handle, LRU first
+        self.__max_open_files = max(1, max_open_files)
+        self.__writer_class = WRITERS[output_format]
         self.__account_file = account_file
         self.__output_folder = \
             os.path.join(
@@ -18,17 +41,30 @@ class StorageLocal():
                 )
             )
 
-    def __get_handle(self, name):
-        """ returns a file handle from the cache or creates a new one """
+    def __get_writer(self, name):
+        """ returns a file writer from the cache or creates a new one """
 
         if not name in self.__cache:
-            handle = open(os.path.join(self.__output_folder, name + '.csv'), 'w')
-            self.__cache.update({name: handle})
-            just_created = True
+            writer = self.__writer_class(os.path.join(self.__output_folder, name))
+            self.__cache.update({name: writer})
+        else:
+            writer = self.__cache[name]
+            writer.resume()
+
+        return writer
+
+    def __track_handle(self, name, writer):
+        """ marks the writer as most recently used and closes the LRU ones above the cap """
+
+        if writer.is_open:
+            self.__open[name] = True
+            self.__open.move_to_end(name)
         else:
-            just_created = False
+            self.__open.pop(name, None)
 
-        return self.__cache[name], just_created
+        while len(self.__open) > self.__max_open_files:
+            lru_name, _ = self.__open.popitem(last=False)
+            self.__cache[lru_name].suspend()
 
     def get_accounts(self):
         """ returns a list of accounts dictionaries """
@@ -37,18 +73,66 @@ class StorageLocal():
             csv_reader = csv.DictReader(f, delimiter=',')
             return list(dict(row) for row in csv_reader)
 
-    def dump_data(self, master, output_file, data=[]):
+    def dump_data(self, master, output_file, data=[], constants={}):
         """ appends the data to the output file """
 
+        if type(data) == list and len(data):
+            self.dump_batches(master, output_file, [(constants, data)])
+
+    @timer(label_arg='output_file')
+    def dump_batches(self, master, output_file, batches=[]):
+        """ appends (constants, rows) batches to the output file """
+
         # creates the output folder on the first dump
         if not len(self.__cache) and not os.path.exists(self.__output_folder):
             os.mkdir(self.__output_folder, mode=0o755)
 
-        if type(data) == list and len(data):
-            handle, just_created = self.__get_handle(master + '_' + output_file)
-            csv_writer = csv.DictWriter(handle, fieldnames=data[0].keys())
-            if just_created:
-                csv_writer.writeheader()
-            for row in data:
-                csv_writer.writerow(row)
-            handle.flush()
\ No newline at end of file
+        columns = get_columns(batches)
+        if columns:
+            name = master + '_' + output_file
+            writer = self.__get_writer(name)
+            columns = extend_columns(writer.columns if writer.columns else columns, batches)
+            writer.write(columns, iter_values(batches, columns))
+            self.__track_handle(name, writer)
+
+    def close(self):
+        """ closes all output files """
+
+        for writer in self.__cache.values():
+            writer.close()
+        self.__cache = {}
+        self.__open.clear()
+
+
+def merge_run_folders(input_folders, output_folder):
+    """ merges per-shard run folders into one folder with unified CSV headers
+
+        plain and compressed CSV files are merged, columnar files are skipped
+    """
+
+    # collect the files and the union of their headers, in order of appearance
+    datasets = {}
+    for input_folder in input_folders:
+        for name in sorted(os.listdir(input_folder)):
+            if not name.endswith(('.csv', '.csv.gz', '.csv.zst')):
+                continue
+            path = os.path.join(input_folder, name)
+            with open_csv(path) as f:
+                header = next(csv.reader(f), [])
+            files, fieldnames = datasets.setdefault(name, ([], []))
+            files.append(path)
+            fieldnames.extend([k for k in header if not k in fieldnames])
+
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder, mode=0o755)
+
+    for name, (files, fieldnames) in iter(datasets.items()):
+        with open_csv(os.path.join(output_folder, name), 'w') as output:
+            csv_writer = csv.DictWriter(output, fieldnames=fieldnames, restval='')
+            csv_writer.writeheader()
+            for path in files:
+                with open_csv(path) as f:
+                    for row in csv.DictReader(f):
+                        csv_writer.writerow(row)
+
+    return list(datasets.keys())
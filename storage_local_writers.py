@@ -0,0 +1,315 @@
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import time
+
+
+def abort(message):
+    """ abort the command """
+
+    print(message)
+    exit()
+
+
+def import_optional(module_name, output_format):
+    """ imports an optional dependency or aborts with an install hint """
+
+    try:
+        return __import__(module_name, fromlist=['_'])
+    except ImportError:
+        package = module_name.split('.')[0]
+        abort(f'error: {output_format} output requires the {package} package (pip install {package})')
+
+
+class CsvWriter():
+    """ CSV file written through a large buffer, with a growing header
+
+        the header is taken from the first write; columns showing up later
+        are appended to the rows and the header is rewritten on close, so
+        earlier rows are just shorter; the buffer is flushed when full or
+        when FLUSH_SECONDS have passed since the last flush; suspend() closes
+        the file handle and resume() reopens it in append mode
+    """
+
+    EXTENSION = '.csv'
+    BUFFER_SIZE = 1024 * 1024
+    FLUSH_SECONDS = 30
+
+    def __init__(self, path):
+        """ init """
+
+        self.path = path + self.EXTENSION
+        self.columns = None
+        self._header = None
+        self._handle = self._open()
+        self._writer = csv.writer(self._handle)
+        self._flushed = time.time()
+
+    def _open(self, mode='w'):
+        """ returns a text handle on the output file """
+
+        return open(self.path, mode, newline='', buffering=self.BUFFER_SIZE)
+
+    @property
+    def is_open(self):
+        return self._handle is not None
+
+    def suspend(self):
+        """ closes the file handle, the header is kept """
+
+        if self._handle:
+            self._handle.close()
+            self._handle = None
+            self._writer = None
+
+    def resume(self):
+        """ reopens the file handle in append mode """
+
+        if not self._handle:
+            self._handle = self._open('a')
+            self._writer = csv.writer(self._handle)
+
+    def write(self, columns, values):
+        """ writes lists of values aligned to the columns """
+
+        if self._header is None:
+            self._header = list(columns)
+            self._writer.writerow(self._header)
+        self.columns = list(columns)
+        self._writer.writerows(values)
+
+        if time.time() - self._flushed > self.FLUSH_SECONDS:
+            self._handle.flush()
+            self._flushed = time.time()
+
+    def _rewrite_header(self):
+        """ copies the file to a new one starting with the final header """
+
+        # keep the extension so the same codec is used
+        temp_path = self.path[:-len(self.EXTENSION)] + '.tmp' + self.EXTENSION
+        with open_csv(self.path) as source, open_csv(temp_path, 'w') as target:
+            next(csv.reader(source), None)
+            csv.writer(target).writerow(self.columns)
+            shutil.copyfileobj(source, target, self.BUFFER_SIZE)
+        os.replace(temp_path, self.path)
+        self._header = list(self.columns)
+
+    def close(self):
+        """ closes the output file, rewriting the header if columns were added """
+
+        self.suspend()
+        if self._header is not None and self.columns != self._header:
+            self._rewrite_header()
+
+
+class GzipCsvWriter(CsvWriter):
+    """ gzip compressed CSV file """
+
+    EXTENSION = '.csv.gz'
+    COMPRESS_LEVEL = 6
+
+    def _open(self, mode='w'):
+        return gzip.open(self.path, mode + 't', newline='', compresslevel=self.COMPRESS_LEVEL)
+
+
+class ZstdCsvWriter(CsvWriter):
+    """ zstandard compressed CSV file """
+
+    EXTENSION = '.csv.zst'
+    COMPRESS_LEVEL = 3
+
+    def _open(self, mode='w'):
+        zstandard = import_optional('zstandard', 'csv.zst')
+        compressor = zstandard.ZstdCompressor(level=self.COMPRESS_LEVEL)
+        stream = compressor.stream_writer(open(self.path, mode + 'b'), closefd=True)
+        return io.TextIOWrapper(stream, newline='', encoding='utf-8')
+
+
+def open_csv(path, mode='r'):
+    """ opens a plain or compressed CSV file in text mode, by extension """
+
+    if path.endswith(GzipCsvWriter.EXTENSION):
+        return gzip.open(path, mode + 't', newline='')
+    elif path.endswith(ZstdCsvWriter.EXTENSION):
+        zstandard = import_optional('zstandard', 'csv.zst')
+        if 'r' in mode:
+            # appended files hold one zstd frame per reopen
+            stream = zstandard.ZstdDecompressor().stream_reader(
+                open(path, 'rb'), read_across_frames=True, closefd=True)
+        else:
+            stream = zstandard.ZstdCompressor().stream_writer(open(path, 'wb'), closefd=True)
+        return io.TextIOWrapper(stream, newline='', encoding='utf-8')
+    else:
+        return open(path, mode, newline='')
+
+
+def arrow_type_of(pa, value):
+    """ maps a python value to the arrow type used for its column """
+
+    if type(value) == bool:
+        return pa.bool_()
+    elif type(value) in [int, float]:
+        return pa.float64()
+    else:
+        return pa.string()
+
+
+def arrow_fits(pa, arrow_type, value):
+    """ True when the value can be stored in a column of the arrow type without loss """
+
+    if value is None or value == '' or arrow_type == pa.string():
+        return True
+    elif arrow_type == pa.bool_():
+        return type(value) == bool
+    elif arrow_type == pa.float64():
+        return type(value) in [int, float]
+    else:
+        return False
+
+
+def arrow_converter(pa, arrow_type):
+    """ returns a function coercing python values to the arrow type, None when they do not fit """
+
+    if arrow_type == pa.bool_():
+        return lambda v: v if type(v) == bool else None
+    elif arrow_type == pa.float64():
+        return lambda v: float(v) if type(v) in [int, float] else None
+    else:
+        return lambda v: v if type(v) == str or v is None else json.dumps(v)
+
+
+class ParquetWriter():
+    """ Parquet file written in row groups
+
+        rows are buffered until ROW_GROUP_SIZE and written as one row group;
+        the schema is inferred from the first row group (bool, float64 for
+        all numbers, string for everything else); a file cannot be reopened
+        for append and has one schema, so once suspended, or once a row group
+        brings new columns or values that do not fit their column type, the
+        next row groups go to a new part file (name-1.parquet, ...) with the
+        evolved schema, where misfit columns become strings; nothing is
+        dropped
+    """
+
+    EXTENSION = '.parquet'
+    ROW_GROUP_SIZE = 50000
+
+    def __init__(self, path, row_group_size=ROW_GROUP_SIZE):
+        """ init """
+
+        self._pa = import_optional('pyarrow', self.EXTENSION[1:])
+        self._base_path = path
+        self._part = 0
+        self.path = path + self.EXTENSION
+        self.columns = None
+        self._schema = None
+        self._writer = None
+        self._rows = []
+        self._row_group_size = row_group_size
+
+    def _infer_schema(self):
+        """ returns the schema of the buffered rows, evolved from the current one """
+
+        pa = self._pa
+        fields = list(self._schema) if self._schema else []
+        for index, column in enumerate(self.columns):
+            if index < len(fields):
+                # a column keeps its type unless a value does not fit it
+                field = fields[index]
+                if not all(arrow_fits(pa, field.type, row[index]) for row in self._rows):
+                    fields[index] = pa.field(column, pa.string())
+            else:
+                value = next((row[index] for row in self._rows if not row[index] in [None, '']), None)
+                arrow_type = arrow_type_of(pa, value)
+                if not all(arrow_fits(pa, arrow_type, row[index]) for row in self._rows):
+                    arrow_type = pa.string()
+                fields.append(pa.field(column, arrow_type))
+        return pa.schema(fields)
+
+    def _open(self, schema):
+        """ returns an arrow writer on the output file """
+
+        parquet = import_optional('pyarrow.parquet', 'parquet')
+        return parquet.ParquetWriter(self.path, schema)
+
+    @property
+    def is_open(self):
+        return self._writer is not None
+
+    def suspend(self):
+        """ closes the current part file, buffered rows are kept in memory """
+
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+            self._part += 1
+            self.path = f'{self._base_path}-{self._part}{self.EXTENSION}'
+
+    def resume(self):
+        """ the next part file is opened with the next row group """
+
+        pass
+
+    def _flush(self):
+        """ writes the buffered rows as one row group """
+
+        if not self._rows:
+            return
+
+        # rows written before new columns showed up are shorter
+        width = len(self.columns)
+        self._rows = [row if len(row) == width else list(row) + [None] * (width - len(row))
+            for row in self._rows]
+
+        pa = self._pa
+        schema = self._infer_schema()
+        if self._schema is not None and not schema.equals(self._schema):
+            self.suspend() # a part file has one schema
+        self._schema = schema
+        if self._writer is None:
+            self._writer = self._open(self._schema)
+
+        arrays = []
+        for index, field in enumerate(self._schema):
+            convert = arrow_converter(pa, field.type)
+            arrays.append(pa.array([convert(row[index]) for row in self._rows], type=field.type))
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self._schema))
+        self._rows = []
+
+    def write(self, columns, values):
+        """ buffers lists of values aligned to the columns """
+
+        self.columns = list(columns)
+        self._rows.extend(values)
+        if len(self._rows) >= self._row_group_size:
+            self._flush()
+
+    def close(self):
+        """ writes the pending row group and closes the output file """
+
+        self._flush()
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+
+
+class ArrowWriter(ParquetWriter):
+    """ Arrow IPC file written in record batches """
+
+    EXTENSION = '.arrow'
+
+    def _open(self, schema):
+        ipc = import_optional('pyarrow.ipc', 'arrow')
+        return ipc.new_file(self.path, schema)
+
+
+WRITERS = {
+    'csv': CsvWriter,
+    'csv.gz': GzipCsvWriter,
+    'csv.zst': ZstdCsvWriter,
+    'parquet': ParquetWriter,
+    'arrow': ArrowWriter
+}
@@ -1,35 +1,73 @@
 import csv
+import gzip
 import json
+import queue
 import requests
+import threading
+import time
+
+from http_session import get_session
+from instrumentation import timed, timer
+from insights_spool import InsightsSpool
+from row_batches import iter_rows
+from worker_threads import Worker, raise_errors, stop_workers
 
 
 class StorageNewRelicInsights():
+    """ inserts events through the Insights collector, in the background
+
+        rejected chunks go to the spool folder, when set, to be replayed later
+    """
 
-    INSIGHTS_MAX_EVENTS = 1000
+    MAX_PAYLOAD_BYTES = 1000000 # collector limit, compressed
+    MAX_RAW_BYTES = 5000000 # uncompressed budget of one chunk
+    COMPRESS_LEVEL = 6
     MAX_RETRIES = 5 # max number of requests before giving up
+    BACKOFF_SECONDS = 1 # wait before the first retry, doubled on every retry
+    CONCURRENCY = 4 # max number of in-flight requests
+    FLUSH_SECONDS = 10 # max age of the pending chunk
+    QUEUE_SIZE = 16 # max number of chunks waiting for a sender
 
-    def __init__(self, account_file, insert_account_id, insert_api_key, timestamp=None):
+    def __init__(self, account_file, insert_account_id, insert_api_key, timestamp=None,
+        concurrency=CONCURRENCY, flush_seconds=FLUSH_SECONDS, spool_folder=None):
         """ init """
 
         self.__account_file = account_file
         self.__headers = {
             'Content-Type': 'application/json',
+            'Content-Encoding': 'gzip',
             'X-Insert-Key': insert_api_key
         }
         self.__url = f'https://insights-collector.newrelic.com/v1/accounts/{insert_account_id}/events'
         self.__timestamp = timestamp
+        self.__concurrency = max(1, concurrency)
+        self.__flush_seconds = flush_seconds
+        self.__spool = InsightsSpool(spool_folder) if spool_folder else None
+
+        self.__lock = threading.Lock()
+        self.__expiry_lock = threading.Lock() # held while an expired chunk is sent outside the queue
+        self.__max_retries = StorageNewRelicInsights.MAX_RETRIES
+        self.__pending = [] # JSON encoded events not queued yet
+        self.__pending_size = 2 # brackets
+        self.__pending_since = None
+        self.__chunks = queue.Queue(maxsize=StorageNewRelicInsights.QUEUE_SIZE)
+        self.__senders = [] # started on the first dump
+        self.__counts = {'accepted': 0, 'rejected': 0, 'retried': 0, 'spooled': 0}
+
+    def __get_events(self, event_type, batches=[]):
+        """ returns an events iterator, eventType and timestamp first """
+
+        metadata = {'eventType': event_type}
+        if self.__timestamp:
+            metadata['timestamp'] = self.__timestamp
 
-    def __get_events(self, event_type, data=[]):
-        """ inject the metadata at the beginning of the dictionary """
+        _batches = []
+        for constants, rows in batches:
+            _constants = dict(metadata)
+            _constants.update(constants)
+            _batches.append((_constants, rows))
 
-        events = []
-        for row in data:
-            _row = {'eventType': event_type}
-            if self.__timestamp:
-                _row['timestamp'] = self.__timestamp
-            _row.update(row)
-            events.append(_row)
-        return events
+        return iter_rows(_batches)
 
     def get_accounts(self):
         """ returns a list of accounts dictionaries """
@@ -38,24 +76,156 @@ class StorageNewRelicInsights():
             csv_reader = csv.DictReader(f, delimiter=',')
             return list(dict(row) for row in csv_reader)
 
-    def dump_data(self, master, event_type, data=[], max_retries=MAX_RETRIES):
+    def __compress(self, chunk):
+        """ returns the gzip compressed JSON array of the encoded events """
+
+        payload = ('[' + ','.join(chunk) + ']').encode('utf-8')
+        return gzip.compress(payload, StorageNewRelicInsights.COMPRESS_LEVEL)
+
+    def __post(self, payload, max_retries=MAX_RETRIES):
+        """ posts one compressed payload, returns (accepted, number of requests) """
+
+        count_retries = 0
+        while count_retries < max_retries:
+            if count_retries:
+                time.sleep(StorageNewRelicInsights.BACKOFF_SECONDS * 2 ** (count_retries - 1))
+            try:
+                count_retries += 1
+                with timed('storage_newrelic_insights.post'):
+                    response = get_session().post(self.__url, data=payload, headers=self.__headers)
+                if response.status_code == requests.codes.ok:
+                    return True, count_retries
+            except:
+                pass
+
+        return False, count_retries
+
+    def __send(self, chunk, max_retries=MAX_RETRIES):
+        """ sends a chunk of encoded events, halving it until it fits in one payload """
+
+        payload = self.__compress(chunk)
+        if len(payload) > StorageNewRelicInsights.MAX_PAYLOAD_BYTES and len(chunk) > 1:
+            half = len(chunk) // 2
+            self.__send(chunk[:half], max_retries)
+            self.__send(chunk[half:], max_retries)
+            return
+
+        accepted, count_requests = self.__post(payload, max_retries)
+        if not accepted and self.__spool:
+            self.__spool.append(chunk)
+        with self.__lock:
+            self.__counts['accepted' if accepted else 'rejected'] += len(chunk)
+            self.__counts['retried'] += len(chunk) * (count_requests - 1)
+            if not accepted and self.__spool:
+                self.__counts['spooled'] += len(chunk)
+
+    def __take_pending(self, expired_only=False):
+        """ returns the pending chunk and starts a new one, None when there is nothing to take """
+
+        with self.__lock:
+            if not self.__pending:
+                return None
+            if expired_only and time.time() - self.__pending_since < self.__flush_seconds:
+                return None
+            chunk = self.__pending
+            self.__pending, self.__pending_size, self.__pending_since = [], 2, None
+            return chunk
+
+    def __send_expired(self):
+        """ sends the pending chunk once it expires, called by idle senders """
+
+        with self.__expiry_lock:
+            chunk = self.__take_pending(expired_only=True)
+            if chunk:
+                self.__send(chunk, self.__max_retries)
+
+    def __start_senders(self, max_retries):
+        """ starts the sender threads once, they all drain the same queue """
+
+        self.__max_retries = max_retries
+        if self.__senders:
+            return
+        self.__senders = [
+            Worker(
+                f'insights-sender-{index}',
+                lambda item: self.__send(*item),
+                items=self.__chunks,
+                stop_on_error=False,
+                on_idle=self.__send_expired
+            ) for index in range(self.__concurrency)
+        ]
+
+    def dump_data(self, master, event_type, data=[], constants={}, max_retries=MAX_RETRIES):
         """ appends the data to the event """
 
         if type(data) == list and data:
-            events = self.__get_events(event_type, data)
-
-            for i in range(0, len(events), StorageNewRelicInsights.INSIGHTS_MAX_EVENTS):
-                data_chunk = events[i:i+StorageNewRelicInsights.INSIGHTS_MAX_EVENTS]
-                succeeded = False
-                count_retries = 0
-                while not succeeded and count_retries < max_retries:
-                    try:
-                        count_retries += 1
-                        response = requests.post(
-                            self.__url,
-                            data=json.dumps(data_chunk),
-                            headers=self.__headers
-                        )
-                        succeeded = (response.status_code == requests.codes.ok)
-                    except:
-                        succeeded = False
\ No newline at end of file
+            self.dump_batches(master, event_type, [(constants, data)], max_retries)
+
+    @timer(label_arg='event_type')
+    def dump_batches(self, master, event_type, batches=[], max_retries=MAX_RETRIES):
+        """ queues (constants, rows) batches to be inserted, blocks while the queue is full """
+
+        if batches:
+            # ascii only JSON, one char per byte
+            self.dump_encoded(
+                (json.dumps(event) for event in self.__get_events(event_type, batches)),
+                max_retries
+            )
+
+    def dump_encoded(self, events, max_retries=MAX_RETRIES):
+        """ queues JSON encoded events to be inserted, used to replay the spool """
+
+        raise_errors(self.__senders)
+        self.__start_senders(max_retries)
+        for encoded in events:
+            chunk = None
+            with self.__lock:
+                if self.__pending and self.__pending_size + len(encoded) + 1 > StorageNewRelicInsights.MAX_RAW_BYTES:
+                    chunk = self.__pending
+                    self.__pending, self.__pending_size = [], 2
+                if not self.__pending:
+                    self.__pending_since = time.time()
+                self.__pending.append(encoded)
+                self.__pending_size += len(encoded) + 1 # comma
+
+            # never block on the queue while holding the lock
+            if chunk:
+                self.__chunks.put((chunk, max_retries))
+
+    def flush(self):
+        """ queues the pending chunk and waits until every queued chunk is sent """
+
+        # waits for an expired chunk being sent by a sender
+        with self.__expiry_lock:
+            chunk = self.__take_pending()
+        if chunk:
+            self.__chunks.put((chunk, self.__max_retries))
+        self.__chunks.join()
+        raise_errors(self.__senders)
+
+    def get_counts(self):
+        """ returns the accepted, rejected and retried event counts so far """
+
+        with self.__lock:
+            return dict(self.__counts)
+
+    def close(self):
+        """ sends everything, stops the senders and reports the event counts """
+
+        if not self.__senders:
+            return
+
+        try:
+            self.flush()
+        finally:
+            # the senders are stopped even when a send failed
+            stop_workers(self.__senders)
+            self.__senders = []
+
+            if self.__spool:
+                self.__spool.close()
+
+        counts = self.get_counts()
+        print('insights: {} events accepted, {} rejected, {} retried, {} spooled'.format(
+            counts['accepted'], counts['rejected'], counts['retried'], counts['spooled']
+        ))
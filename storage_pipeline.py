@@ -0,0 +1,64 @@
+from worker_threads import Worker, raise_errors, stop_workers
+
+
+class StoragePipeline():
+    """ decouples data collection from storage writes
+
+        every dump_data call is queued to one bounded queue per storage and
+        a dedicated writer thread per storage drains it, so a slow storage
+        only stalls the collection loop once its queue is full; a failing
+        storage stops writing but the others carry on, and close() raises
+        the first error once every storage is flushed
+    """
+
+    QUEUE_SIZE = 32 # max number of pending batches per storage
+
+    def __init__(self, storages, queue_size=QUEUE_SIZE):
+        """ init """
+
+        self.__writers = [
+            Worker(
+                f'writer-{type(storage).__name__}',
+                lambda batch, storage=storage: storage.dump_data(*batch),
+                queue_size=queue_size,
+                # write-behind buffers get their final flush on the writer thread
+                on_stop=getattr(storage, 'flush', None)
+            ) for storage in storages if storage
+        ]
+
+    def dump_data(self, master, output_file, data=[], constants={}):
+        """ queues the data to the healthy storages, blocks while any queue is full """
+
+        # the collection only stops when there is no storage left to write to
+        if self.__writers and all(writer.errors for writer in self.__writers):
+            raise_errors(self.__writers)
+
+        for writer in self.__writers:
+            if not writer.errors:
+                writer.put((master, output_file, data, constants))
+
+    def close(self):
+        """ waits for all queued batches to be written and stops the writers """
+
+        writers, self.__writers = self.__writers, []
+        stop_workers(writers)
+        raise_errors(writers)
+
+
+def close_storages(storages):
+    """ closes every storage, even after an error, and raises the first error
+
+        each storage gets to flush or spool its pending writes on its own
+    """
+
+    errors = []
+    for storage in storages:
+        if storage:
+            try:
+                storage.close()
+            except BaseException as error:
+                # abort() raises SystemExit, the other storages still close
+                errors.append(error)
+
+    if errors:
+        raise errors[0]
@@ -0,0 +1,137 @@
+import csv
+import json
+import sqlite3
+import time
+
+from instrumentation import timer
+from row_batches import extend_columns, get_columns, iter_values
+
+
+def quote(identifier):
+    """ quotes an SQLite identifier """
+
+    return '"' + str(identifier).replace('"', '""') + '"'
+
+
+def to_sqlite(value):
+    """ converts a value to an SQLite friendly type """
+
+    if value is None or type(value) in [int, float, str, bytes]:
+        return value
+    elif type(value) == bool:
+        return int(value)
+    else:
+        return json.dumps(value)
+
+
+class StorageSQLite():
+    """ one SQLite table per dataset, kept across runs in the same database file
+
+        every row is stored with its master name and the run timestamp,
+        columns are added as new attributes show up, attributes differing
+        only by case from an existing column, or named like the master and
+        run_timestamp columns, get a _2, _3, ... suffix since SQLite names
+        are case insensitive, inserts are bulk
+        executemany calls in one transaction per dump and every table with
+        an account_id column is indexed by (account_id, run_timestamp)
+    """
+
+    RESERVED_COLUMNS = ['master', 'run_timestamp'] # written by the storage itself
+
+    def __init__(self, account_file, database_file, timestamp=None):
+        """ init """
+
+        self.__account_file = account_file
+        self.__timestamp = int(timestamp if timestamp else time.time())
+        self.__tables = {} # table -> list of columns
+        self.__names = {} # table -> {attribute: column}
+
+        # the storage pipeline writes from its own thread
+        self.__connection = sqlite3.connect(database_file, check_same_thread=False)
+        self.__connection.execute('PRAGMA journal_mode=WAL')
+        self.__connection.execute('PRAGMA synchronous=NORMAL')
+
+    def __get_columns(self, table):
+        """ returns the table columns, creating the table when missing """
+
+        if not table in self.__tables:
+            self.__connection.execute(
+                f'CREATE TABLE IF NOT EXISTS {quote(table)} (master TEXT, run_timestamp INTEGER)'
+            )
+            cursor = self.__connection.execute(f'PRAGMA table_info({quote(table)})')
+            self.__tables[table] = [row[1] for row in cursor.fetchall()]
+
+        return self.__tables[table]
+
+    def __add_columns(self, table, attributes):
+        """ returns the columns of the attributes, adding the missing ones to the table
+
+            the table is indexed once account_id shows up
+        """
+
+        existing = self.__get_columns(table)
+        names = self.__names.setdefault(table, {})
+        columns = []
+        for attribute in attributes:
+            if not attribute in names:
+                # an exact match is the same column, a case insensitive one or
+                # a reserved column is another attribute
+                lowered = {k.lower(): k for k in existing}
+                column, suffix = str(attribute), 1
+                while column.lower() in lowered and (lowered[column.lower()] != column or \
+                    column.lower() in StorageSQLite.RESERVED_COLUMNS):
+                    suffix += 1
+                    column = f'{attribute}_{suffix}'
+
+                if not column in existing:
+                    self.__connection.execute(f'ALTER TABLE {quote(table)} ADD COLUMN {quote(column)}')
+                    existing.append(column)
+                    if column == 'account_id':
+                        self.__connection.execute(
+                            f'CREATE INDEX IF NOT EXISTS {quote("idx_" + table + "_account_run")} '
+                            f'ON {quote(table)} (account_id, run_timestamp)'
+                        )
+                names[attribute] = column
+            columns.append(names[attribute])
+
+        return columns
+
+    def get_accounts(self):
+        """ returns a list of accounts dictionaries """
+
+        with open(self.__account_file) as f:
+            csv_reader = csv.DictReader(f, delimiter=',')
+            return list(dict(row) for row in csv_reader)
+
+    def dump_data(self, master, output_file, data=[], constants={}):
+        """ inserts the data in the dataset table """
+
+        if type(data) == list and len(data):
+            self.dump_batches(master, output_file, [(constants, data)])
+
+    @timer(label_arg='output_file')
+    def dump_batches(self, master, output_file, batches=[]):
+        """ inserts (constants, rows) batches in the dataset table, in one transaction """
+
+        columns = get_columns(batches)
+        if not columns:
+            return
+
+        columns = extend_columns(columns, batches)
+        with self.__connection:
+            table_columns = self.__add_columns(output_file, columns)
+            statement = 'INSERT INTO {} (master, run_timestamp, {}) VALUES (?, ?, {})'.format(
+                quote(output_file),
+                ', '.join(quote(k) for k in table_columns),
+                ', '.join('?' for _ in columns)
+            )
+            self.__connection.executemany(
+                statement,
+                ([master, self.__timestamp] + [to_sqlite(v) for v in values]
+                    for values in iter_values(batches, columns, None))
+            )
+
+    def close(self):
+        """ closes the database connection """
+
+        self.__connection.close()
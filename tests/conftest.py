@@ -0,0 +1,16 @@
+import os
+import sys
+import types
+
+# the modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# the tests replace every http session, so without requests installed the
+# modules only need the names they read at import and on responses
+try:
+    import requests
+except ImportError:
+    requests = types.ModuleType('requests')
+    requests.codes = types.SimpleNamespace(ok=200)
+    requests.Session = None
+    sys.modules['requests'] = requests
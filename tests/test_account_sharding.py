@@ -0,0 +1,41 @@
+import pytest
+
+from account_sharding import parse_shard, shard_accounts
+
+
+ACCOUNTS = [{'account_id': str(k), 'cost': str(k % 7 + 1)} for k in range(100)]
+
+
+def test_parse_shard():
+    assert parse_shard('2/4') == (2, 4)
+    for shard in ['0/4', '5/4', '4', 'a/b']:
+        with pytest.raises(SystemExit):
+            parse_shard(shard)
+
+
+def test_no_shard_returns_all_accounts():
+    assert shard_accounts(ACCOUNTS) is ACCOUNTS
+
+
+@pytest.mark.parametrize('weight_key', [None, 'cost'])
+def test_shards_partition_the_accounts_in_order(weight_key):
+    shards = [shard_accounts(ACCOUNTS, f'{k}/3', weight_key) for k in range(1, 4)]
+
+    ids = [account['account_id'] for shard in shards for account in shard]
+    assert sorted(ids, key=int) == [account['account_id'] for account in ACCOUNTS]
+    for shard in shards:
+        assert shard == [account for account in ACCOUNTS if account in shard]
+
+
+def test_weighted_shards_are_balanced():
+    loads = [
+        sum(float(account['cost']) for account in shard_accounts(ACCOUNTS, f'{k}/4', 'cost'))
+        for k in range(1, 5)
+    ]
+    assert max(loads) - min(loads) <= 7
+
+
+def test_hash_shard_is_stable_across_list_order():
+    shard = shard_accounts(ACCOUNTS, '1/3')
+    reversed_shard = shard_accounts(list(reversed(ACCOUNTS)), '1/3')
+    assert sorted(k['account_id'] for k in shard) == sorted(k['account_id'] for k in reversed_shard)
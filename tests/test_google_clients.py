@@ -0,0 +1,81 @@
+import sys
+import types
+
+import google_clients
+from google_clients import DiscoveryFileCache, build_service, get_rate_limiter, get_service, is_retryable
+
+
+def test_discovery_documents_are_cached_on_disk(tmp_path):
+    cache = DiscoveryFileCache(str(tmp_path / 'discovery'))
+    assert cache.get('https://sheets/v4') is None
+
+    cache.set('https://sheets/v4', '{"name": "sheets"}')
+    assert DiscoveryFileCache(str(tmp_path / 'discovery')).get('https://sheets/v4') == '{"name": "sheets"}'
+
+
+def fake_discovery(monkeypatch, build):
+    discovery = types.ModuleType('googleapiclient.discovery')
+    discovery.build = build
+    package = types.ModuleType('googleapiclient')
+    package.discovery = discovery
+    monkeypatch.setitem(sys.modules, 'googleapiclient', package)
+    monkeypatch.setitem(sys.modules, 'googleapiclient.discovery', discovery)
+
+
+def test_services_are_built_from_bundled_documents(monkeypatch):
+    calls = []
+
+    def build(name, version, credentials=None, static_discovery=None, cache=None):
+        calls.append((name, static_discovery, cache))
+        return 'service'
+
+    fake_discovery(monkeypatch, build)
+    assert build_service('sheets', 'v4', 'credentials') == 'service'
+    assert calls == [('sheets', True, None)]
+
+
+def test_older_clients_fall_back_to_the_file_cache(monkeypatch):
+    calls = []
+
+    def build(name, version, credentials=None, cache=None):
+        calls.append((name, cache))
+        return 'service'
+
+    fake_discovery(monkeypatch, build)
+    assert build_service('drive', 'v3', 'credentials') == 'service'
+    assert isinstance(calls[0][1], DiscoveryFileCache)
+
+
+def test_services_are_built_once_per_process(monkeypatch, tmp_path):
+    built = []
+    monkeypatch.setattr(google_clients, 'get_credentials', lambda secret_file: 'credentials')
+    monkeypatch.setattr(google_clients, 'build_service', lambda *args: built.append(args) or object())
+
+    secret_file = str(tmp_path / 'secret.json')
+    service = get_service(secret_file, 'sheets', 'v4')
+    assert get_service(secret_file, 'sheets', 'v4') is service
+    assert not get_service(secret_file, 'drive', 'v3') is service
+    assert built == [('sheets', 'v4', 'credentials'), ('drive', 'v3', 'credentials')]
+
+
+class HttpError(Exception):
+    def __init__(self, status, content=b''):
+        self.resp = types.SimpleNamespace(status=status)
+        self.content = content
+
+
+def test_quota_and_server_errors_are_retried():
+    assert is_retryable(HttpError(429))
+    assert is_retryable(HttpError(503))
+    assert is_retryable(HttpError(403, b'{"reason": "userRateLimitExceeded"}'))
+    assert not is_retryable(HttpError(403, b'{"reason": "forbidden"}'))
+    assert not is_retryable(HttpError(404))
+
+
+def test_the_quota_is_shared_per_user_and_api(tmp_path):
+    secret_file = str(tmp_path / 'secret.json')
+    sheets = get_rate_limiter(secret_file, 'sheets')
+
+    assert get_rate_limiter(secret_file, 'sheets') is sheets
+    assert not get_rate_limiter(secret_file, 'drive') is sheets
+    assert not get_rate_limiter(str(tmp_path / 'other.json'), 'sheets') is sheets
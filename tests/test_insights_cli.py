@@ -0,0 +1,67 @@
+import importlib.util
+import io
+import json
+import os
+
+import pytest
+
+import newrelic_query_api
+
+spec = importlib.util.spec_from_file_location(
+    'insights_cli', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'insights-cli.py')
+)
+insights_cli = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(insights_cli)
+
+EVENTS = [{'a': 1, 'b': 'x'}, {'a': 2, 'c': True}]
+
+
+def streamed(f):
+    """ yields the events, checking each one is written before the next is produced """
+
+    for index, event in enumerate(EVENTS):
+        assert f.getvalue().count('\n') >= index
+        yield event
+
+
+def test_ndjson_is_streamed():
+    f = io.StringIO()
+    insights_cli.write_ndjson(streamed(f), f)
+
+    assert [json.loads(line) for line in f.getvalue().splitlines()] == EVENTS
+
+
+def test_compact_json_is_one_array():
+    f = io.StringIO()
+    insights_cli.write_json_compact(iter(EVENTS), f)
+
+    assert f.getvalue() == '[{"a":1,"b":"x"},{"a":2,"c":true}]\n'
+    assert json.loads(f.getvalue()) == EVENTS
+
+
+def test_csv_has_the_union_of_the_columns():
+    f = io.StringIO()
+    insights_cli.write_csv(iter(EVENTS), f)
+
+    assert f.getvalue().splitlines() == ['a,b,c', '1,x,', '2,,True']
+
+
+class FailingAPI():
+    def __init__(self, account_id, query_api_key):
+        pass
+
+    def iter_events(self, nrql, include={}):
+        yield {'a': 1}
+        raise KeyError('timeSeries')
+
+
+def test_fetch_errors_are_not_reported_as_write_errors(monkeypatch, tmp_path, capsys):
+    monkeypatch.setattr(newrelic_query_api, 'NewRelicQueryAPI', FailingAPI)
+
+    with pytest.raises(SystemExit):
+        insights_cli.do_query(
+            query='SELECT * FROM Transaction', account_id='1', query_api_key='key',
+            output_file=str(tmp_path / 'events.ndjson'), output_format='ndjson'
+        )
+
+    assert 'cannot fetch the events' in capsys.readouterr().out
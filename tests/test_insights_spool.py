@@ -0,0 +1,15 @@
+from insights_spool import InsightsSpool, iter_segment
+
+
+def test_segments_are_rotated_and_replayed_in_order(tmp_path):
+    spool = InsightsSpool(str(tmp_path), max_segment_bytes=10)
+    spool.append(['{"a":1}', '{"a":2}'])
+    spool.append([])
+    spool.append(['{"a":3}'])
+    spool.close()
+
+    segments = spool.get_segments()
+    assert len(segments) == 2
+    assert [event for segment in segments for event in iter_segment(segment)] == [
+        '{"a":1}', '{"a":2}', '{"a":3}'
+    ]
@@ -0,0 +1,83 @@
+import pytest
+
+import instrumentation
+from instrumentation import count, dump_report, get_report, percentile, timed, timer
+
+
+@pytest.fixture(autouse=True)
+def reset():
+    instrumentation.reset()
+    yield
+    instrumentation.reset()
+
+
+def rows(kind):
+    return {(row['function'], row['label']): row for row in get_report() if row['kind'] == kind}
+
+
+def test_timer_counts_calls_and_errors_by_label():
+    @timer(name='dump', label_arg='output_file')
+    def dump(master, output_file, fail=False):
+        if fail:
+            raise ValueError(output_file)
+
+    dump('M', 'Apps')
+    dump('M', output_file='Apps')
+    with pytest.raises(ValueError):
+        dump('M', 'Hosts', fail=True)
+
+    timers = rows('timer')
+    assert (timers[('dump', 'Apps')]['count'], timers[('dump', 'Apps')]['errors']) == (2, 0)
+    assert (timers[('dump', 'Hosts')]['count'], timers[('dump', 'Hosts')]['errors']) == (1, 1)
+
+
+def test_generators_are_timed_over_their_iteration():
+    @timer(label=lambda n: f'n={n}')
+    def numbers(n):
+        yield from range(n)
+
+    assert list(numbers(3)) == [0, 1, 2]
+
+    [(name, label)] = rows('timer').keys()
+    assert name.endswith('numbers') and label == 'n=3'
+
+
+def test_counters_and_reset():
+    count('cache_hits', '1')
+    count('cache_hits', '1', 2)
+    with timed('query'):
+        pass
+
+    assert rows('counter')[('cache_hits', '1')]['count'] == 3
+    instrumentation.reset()
+    assert get_report() == []
+
+
+def test_percentiles_are_nearest_rank():
+    samples = list(range(1, 101))
+    assert [percentile(samples, p) for p in [50, 95, 99]] == [50, 95, 99]
+    assert percentile([], 50) == 0.0
+
+
+class Recorder():
+    def __init__(self):
+        self.dumps = []
+
+    def dump_data(self, master, output_file, data=[], constants={}):
+        self.dumps.append((master, output_file, data, constants))
+
+
+def test_the_report_is_written_like_a_dataset():
+    recorder = Recorder()
+    count('retries', 'sheets')
+    report = dump_report([recorder, None], 'Summary', 'MaturityRunStats', {'accounts': 2})
+
+    assert recorder.dumps == [('Summary', 'MaturityRunStats', report, {'accounts': 2})]
+    assert report == [{'kind': 'counter', 'function': 'retries', 'label': 'sheets', 'count': 1}]
+
+
+def test_an_empty_report_is_not_written():
+    recorder = Recorder()
+    dump_report([recorder], 'Summary', 'MaturityRunStats')
+
+    assert recorder.dumps == []
@@ -0,0 +1,118 @@
+import time
+
+import pytest
+
+import newrelic_query_api
+from newrelic_query_api import NewRelicQueryAPI, NewRelicQueryAPIPool, QueryCache
+from rate_limiter import TokenBucket
+
+RESULT = {
+    'results': [{'events': [{'appName': 'a', 'timestamp': 1000}]}],
+    'metadata': {
+        'contents': [{'function': 'events', 'limit': 100, 'order': {'column': 'timestamp'}}],
+        'beginTimeMillis': 0,
+        'endTimeMillis': 1000
+    }
+}
+
+
+class Response():
+    def __init__(self, status_code, result):
+        self.status_code = status_code
+        self.content = b'x' * 10
+        self.__result = result
+
+    def json(self):
+        return self.__result
+
+
+class FakeSession():
+    requests = []
+    statuses = []
+
+    def __init__(self):
+        self.headers = {}
+
+    def get(self, url, params={}):
+        FakeSession.requests.append((url, params['nrql']))
+        status = FakeSession.statuses.pop(0) if FakeSession.statuses else 200
+        return Response(status, RESULT)
+
+
+@pytest.fixture(autouse=True)
+def fake_session(monkeypatch):
+    FakeSession.requests, FakeSession.statuses = [], []
+    monkeypatch.setattr(newrelic_query_api.requests, 'Session', FakeSession)
+
+
+def test_cache_evicts_the_least_recently_used_entries():
+    cache = QueryCache(max_entries=2, max_bytes=100)
+    cache.set('a', 1, 10)
+    cache.set('b', 2, 10)
+    assert cache.get('a') == 1
+    cache.set('c', 3, 10)
+
+    assert [cache.get(k) for k in 'abc'] == [1, None, 3]
+
+
+def test_cache_is_bounded_by_bytes():
+    cache = QueryCache(max_entries=10, max_bytes=25)
+    cache.set('a', 1, 10)
+    cache.set('b', 2, 10)
+    cache.set('c', 3, 10)
+    cache.set('big', 4, 26)
+
+    assert [cache.get(k) for k in ['a', 'b', 'c', 'big']] == [None, 2, 3, None]
+
+
+def test_repeated_queries_are_answered_from_the_cache():
+    api = NewRelicQueryAPI(1, 'key')
+    assert api.query('SELECT * FROM {event}', {'event': 'Transaction'}) == RESULT
+    assert api.query('SELECT * FROM Transaction') == RESULT
+
+    assert FakeSession.requests == [
+        ('https://insights-api.newrelic.com/v1/accounts/1/query', 'SELECT * FROM Transaction')
+    ]
+
+
+def test_failed_queries_are_retried_and_not_cached():
+    FakeSession.statuses = [500, 500]
+    api = NewRelicQueryAPI(1, 'key', max_retries=2)
+    assert api.query('SELECT 1') == []
+    assert api.query('SELECT 1') == RESULT
+
+    assert len(FakeSession.requests) == 3
+
+
+def test_pool_shares_clients_and_cache():
+    pool = NewRelicQueryAPIPool()
+    clients = pool.get_vault({
+        'one': {'account_id': '1', 'query_api_key': 'key'},
+        'same': {'account_id': ' 1 ', 'query_api_key': 'key'},
+        'two': {'account_id': '2', 'query_api_key': 'key'}
+    })
+    assert clients['one'] is clients['same']
+    assert not clients['one'] is clients['two']
+
+    clients['one'].query('SELECT 1')
+    clients['same'].query('SELECT 1')
+    clients['two'].query('SELECT 1')
+    assert [nrql for _, nrql in FakeSession.requests] == ['SELECT 1', 'SELECT 1']
+
+
+def test_token_bucket_limits_the_rate():
+    bucket = TokenBucket(rate=50, capacity=1)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+
+    assert time.monotonic() - start >= 0.09
+
+
+def test_token_bucket_disabled_by_a_zero_rate():
+    bucket = TokenBucket()
+    start = time.monotonic()
+    for _ in range(1000):
+        bucket.acquire()
+
+    assert time.monotonic() - start < 0.5
@@ -0,0 +1,69 @@
+import pytest
+
+from pivot_engine import GRAND_TOTAL, PivotTable, StoragePivot
+
+
+ROWS = [
+    {'master': 'A', 'kind': 'x', 'apps': 3, 'apdex': 0.5, 'name': 'n1'},
+    {'master': 'A', 'kind': 'y', 'apps': 5, 'apdex': '', 'name': 'n1'},
+    {'master': 'B', 'kind': 'x', 'apps': 2, 'apdex': 0.9, 'name': 'n2'},
+    {'master': 'A', 'kind': 'x', 'apps': 4, 'apdex': 0.7, 'name': 'n3'}
+]
+
+
+def pivot(definition, rows=ROWS):
+    table = PivotTable(definition)
+    for row in rows:
+        table.add(row)
+    return table.result()
+
+
+def test_rows_and_aggregates():
+    result = pivot({
+        'rows': ['master'],
+        'values': {'apps': 'SUM', 'apdex': 'AVERAGE', 'name': 'COUNTUNIQUE'}
+    })
+    assert result == [
+        {'master': 'A', 'SUM of apps': 12, 'AVERAGE of apdex': pytest.approx(0.6), 'COUNTUNIQUE of name': 2},
+        {'master': 'B', 'SUM of apps': 2, 'AVERAGE of apdex': 0.9, 'COUNTUNIQUE of name': 1},
+        {'master': GRAND_TOTAL, 'SUM of apps': 14, 'AVERAGE of apdex': pytest.approx(0.7), 'COUNTUNIQUE of name': 3}
+    ]
+
+
+def test_columns_and_blank_cells():
+    result = pivot({'rows': ['master'], 'columns': ['kind'], 'values': {'apps': 'MAX'}})
+    assert result[1] == {'master': 'B', 'x - MAX of apps': 2, 'y - MAX of apps': ''}
+    assert result[2] == {'master': GRAND_TOTAL, 'x - MAX of apps': 4, 'y - MAX of apps': 5}
+
+
+def test_counts_skip_empty_and_non_numbers():
+    result = pivot({'values': {'apdex': 'COUNT', 'name': 'COUNTA', 'apps': 'MEDIAN'}})
+    assert result == [{'COUNT of apdex': 3, 'COUNTA of name': 4, 'MEDIAN of apps': 3.5}]
+
+
+def test_unsupported_function_aborts():
+    with pytest.raises(SystemExit):
+        PivotTable({'values': {'apps': 'MODE'}})
+
+
+class Recorder():
+    def __init__(self):
+        self.dumps = []
+
+    def dump_data(self, master, output_file, data=[], constants={}):
+        self.dumps.append((master, output_file, data))
+
+
+def test_storage_pivot_writes_one_table_per_master_and_dataset():
+    recorder = Recorder()
+    storage = StoragePivot({'Summary': {'rows': ['kind'], 'values': {'apps': 'SUM'}}}, [recorder, None])
+    storage.dump_batches('M', 'Summary', [({'master': 'A'}, ROWS[:2])])
+    storage.dump_data('M', 'Summary', ROWS[2:], {})
+    storage.dump_data('M', 'Other', ROWS)
+    storage.close()
+
+    assert recorder.dumps == [('M', 'SummaryPivot', [
+        {'kind': 'x', 'SUM of apps': 9},
+        {'kind': 'y', 'SUM of apps': 5},
+        {'kind': GRAND_TOTAL, 'SUM of apps': 14}
+    ])]
@@ -0,0 +1,37 @@
+from row_batches import count_rows, extend_columns, get_columns, iter_rows, iter_values
+
+
+BATCHES = [
+    ({'account_id': 1}, [{'a': 1, 'b': 2}, {'a': 3, 'c': 4}]),
+    ({'account_id': 2, 'master': 'm'}, [{'b': 5}]),
+    ({'account_id': 3}, [])
+]
+
+
+def test_get_columns_constants_first():
+    assert get_columns(BATCHES) == ['account_id', 'a', 'b']
+    assert get_columns([({'x': 1}, [])]) == []
+
+
+def test_extend_columns_appends_new_columns_in_order():
+    assert extend_columns(['b'], BATCHES) == ['b', 'account_id', 'a', 'c', 'master']
+
+
+def test_iter_values_aligns_rows_and_fills_missing():
+    columns = ['account_id', 'a', 'b', 'c', 'master']
+    assert list(iter_values(BATCHES, columns)) == [
+        [1, 1, 2, '', ''],
+        [1, 3, '', 4, ''],
+        [2, '', 5, '', 'm']
+    ]
+    assert list(iter_values(BATCHES, ['c'], None)) == [[None], [4], [None]]
+
+
+def test_iter_rows_rows_override_constants():
+    rows = list(iter_rows([({'a': 0, 'k': 1}, [{'a': 2}])]))
+    assert rows == [{'a': 2, 'k': 1}]
+    assert list(rows[0].keys()) == ['a', 'k']
+
+
+def test_count_rows():
+    assert count_rows(BATCHES) == 3
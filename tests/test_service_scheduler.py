@@ -0,0 +1,55 @@
+from datetime import datetime
+
+import pytest
+
+from service_scheduler import CronSchedule, Job, parse_cron_field
+
+
+def at(*args):
+    return datetime(*args).timestamp()
+
+
+def test_parse_cron_field():
+    assert parse_cron_field('*', 0, 5) == {0, 1, 2, 3, 4, 5}
+    assert parse_cron_field('*/15', 0, 59) == {0, 15, 30, 45}
+    assert parse_cron_field('1-3,7', 0, 10) == {1, 2, 3, 7}
+    assert parse_cron_field('5/20', 0, 59) == {5, 25, 45}
+    for field in ['60', '3-1', '*/0']:
+        with pytest.raises(ValueError):
+            parse_cron_field(field, 0, 59)
+
+
+def test_invalid_expressions_abort():
+    for expression in ['* * * *', '61 * * * *', 'a b c d e']:
+        with pytest.raises(SystemExit):
+            CronSchedule(expression)
+
+
+def test_next_time_daily():
+    schedule = CronSchedule('0 2 * * *')
+    assert schedule.next_time(at(2026, 1, 10, 1, 30)) == at(2026, 1, 10, 2, 0)
+    assert schedule.next_time(at(2026, 1, 10, 2, 0)) == at(2026, 1, 11, 2, 0)
+
+
+def test_next_time_aliases_and_month_rollover():
+    assert CronSchedule('@monthly').next_time(at(2026, 12, 15)) == at(2027, 1, 1)
+    assert CronSchedule('@hourly').next_time(at(2026, 3, 1, 10, 59)) == at(2026, 3, 1, 11, 0)
+
+
+def test_day_of_week_and_day_of_month():
+    # 2026-01-10 is a saturday, 7 is sunday like 0
+    assert CronSchedule('0 0 * * 7').next_time(at(2026, 1, 10)) == at(2026, 1, 11)
+    assert CronSchedule('0 0 * * 1-5').next_time(at(2026, 1, 10)) == at(2026, 1, 12)
+    # both set: either one matches
+    assert CronSchedule('0 0 15 * 1').next_time(at(2026, 1, 10)) == at(2026, 1, 12)
+
+
+def test_job_status_reports_its_progress():
+    job = Job('maturity', '@daily', lambda progress: None)
+    job.report(done=1, total=2)
+
+    status = job.status()
+    assert status['name'] == 'maturity'
+    assert status['state'] == 'scheduled'
+    assert status['next_run'] is not None
+    assert status['progress'] == {'done': 1, 'total': 2}
@@ -0,0 +1,42 @@
+from storage_buffer import StorageBuffer
+
+
+class BatchRecorder():
+    def __init__(self):
+        self.dumps = []
+
+    def dump_batches(self, master, output_file, batches=[]):
+        self.dumps.append((master, output_file, batches))
+
+
+def test_rows_are_coalesced_per_target_with_their_constants():
+    recorder = BatchRecorder()
+    storage = StorageBuffer(recorder, max_rows=3)
+    storage.dump_data('M', 'A', [{'i': 1}], {'account_id': 1})
+    storage.dump_data('M', 'B', [{'i': 2}], {'account_id': 1})
+    storage.dump_data('M', 'A', [{'i': 3}, {'i': 4}], {'account_id': 2})
+
+    assert recorder.dumps == [
+        ('M', 'A', [({'account_id': 1}, [{'i': 1}]), ({'account_id': 2}, [{'i': 3}, {'i': 4}])])
+    ]
+
+    storage.flush()
+    assert recorder.dumps[1:] == [('M', 'B', [({'account_id': 1}, [{'i': 2}])])]
+
+
+def test_expired_targets_are_flushed_on_the_next_dump():
+    recorder = BatchRecorder()
+    storage = StorageBuffer(recorder, max_seconds=0)
+    storage.dump_data('M', 'A', [{'i': 1}])
+    storage.dump_data('M', 'B', [])
+
+    assert recorder.dumps == [('M', 'A', [({}, [{'i': 1}])])]
+
+
+def test_empty_data_is_not_buffered():
+    recorder = BatchRecorder()
+    storage = StorageBuffer(recorder)
+    storage.dump_data('M', 'A', [])
+    storage.close()
+
+    assert recorder.dumps == []
@@ -0,0 +1,288 @@
+import re
+import threading
+import time
+
+import pytest
+
+import storage_google_drive
+from storage_google_drive import StorageGoogleDrive
+
+
+class Resource():
+    """ any chain of api resources, a method call returns a (method, arguments) request """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __getattr__(self, name):
+        def call(**kwargs):
+            if name == 'values' and not kwargs:
+                return Resource(f'{self.path}.values')
+            return (f'{self.path}.{name}', kwargs)
+        return call
+
+
+class FakeGoogle():
+    """ records the executed requests, folders and spreadsheets of an earlier run are found by name """
+
+    def __init__(self, found={}):
+        self.lock = threading.Lock()
+        self.calls = []
+        self.found = found # name -> (id, [(title, header, row count)] of a spreadsheet)
+        self.created = 0
+
+    def get_service(self, secret_file, name, version):
+        return self
+
+    def __getattr__(self, name):
+        return lambda: Resource(name)
+
+    def execute(self, request, secret_file, api):
+        method, kwargs = request
+        with self.lock:
+            self.calls.append((method, kwargs))
+            if method == 'files.list':
+                name = re.search(r"name = '([^']*)'", kwargs['q']).group(1)
+                found = self.found.get(name)
+                return {'files': [{'id': found[0]}] if found else []}
+            elif method == 'files.create':
+                self.created += 1
+                return {'id': f'id{self.created}'}
+            elif method == 'spreadsheets.get':
+                sheets = next(k[1] for k in self.found.values() if k[0] == kwargs['spreadsheetId'])
+                return {'sheets': [
+                    {'properties': {
+                        'sheetId': index,
+                        'title': title,
+                        'gridProperties': {'rowCount': rows, 'columnCount': len(header)}
+                    }} for index, (title, header, rows) in enumerate(sheets)
+                ]}
+            elif method == 'spreadsheets.values.get':
+                sheets = next(k[1] for k in self.found.values() if k[0] == kwargs['spreadsheetId'])
+                title = kwargs['range'].split('!')[0].strip("'")
+                return {'values': [next(k[1] for k in sheets if k[0] == title)]}
+            return {}
+
+    def methods(self):
+        return [method for method, _ in self.calls]
+
+    def requests(self, spreadsheet_id):
+        """ the batchUpdate requests of a spreadsheet, in order """
+
+        return [
+            request for method, kwargs in self.calls
+            if method == 'spreadsheets.batchUpdate' and kwargs['spreadsheetId'] == spreadsheet_id
+            for request in kwargs['body']['requests']
+        ]
+
+    def added_sheets(self, spreadsheet_id):
+        return [
+            request['addSheet']['properties']['title']
+            for request in self.requests(spreadsheet_id) if 'addSheet' in request
+        ]
+
+    def values(self, spreadsheet_id):
+        """ the (range, rows) written to a spreadsheet, in order """
+
+        return [
+            (data['range'], data['values']) for method, kwargs in self.calls
+            if method == 'spreadsheets.values.batchUpdate' and kwargs['spreadsheetId'] == spreadsheet_id
+            for data in kwargs['body']['data']
+        ]
+
+
+@pytest.fixture
+def google(monkeypatch):
+    google = FakeGoogle()
+    monkeypatch.setattr(storage_google_drive, 'get_service', google.get_service)
+    monkeypatch.setattr(storage_google_drive, 'execute', google.execute)
+    return google
+
+
+@pytest.fixture
+def secret_file(tmp_path):
+    secret_file = tmp_path / 'secret.json'
+    secret_file.write_text('{}')
+    return str(secret_file)
+
+
+def test_requests_are_coalesced_per_spreadsheet(google, secret_file):
+    storage = StorageGoogleDrive('accounts', 'output', secret_file, prefix='RUN')
+    storage.dump_data('M', 'Apps', [{'name': 'a'}], {'account_id': 1})
+    storage.dump_data('M', 'Apps', [{'name': 'b'}], {'account_id': 2})
+    storage.dump_data('M', 'Hosts', [{'host': 'h'}])
+    storage.close()
+
+    # folder and spreadsheet are created without a lookup in the new run folder
+    assert google.methods() == [
+        'files.list', 'files.create', 'files.create',
+        'spreadsheets.batchUpdate', 'spreadsheets.values.batchUpdate'
+    ]
+    assert google.added_sheets('id2') == ['Apps', 'Hosts']
+    assert google.values('id2') == [
+        ("'Apps'!A1", [['account_id', 'name'], [1, 'a'], [2, 'b']]),
+        ("'Hosts'!A1", [['host'], ['h']])
+    ]
+
+
+def test_a_large_queue_is_sent_before_the_flush(google, secret_file, monkeypatch):
+    monkeypatch.setattr(StorageGoogleDrive, 'MAX_BATCH_CELLS', 4)
+    storage = StorageGoogleDrive('accounts', 'output', secret_file, prefix='RUN')
+    storage.dump_data('M', 'Apps', [{'name': 'a', 'value': 1}])
+    storage.dump_data('M', 'Apps', [{'name': 'b', 'value': 2}, {'name': 'c', 'value': 3}])
+    storage.close()
+
+    assert google.methods().count('spreadsheets.values.batchUpdate') == 2
+    assert google.values('id2') == [
+        ("'Apps'!A1", [['name', 'value'], ['a', 1]]),
+        ("'Apps'!A3", [['b', 2], ['c', 3]])
+    ]
+
+
+def test_sheets_of_an_earlier_run_are_read_once(google, secret_file):
+    timestamp = time.localtime(0)
+    google.found = {
+        time.strftime('RUN_%Y-%m-%d_%H-%M', timestamp): ('folder', None),
+        'M': ('old', [('Sheet1', ['x'], 1000), ('Apps', ['account_id', 'name'], 3)])
+    }
+    storage = StorageGoogleDrive('accounts', 'output', secret_file, timestamp, prefix='RUN')
+    storage.dump_data('M', 'Apps', [{'name': 'c', 'extra': 1}], {'account_id': 3})
+    storage.dump_data('M', 'Apps', [{'name': 'd'}], {'account_id': 4})
+    storage.close()
+
+    reads = [(method, kwargs) for method, kwargs in google.calls if method.endswith('get')]
+    assert reads == [
+        ('spreadsheets.get', {
+            'spreadsheetId': 'old',
+            'fields': 'sheets.properties(sheetId,title,gridProperties(rowCount,columnCount))'
+        }),
+        ('spreadsheets.values.get', {
+            'spreadsheetId': 'old', 'range': "'Apps'!1:1", 'majorDimension': 'ROWS', 'fields': 'values'
+        })
+    ]
+    assert google.values('old') == [("'Apps'!A4", [[3, 'c', 1], [4, 'd', '']])]
+    [header] = [request['updateCells'] for request in google.requests('old') if 'updateCells' in request]
+    assert [value['userEnteredValue']['stringValue'] for value in header['rows'][0]['values']] == \
+        ['account_id', 'name', 'extra']
+
+
+def test_values_are_raw_and_numeric_columns_get_a_format(google, secret_file):
+    storage = StorageGoogleDrive('accounts', 'output', secret_file, prefix='RUN')
+    storage.dump_data('M', 'Apps', [
+        {'name': 'a', 'count': None, 'ok': True, 'tags': ['x'], 'ratio': float('nan')},
+        {'name': 'b', 'count': 2, 'ok': False, 'tags': {}, 'ratio': 0.5, 'datetime': 45000.5}
+    ])
+    storage.format_data()
+    storage.close()
+
+    [(method, kwargs)] = [k for k in google.calls if k[0] == 'spreadsheets.values.batchUpdate']
+    assert kwargs['body']['valueInputOption'] == 'RAW'
+    assert kwargs['body']['data'][0]['values'] == [
+        ['name', 'count', 'ok', 'tags', 'ratio', 'datetime'],
+        ['a', '', True, '["x"]', 'nan', ''],
+        ['b', 2, False, '{}', 0.5, 45000.5]
+    ]
+
+    formats = {
+        request['repeatCell']['range']['startColumnIndex']: request['repeatCell']['cell']['userEnteredFormat']['numberFormat']
+        for request in google.requests('id2')
+        if 'repeatCell' in request and request['repeatCell']['fields'] == 'userEnteredFormat.numberFormat'
+    }
+    assert formats == {
+        1: {'type': 'NUMBER', 'pattern': '#,##0'},
+        4: {'type': 'NUMBER', 'pattern': '#,##0.00'},
+        5: {'type': 'DATE'}
+    }
+
+
+def test_concurrent_senders_keep_the_order_of_each_spreadsheet(google, secret_file, monkeypatch):
+    monkeypatch.setattr(StorageGoogleDrive, 'MAX_BATCH_CELLS', 2)
+    storage = StorageGoogleDrive('accounts', 'output', secret_file, prefix='RUN', concurrency=3)
+    for index in range(10):
+        for master in ['A', 'B', 'C', 'D']:
+            storage.dump_data(master, 'Apps', [{'index': index}])
+    storage.close()
+
+    for spreadsheet_id in ['id2', 'id3', 'id4', 'id5']:
+        values = google.values(spreadsheet_id)
+        assert [cells for _, rows in values for cells in rows] == [['index']] + [[k] for k in range(10)]
+        starts = [sum(len(rows) for _, rows in values[:index]) + 1 for index in range(len(values))]
+        assert [cells_range for cells_range, _ in values] == [f"'Apps'!A{start}" for start in starts]
+        assert len(values) > 1
+
+
+@pytest.fixture
+def small_limits(monkeypatch):
+    # a new spreadsheet holds its default Sheet1 and 60 more cells
+    monkeypatch.setattr(StorageGoogleDrive, 'MAX_SHEET_CELLS', 40)
+    monkeypatch.setattr(StorageGoogleDrive, 'MAX_SPREADSHEET_CELLS', 1000 * 26 + 60)
+
+
+def test_datasets_roll_over_to_new_sheets_and_spreadsheets(google, secret_file, small_limits):
+    storage = StorageGoogleDrive('accounts', 'output', secret_file, prefix='RUN')
+    storage.dump_data('M', 'Data', [{'a': index, 'b': 'x'} for index in range(40)])
+    storage.format_data()
+    storage.close()
+
+    assert [kwargs['body']['name'] for method, kwargs in google.calls if method == 'files.create'][1:] == ['M', 'M_2']
+    assert google.added_sheets('id2') == ['Data', 'Data_2', 'Index']
+    assert google.added_sheets('id3') == ['Data_3']
+    assert [len(rows) for _, rows in google.values('id3')] == [1 + 12]
+
+    [(_, index)] = [k for k in google.values('id2') if k[0].startswith("'Index'")]
+    assert [row[:4] for row in index] == [
+        ['dataset', 'spreadsheet', 'sheet', 'rows'],
+        ['Data', 'M', 'Data', 19],
+        ['Data', 'M', 'Data_2', 9],
+        ['Data', 'M_2', 'Data_3', 12]
+    ]
+
+
+def test_new_datasets_start_in_the_last_spreadsheet(google, secret_file, small_limits):
+    storage = StorageGoogleDrive('accounts', 'output', secret_file, prefix='RUN')
+    storage.dump_data('M', 'Data', [{'a': index, 'b': 'x'} for index in range(40)])
+    storage.dump_data('M', 'Pivot', [{'a': 1, 'b': 2}])
+    storage.dump_data('M', 'Stats', [{'c': 1, 'd': 2}])
+    storage.close()
+
+    assert google.added_sheets('id2') == ['Data', 'Data_2']
+    assert google.added_sheets('id3') == ['Data_3', 'Pivot', 'Stats']
+
+
+def test_a_full_spreadsheet_gets_no_new_sheet(google, secret_file, small_limits):
+    storage = StorageGoogleDrive('accounts', 'output', secret_file, prefix='RUN')
+    # 19 rows fill the first sheet and 9 rows the spreadsheet
+    storage.dump_data('M', 'Data', [{'a': index, 'b': 'x'} for index in range(28)])
+    storage.dump_data('M', 'Stats', [{'c': 1, 'd': 2}])
+    storage.close()
+
+    assert google.added_sheets('id2') == ['Data', 'Data_2']
+    assert google.added_sheets('id3') == ['Stats']
+    assert google.values('id3') == [("'Stats'!A1", [['c', 'd'], [1, 2]])]
+
+
+def test_rows_wider_than_a_sheet_abort(google, secret_file, monkeypatch):
+    monkeypatch.setattr(StorageGoogleDrive, 'MAX_SHEET_CELLS', 3)
+    storage = StorageGoogleDrive('accounts', 'output', secret_file, prefix='RUN')
+
+    with pytest.raises(SystemExit):
+        storage.dump_data('M', 'Data', [{'a': 1, 'b': 2}])
+
+
+def test_format_data_reads_nothing_and_sends_one_batch_per_spreadsheet(google, secret_file):
+    storage = StorageGoogleDrive('accounts', 'output', secret_file, prefix='RUN')
+    storage.dump_data('M', 'Apps', [{'name': 'a', 'count': 1}])
+    storage.dump_data('N', 'Apps', [{'name': 'b', 'count': 2}])
+    storage.flush()
+    sent = len(google.calls)
+    storage.format_data({'Apps': {'rows': ['name'], 'columns': [], 'values': {'count': 'SUM'}}})
+    storage.close()
+
+    calls = google.calls[sent:]
+    assert [method for method, _ in calls] == ['spreadsheets.batchUpdate'] * 2
+    for _, kwargs in calls:
+        kinds = [next(iter(request)) for request in kwargs['body']['requests']]
+        # the pivot sheet is added, Sheet1 removed
+        assert kinds.count('addSheet') == 1
+        assert kinds.count('deleteSheet') == 1
+        assert {'updateCells', 'setBasicFilter', 'updateSheetProperties', 'autoResizeDimensions'} <= set(kinds)
@@ -0,0 +1,129 @@
+import csv
+import gzip
+import os
+
+import pytest
+
+import storage_local
+from storage_local import StorageLocal, merge_run_folders
+from storage_local_writers import CsvWriter, GzipCsvWriter, open_csv
+
+
+def read_csv(path):
+    with open_csv(str(path)) as f:
+        return list(csv.reader(f))
+
+
+@pytest.mark.parametrize('writer_class', [CsvWriter, GzipCsvWriter])
+def test_csv_header_is_rewritten_when_columns_grow(tmp_path, writer_class):
+    writer = writer_class(str(tmp_path / 'data'))
+    writer.write(['a', 'b'], [[1, 2]])
+    writer.suspend()
+    writer.resume()
+    writer.write(['a', 'b', 'c'], [[3, 4, 5]])
+    writer.close()
+
+    assert read_csv(writer.path) == [['a', 'b', 'c'], ['1', '2'], ['3', '4', '5']]
+    assert os.listdir(tmp_path) == [os.path.basename(writer.path)]
+
+
+def test_dumps_are_appended_under_one_header(tmp_path):
+    storage = StorageLocal('accounts.csv', str(tmp_path), prefix='RUN')
+    storage.dump_data('M', 'A', [{'name': 'a', 'value': 1}], {'account_id': 7})
+    storage.dump_data('M', 'A', [{'name': 'b', 'extra': 'x'}])
+    storage.close()
+
+    [run_folder] = os.listdir(tmp_path)
+    assert read_csv(tmp_path / run_folder / 'M_A.csv') == [
+        ['account_id', 'name', 'value', 'extra'], ['7', 'a', '1'], ['', 'b', '', 'x']
+    ]
+
+
+class TrackedCsvWriter(CsvWriter):
+    writers = []
+
+    def __init__(self, path):
+        super().__init__(path)
+        TrackedCsvWriter.writers.append(self)
+
+
+def test_open_files_are_capped_and_reopened(tmp_path, monkeypatch):
+    TrackedCsvWriter.writers = []
+    monkeypatch.setitem(storage_local.WRITERS, 'csv', TrackedCsvWriter)
+    storage = StorageLocal('accounts.csv', str(tmp_path), prefix='RUN', max_open_files=2)
+    for name in ['A', 'B', 'C', 'A', 'C']:
+        storage.dump_data('M', name, [{'name': name, 'value': 1}], {'account_id': 7})
+        assert sum(1 for writer in TrackedCsvWriter.writers if writer.is_open) <= 2
+    storage.dump_data('M', 'B', [{'name': 'B', 'extra': 'x'}])
+    storage.close()
+
+    [run_folder] = os.listdir(tmp_path)
+    folder = tmp_path / run_folder
+    assert sorted(os.listdir(folder)) == ['M_A.csv', 'M_B.csv', 'M_C.csv']
+    assert read_csv(folder / 'M_A.csv') == [
+        ['account_id', 'name', 'value'], ['7', 'A', '1'], ['7', 'A', '1']
+    ]
+    assert read_csv(folder / 'M_B.csv') == [
+        ['account_id', 'name', 'value', 'extra'], ['7', 'B', '1'], ['', 'B', '', 'x']
+    ]
+
+
+def test_gzip_csv_is_compressed(tmp_path):
+    writer = GzipCsvWriter(str(tmp_path / 'data'))
+    writer.write(['a'], [[1]])
+    writer.close()
+
+    with gzip.open(writer.path, 'rt') as f:
+        assert f.read().splitlines() == ['a', '1']
+
+
+def test_unsupported_format_aborts(tmp_path):
+    with pytest.raises(SystemExit):
+        StorageLocal('accounts.csv', str(tmp_path), output_format='xlsx')
+
+
+def test_get_accounts(tmp_path):
+    account_file = tmp_path / 'accounts.csv'
+    account_file.write_text('account_id,account_name\n1,one\n2,two\n')
+    storage = StorageLocal(str(account_file), str(tmp_path))
+    assert storage.get_accounts() == [
+        {'account_id': '1', 'account_name': 'one'},
+        {'account_id': '2', 'account_name': 'two'}
+    ]
+
+
+def test_merge_run_folders_unifies_headers(tmp_path):
+    shard1, shard2, merged = tmp_path / 'shard1', tmp_path / 'shard2', tmp_path / 'merged'
+    shard1.mkdir()
+    shard2.mkdir()
+    (shard1 / 'M_A.csv').write_text('a,b\n1,2\n')
+    (shard2 / 'M_A.csv').write_text('b,c\n3,4\n')
+    (shard2 / 'M_B.csv').write_text('x\n5\n')
+    (shard2 / 'M_A.parquet').write_bytes(b'skipped')
+
+    names = merge_run_folders([str(shard1), str(shard2)], str(merged))
+
+    assert sorted(names) == ['M_A.csv', 'M_B.csv']
+    assert read_csv(merged / 'M_A.csv') == [['a', 'b', 'c'], ['1', '2', ''], ['', '3', '4']]
+    assert read_csv(merged / 'M_B.csv') == [['x'], ['5']]
+
+
+def test_parquet_schema_evolves_without_losing_data(tmp_path):
+    pytest.importorskip('pyarrow')
+    import pyarrow.parquet as parquet
+    from storage_local_writers import ParquetWriter
+
+    writer = ParquetWriter(str(tmp_path / 'data'), row_group_size=2)
+    writer.write(['a', 'b'], [[1, 'x'], [2, 'y']])
+    writer.write(['a', 'b', 'c'], [[3, 'z', True], ['text', 'w', False]])
+    writer.close()
+
+    rows = []
+    for name in sorted(os.listdir(tmp_path), key=len):
+        rows.extend(parquet.read_table(str(tmp_path / name)).to_pylist())
+    assert rows == [
+        {'a': 1.0, 'b': 'x'},
+        {'a': 2.0, 'b': 'y'},
+        {'a': '3', 'b': 'z', 'c': True},
+        {'a': 'text', 'b': 'w', 'c': False}
+    ]
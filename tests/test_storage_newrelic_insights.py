@@ -0,0 +1,130 @@
+import gzip
+import json
+import threading
+import time
+
+import pytest
+
+import storage_newrelic_insights
+from insights_spool import InsightsSpool, iter_segment
+from storage_newrelic_insights import StorageNewRelicInsights
+
+
+class FakeSession():
+    """ records the posted events, answering with the queued statuses then 200 """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.payloads = []
+        self.statuses = []
+
+    def post(self, url, data=None, headers={}):
+        with self.lock:
+            self.payloads.append(json.loads(gzip.decompress(data)))
+            status = self.statuses.pop(0) if self.statuses else 200
+        return type('Response', (), {'status_code': status})()
+
+    @property
+    def events(self):
+        return [event for payload in self.payloads for event in payload]
+
+
+@pytest.fixture
+def session(monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(storage_newrelic_insights, 'get_session', lambda: session)
+    monkeypatch.setattr(StorageNewRelicInsights, 'BACKOFF_SECONDS', 0)
+    return session
+
+
+def test_events_carry_their_type_timestamp_and_constants(session):
+    storage = StorageNewRelicInsights('accounts.csv', 1, 'key', timestamp=100)
+    storage.dump_batches('M', 'Apps', [({'account_id': 7}, [{'name': 'a'}, {'name': 'b', 'account_id': 8}])])
+    storage.close()
+
+    assert session.events == [
+        {'eventType': 'Apps', 'timestamp': 100, 'account_id': 7, 'name': 'a'},
+        {'eventType': 'Apps', 'timestamp': 100, 'account_id': 8, 'name': 'b'}
+    ]
+
+
+def test_chunks_are_cut_by_raw_size(session, monkeypatch):
+    monkeypatch.setattr(StorageNewRelicInsights, 'MAX_RAW_BYTES', 200)
+    storage = StorageNewRelicInsights('accounts.csv', 1, 'key')
+    storage.dump_data('M', 'Apps', [{'index': index, 'padding': 'x' * 40} for index in range(10)])
+    storage.close()
+
+    assert len(session.payloads) > 1
+    assert all(len(json.dumps(payload)) <= 200 for payload in session.payloads)
+    assert sorted(event['index'] for event in session.events) == list(range(10))
+
+
+def test_chunks_over_the_payload_limit_are_split(session, monkeypatch):
+    monkeypatch.setattr(StorageNewRelicInsights, 'MAX_PAYLOAD_BYTES', 60)
+    storage = StorageNewRelicInsights('accounts.csv', 1, 'key')
+    storage.dump_data('M', 'Apps', [{'index': index} for index in range(8)])
+    storage.close()
+
+    assert len(session.payloads) > 1
+    assert sorted(event['index'] for event in session.events) == list(range(8))
+    assert storage.get_counts()['accepted'] == 8
+
+
+def test_an_expired_chunk_is_sent_without_a_flush(session):
+    storage = StorageNewRelicInsights('accounts.csv', 1, 'key', flush_seconds=0)
+    storage.dump_data('M', 'Apps', [{'name': 'a'}])
+
+    deadline = time.time() + 10
+    while not session.payloads and time.time() < deadline:
+        time.sleep(0.05)
+    assert session.events == [{'eventType': 'Apps', 'name': 'a'}]
+    storage.close()
+
+
+def test_failed_posts_are_retried_then_rejected(session):
+    session.statuses = [500, 500, 500]
+    storage = StorageNewRelicInsights('accounts.csv', 1, 'key', concurrency=1)
+    storage.dump_data('M', 'Apps', [{'name': 'a'}], max_retries=2)
+    storage.flush()
+    storage.dump_data('M', 'Apps', [{'name': 'b'}], max_retries=2)
+    storage.close()
+
+    assert storage.get_counts() == {'accepted': 1, 'rejected': 1, 'retried': 2, 'spooled': 0}
+    assert session.events[-1]['name'] == 'b'
+
+
+class FailingSpool():
+    def __init__(self, spool_folder):
+        pass
+
+    def append(self, events):
+        raise OSError('disk full')
+
+    def close(self):
+        pass
+
+
+def test_sender_errors_surface_on_close(session, monkeypatch, tmp_path):
+    monkeypatch.setattr(storage_newrelic_insights, 'InsightsSpool', FailingSpool)
+    session.statuses = [500]
+    storage = StorageNewRelicInsights('accounts.csv', 1, 'key', spool_folder=str(tmp_path))
+    storage.dump_data('M', 'Apps', [{'name': 'a'}], max_retries=1)
+
+    with pytest.raises(OSError):
+        storage.close()
+
+
+def test_rejected_events_are_spooled_and_replayed(session, tmp_path):
+    session.statuses = [500]
+    storage = StorageNewRelicInsights('accounts.csv', 1, 'key', spool_folder=str(tmp_path))
+    storage.dump_data('M', 'Apps', [{'name': 'a'}, {'name': 'b'}], max_retries=1)
+    storage.close()
+    assert storage.get_counts()['spooled'] == 2
+
+    [segment] = InsightsSpool(str(tmp_path)).get_segments()
+    replay = StorageNewRelicInsights(None, 1, 'key', spool_folder=str(tmp_path))
+    replay.dump_encoded(iter_segment(segment))
+    replay.close()
+
+    assert replay.get_counts() == {'accepted': 2, 'rejected': 0, 'retried': 0, 'spooled': 0}
+    assert session.payloads[-1] == [{'eventType': 'Apps', 'name': 'a'}, {'eventType': 'Apps', 'name': 'b'}]
@@ -0,0 +1,118 @@
+import threading
+
+import pytest
+
+from storage_buffer import StorageBuffer
+from storage_local import StorageLocal
+from storage_pipeline import StoragePipeline, close_storages
+
+TIMEOUT = 10
+
+
+def run_with_timeout(target):
+    """ runs target on a thread, fails instead of hanging, returns its exception """
+
+    errors = []
+
+    def run():
+        try:
+            target()
+        except BaseException as error:
+            errors.append(error)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(TIMEOUT)
+    assert not thread.is_alive(), 'the pipeline hung'
+    return errors[0] if errors else None
+
+
+class Recorder():
+    def __init__(self):
+        self.dumps = []
+        self.flushed = False
+        self.closed = False
+
+    def dump_data(self, master, output_file, data=[], constants={}):
+        self.dumps.append((master, output_file, data, constants))
+
+    def flush(self):
+        self.flushed = True
+
+    def close(self):
+        self.closed = True
+
+
+class Aborting():
+    def dump_data(self, master, output_file, data=[], constants={}):
+        exit()
+
+    def dump_batches(self, master, output_file, batches=[]):
+        exit()
+
+    def close(self):
+        exit()
+
+
+def test_batches_reach_every_storage_in_order():
+    recorders = [Recorder(), Recorder()]
+    pipeline = StoragePipeline(recorders + [None], queue_size=1)
+    for index in range(5):
+        pipeline.dump_data('M', 'D', [{'i': index}], {'k': 1})
+    pipeline.close()
+
+    for recorder in recorders:
+        assert [dump[2][0]['i'] for dump in recorder.dumps] == list(range(5))
+        assert recorder.flushed
+
+
+def test_abort_in_a_writer_does_not_block_a_full_queue():
+    pipeline = StoragePipeline([Aborting()], queue_size=2)
+
+    def dump_and_close():
+        for _ in range(10):
+            pipeline.dump_data('M', 'D', [{'a': 1}])
+        pipeline.close()
+
+    error = run_with_timeout(dump_and_close)
+    assert isinstance(error, SystemExit)
+
+
+def test_healthy_storages_keep_writing_after_one_fails():
+    recorder = Recorder()
+    pipeline = StoragePipeline([Aborting(), recorder], queue_size=1)
+
+    def dump_and_close():
+        for index in range(5):
+            pipeline.dump_data('M', 'D', [{'i': index}])
+        pipeline.close()
+
+    error = run_with_timeout(dump_and_close)
+    assert isinstance(error, SystemExit)
+    assert [dump[2][0]['i'] for dump in recorder.dumps] == list(range(5))
+
+
+def test_failing_final_flush_does_not_hang_close(tmp_path):
+    # the run folder cannot be created, the error shows up in the final flush
+    storage = StorageBuffer(StorageLocal('accounts.csv', str(tmp_path / 'missing' / 'output')))
+    pipeline = StoragePipeline([storage])
+    pipeline.dump_data('M', 'D', [{'a': 1}])
+
+    error = run_with_timeout(pipeline.close)
+    assert isinstance(error, FileNotFoundError)
+
+
+def test_abort_in_a_buffered_writer_is_not_reported_as_success():
+    pipeline = StoragePipeline([StorageBuffer(Aborting())])
+    pipeline.dump_data('M', 'D', [{'a': 1}])
+
+    with pytest.raises(SystemExit):
+        pipeline.close()
+
+
+def test_every_storage_is_closed_after_an_error():
+    recorders = [Recorder(), Recorder()]
+    with pytest.raises(SystemExit):
+        close_storages([recorders[0], Aborting(), None, recorders[1]])
+
+    assert all(recorder.closed for recorder in recorders)
@@ -0,0 +1,67 @@
+import sqlite3
+
+from storage_sqlite import StorageSQLite
+
+
+def select(database_file, statement):
+    connection = sqlite3.connect(database_file)
+    try:
+        return connection.execute(statement).fetchall()
+    finally:
+        connection.close()
+
+
+def columns(database_file, table):
+    return [row[1] for row in select(database_file, f'PRAGMA table_info("{table}")')]
+
+
+def test_rows_are_inserted_with_master_and_run_timestamp(tmp_path):
+    database_file = str(tmp_path / 'runs.sqlite')
+    storage = StorageSQLite('accounts.csv', database_file, timestamp=100)
+    storage.dump_batches('M', 'Apps', [({'account_id': 1}, [{'name': 'a', 'tags': ['x']}, {'name': 'b'}])])
+    storage.dump_data('M', 'Apps', [{'name': 'c', 'ok': True}])
+    storage.close()
+
+    assert columns(database_file, 'Apps') == ['master', 'run_timestamp', 'account_id', 'name', 'tags', 'ok']
+    assert select(database_file, 'SELECT * FROM Apps') == [
+        ('M', 100, 1, 'a', '["x"]', None),
+        ('M', 100, 1, 'b', None, None),
+        ('M', 100, None, 'c', None, 1)
+    ]
+    indexes = select(database_file, "SELECT name FROM sqlite_master WHERE type = 'index'")
+    assert indexes == [('idx_Apps_account_run',)]
+
+
+def test_tables_are_kept_across_runs(tmp_path):
+    database_file = str(tmp_path / 'runs.sqlite')
+    for timestamp in [100, 200]:
+        storage = StorageSQLite('accounts.csv', database_file, timestamp=timestamp)
+        storage.dump_data('M', 'Summary', [{'value': timestamp}])
+        storage.close()
+
+    assert select(database_file, 'SELECT run_timestamp, value FROM Summary') == [(100, 100), (200, 200)]
+
+
+def test_attributes_differing_by_case_get_their_own_columns(tmp_path):
+    database_file = str(tmp_path / 'runs.sqlite')
+    storage = StorageSQLite('accounts.csv', database_file, timestamp=100)
+    storage.dump_data('M', 'Events', [{'x': 1, 'X': 2}])
+    storage.close()
+
+    # a later run maps the attributes to the same columns, whatever their order
+    storage = StorageSQLite('accounts.csv', database_file, timestamp=200)
+    storage.dump_data('M', 'Events', [{'X': 4, 'x': 3}])
+    storage.close()
+
+    assert columns(database_file, 'Events') == ['master', 'run_timestamp', 'x', 'X_2']
+    assert select(database_file, 'SELECT x, X_2 FROM Events') == [(1, 2), (3, 4)]
+
+
+def test_attributes_named_like_reserved_columns_are_renamed(tmp_path):
+    database_file = str(tmp_path / 'runs.sqlite')
+    storage = StorageSQLite('accounts.csv', database_file, timestamp=100)
+    storage.dump_data('M', 'Apps', [{'master': 'x', 'Run_Timestamp': 5, 'name': 'a'}])
+    storage.close()
+
+    assert columns(database_file, 'Apps') == ['master', 'run_timestamp', 'master_2', 'Run_Timestamp_2', 'name']
+    assert select(database_file, 'SELECT * FROM Apps') == [('M', 100, 'x', 5, 'a')]
@@ -0,0 +1,79 @@
+import queue
+import threading
+
+import pytest
+
+from worker_threads import Worker, raise_errors, stop_workers
+
+
+def test_items_are_handled_in_order_then_on_stop():
+    handled = []
+    worker = Worker('test', handled.append, on_stop=lambda: handled.append('stop'))
+    for index in range(5):
+        worker.put(index)
+    worker.stop()
+
+    assert handled == [0, 1, 2, 3, 4, 'stop']
+    assert worker.errors == []
+
+
+def test_items_after_an_error_are_skipped_without_blocking_the_producer():
+    handled = []
+
+    def handler(item):
+        if item == 1:
+            exit()
+        handled.append(item)
+
+    worker = Worker('test', handler, queue_size=1, on_stop=lambda: handled.append('stop'))
+    for index in range(10):
+        worker.put(index)
+    worker.stop()
+
+    assert handled == [0]
+    assert isinstance(worker.errors[0], SystemExit)
+    with pytest.raises(SystemExit):
+        raise_errors([worker])
+
+
+def test_workers_can_keep_going_after_an_error():
+    handled = []
+
+    def handler(item):
+        if item == 1:
+            raise ValueError(item)
+        handled.append(item)
+
+    worker = Worker('test', handler, stop_on_error=False)
+    for index in range(3):
+        worker.put(index)
+    worker.join()
+    worker.stop()
+
+    assert handled == [0, 2]
+    assert [type(error) for error in worker.errors] == [ValueError]
+
+
+def test_on_idle_is_called_while_no_item_shows_up():
+    idle = threading.Event()
+    worker = Worker('test', lambda item: None, on_idle=idle.set, idle_seconds=0.01)
+
+    assert idle.wait(5)
+    worker.stop()
+
+
+def test_workers_sharing_a_queue_are_all_stopped():
+    items = queue.Queue()
+    handled = []
+    lock = threading.Lock()
+
+    def handler(item):
+        with lock:
+            handled.append(item)
+
+    workers = [Worker(f'test-{index}', handler, items=items) for index in range(3)]
+    for index in range(20):
+        items.put(index)
+    stop_workers(workers)
+
+    assert sorted(handled) == list(range(20))
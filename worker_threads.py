@@ -0,0 +1,108 @@
+import queue
+import threading
+
+
+class Worker():
+    """ daemon thread calling handler(item) for every item of a bounded queue
+
+        errors are recorded, not raised, and the queue keeps draining so a
+        producer never blocks forever on a dead thread; with stop_on_error
+        the items after an error are skipped; on_idle is called when no item
+        shows up for idle_seconds and on_stop once the queue is stopped;
+        several workers can drain the same queue
+    """
+
+    QUEUE_SIZE = 32
+    __STOP = object()
+
+    def __init__(self, name, handler, items=None, queue_size=QUEUE_SIZE, stop_on_error=True,
+        on_stop=None, on_idle=None, idle_seconds=1):
+        """ init """
+
+        self.items = items if items is not None else queue.Queue(maxsize=queue_size)
+        self.errors = []
+        self.__handler = handler
+        self.__stop_on_error = stop_on_error
+        self.__on_stop = on_stop
+        self.__on_idle = on_idle
+        self.__idle_seconds = idle_seconds
+        self.__thread = threading.Thread(target=self.__run, name=name, daemon=True)
+        self.__thread.start()
+
+    def __call(self, function, *args):
+        """ calls a function of the loop, recording its error """
+
+        try:
+            function(*args)
+        except BaseException as error:
+            # abort() raises SystemExit, which would end the thread silently
+            self.errors.append(error)
+
+    def __run(self):
+        """ thread loop """
+
+        while True:
+            try:
+                item = self.items.get(timeout=self.__idle_seconds if self.__on_idle else None)
+            except queue.Empty:
+                if not (self.errors and self.__stop_on_error):
+                    self.__call(self.__on_idle)
+                continue
+
+            stop = item is Worker.__STOP
+            try:
+                if self.errors and self.__stop_on_error:
+                    pass
+                elif stop:
+                    if self.__on_stop:
+                        self.__call(self.__on_stop)
+                else:
+                    self.__call(self.__handler, item)
+            finally:
+                self.items.task_done()
+
+            # nothing is queued after STOP, even when on_stop failed
+            if stop:
+                return
+
+    def put(self, item):
+        """ queues an item, blocks while the queue is full """
+
+        self.items.put(item)
+
+    def join(self):
+        """ waits until every queued item is handled """
+
+        self.items.join()
+
+    def request_stop(self):
+        """ queues the end of the thread, after the items queued so far """
+
+        self.items.put(Worker.__STOP)
+
+    def wait(self):
+        """ waits for the end of the thread """
+
+        self.__thread.join()
+
+    def stop(self):
+        """ handles the queued items, calls on_stop and ends the thread """
+
+        stop_workers([self])
+
+
+def stop_workers(workers):
+    """ stops workers, those sharing a queue included """
+
+    for worker in workers:
+        worker.request_stop()
+    for worker in workers:
+        worker.wait()
+
+
+def raise_errors(workers):
+    """ surface the first worker error in the caller thread """
+
+    for worker in workers:
+        if worker.errors:
+            raise worker.errors[0]